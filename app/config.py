@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from pathlib import Path
+from typing import List
 
 class Settings(BaseSettings):
     database_username: str
@@ -14,6 +15,84 @@ class Settings(BaseSettings):
     API_SECRET: str
     REDIRECT_URI: str
 
+    # max rows per INSERT ... ON CONFLICT statement in holdings upload
+    holdings_upsert_batch_size: int = 1000
+    # rows parsed, validated and COPY'd per chunk in the streaming upload
+    holdings_stream_chunk_size: int = 5000
+    # longest line accepted in the streaming upload, longer ones fail the upload with a 413
+    holdings_stream_max_line_bytes: int = 64 * 1024
+    # how often each worker checks the stored instruments version for changes
+    instrument_registry_refresh_seconds: int = 60
+    # allocation report cache (per worker), keyed by user + portfolio version
+    report_cache_max_entries: int = 1024
+    report_cache_ttl_seconds: int = 300
+    # excel reports are written off the event loop: "thread" or "process" pool
+    report_executor_kind: str = "thread"
+    report_executor_workers: int = 2
+    # background report jobs (per worker)
+    report_jobs_max_concurrent: int = 2
+    report_jobs_max_queued: int = 100
+    report_jobs_stale_seconds: int = 900  # lease of a queued/running job, past it the job counts as abandoned
+    report_expiry_minutes: int = 5
+    report_reuse_min_remaining_seconds: int = 30  # only reuse a report file that stays live at least this long
+    # users allowed on /analytics endpoints, e.g. ADMIN_USER_IDS='[1, 2]'
+    admin_user_ids: List[int] = []
+    # holdings rows per server-side cursor fetch in firm-wide analytics
+    analytics_chunk_size: int = 50000
+    # market prices for basis=market reports: "none", "file" (offline stand-in) or "upstox"
+    price_provider: str = "none"
+    price_file_path: str = "data/prices.json"
+    price_cache_ttl_seconds: int = 60
+    price_batch_size: int = 500
+    price_max_concurrency: int = 4
+    upstox_access_token: str = ""
+    # authenticated principal cache (per worker), saves the users lookup on every request
+    auth_cache_max_entries: int = 10000
+    auth_cache_ttl_seconds: int = 60
+    # bcrypt cost for new hashes, older hashes are upgraded on login
+    bcrypt_rounds: int = 12
+    # password hashing pool (per worker), requests beyond workers + max_queued get a 503
+    password_hash_workers: int = 2
+    password_hash_max_queued: int = 32
+    # expired report sweeper: rows claimed per batch, batches per sweep, threads unlinking files
+    cleanup_batch_size: int = 500
+    cleanup_max_batches_per_sweep: int = 20
+    cleanup_unlink_workers: int = 4
+    # sweep interval backs off towards max while there is no backlog, drops to min while there is
+    cleanup_min_interval_seconds: int = 5
+    cleanup_max_interval_seconds: int = 60
+    # requests slower than this are logged with their per-query breakdown
+    slow_request_ms: int = 1000
+    # statements kept per request for that breakdown (counts and totals are always exact)
+    slow_request_max_queries: int = 500
+    # request connection pool (per worker)
+    db_pool_size: int = 10
+    db_max_overflow: int = 10
+    db_pool_timeout_seconds: int = 30
+    db_pool_recycle_seconds: int = 1800
+    db_pool_pre_ping: bool = True
+    # prepared statements cached per connection, 0 behind pgbouncer in transaction mode
+    db_statement_cache_size: int = 100
+    # separate pool for background tasks, 0 shares the request pool; raised to at least
+    # report_jobs_max_concurrent + 4 (see database.BACKGROUND_CONNECTIONS)
+    db_background_pool_size: int = 6
+    # holdings listing: largest page for keyset pagination, rows fetched per round trip when streaming
+    holdings_page_max_limit: int = 1000
+    holdings_list_chunk_size: int = 2000
+    # most snapshots returned by one time-series request
+    snapshot_series_max: int = 1000
+    rebalance_tolerance_pp: float = 2.0  # default drift band, percentage points
+    # nightly batch reports: pool processes (0 = cpu count), users per pool task, tasks in flight
+    # per process (bounds memory: the scan pauses while that many are pending), file lifetime
+    nightly_report_workers: int = 0
+    nightly_users_per_task: int = 50
+    nightly_tasks_per_worker: int = 2
+    nightly_report_expiry_hours: int = 24
+    # direct report export: rows per CSV chunk / parquet row group, bytes per streamed chunk,
+    # chunks buffered between the writer thread and the response before the writer waits
+    report_export_chunk_rows: int = 5000
+    report_export_chunk_bytes: int = 65536
+    report_export_queue_chunks: int = 8
 
 
     class Config:
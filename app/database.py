@@ -1,27 +1,158 @@
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy import text
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from .config import settings
+from .metrics import instrument_engine, register_collector, pool_wait
 from typing import AsyncGenerator
 from urllib.parse import quote_plus
 import ssl
+import time
 
 ssl_context = ssl.create_default_context(cafile=None)
 
 SQLALCHEMY_DATABASE_URL = f'postgresql+asyncpg://{settings.database_username}:{quote_plus(settings.database_password)}@{settings.database_hostname}:{settings.database_port}/{settings.database_name}'
 
 
-print(SQLALCHEMY_DATABASE_URL)
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waited for a connection (incl. connecting)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+            pool_wait.observe(waited, self.logging_name or "default")
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "checked_in": self.checkedin(),
+            "overflow": max(0, self.overflow()),
+            "max_overflow": self._max_overflow,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_ms_avg": round(self.wait_seconds_total * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+            "wait_ms_max": round(self.wait_seconds_max * 1000, 3),
+        }
+
+
+def make_engine(name: str, pool_size: int, max_overflow: int):
+    engine = create_async_engine(
+        SQLALCHEMY_DATABASE_URL,
+        echo=False,
+        poolclass=InstrumentedQueuePool,
+        pool_logging_name=name,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=settings.db_pool_timeout_seconds,
+        pool_recycle=settings.db_pool_recycle_seconds,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        connect_args={
+            "ssl": ssl_context,
+            # asyncpg's own cache, used by raw driver calls (COPY staging etc.)
+            "statement_cache_size": settings.db_statement_cache_size,
+            # SQLAlchemy's asyncpg dialect keeps its own prepared statement cache per connection
+            "prepared_statement_cache_size": settings.db_statement_cache_size,
+        },
+    )
+    instrument_engine(engine)
+    return engine
+
 
 # Create the async engine
-engine = create_async_engine(SQLALCHEMY_DATABASE_URL, echo=False,connect_args ={"ssl":ssl_context})
+engine = make_engine("default", settings.db_pool_size, settings.db_max_overflow)
 
 # Create the async session maker
 AsyncSessionLocal = async_sessionmaker(bind = engine, expire_on_commit=False, class_=AsyncSession)
 
+# background tasks (cleanup, registry refresh, report jobs) get their own small pool when
+# configured, so they can never hold the connections request handlers are waiting for
+# connections background work can hold at once: one per running report job, plus the cleanup
+# sweep, the registry refresh and the nightly run's two sessions (writes + holdings scan)
+BACKGROUND_CONNECTIONS = settings.report_jobs_max_concurrent + 4
+
+if settings.db_background_pool_size > 0:
+    # never smaller than what those consumers need, or they queue on each other until pool timeout
+    background_pool_size = max(settings.db_background_pool_size, BACKGROUND_CONNECTIONS)
+    if background_pool_size > settings.db_background_pool_size:
+        print(f"db_background_pool_size={settings.db_background_pool_size} is below the {BACKGROUND_CONNECTIONS} "
+              f"connections background work can hold, using {background_pool_size}")
+    background_engine = make_engine("background", background_pool_size, 0)
+    BackgroundSessionLocal = async_sessionmaker(bind = background_engine, expire_on_commit=False, class_=AsyncSession)
+else:
+    background_engine = engine
+    BackgroundSessionLocal = AsyncSessionLocal
+
+
+def pool_stats() -> dict:
+    stats = {"default": engine.pool.stats()}
+    if background_engine is not engine:
+        stats["background"] = background_engine.pool.stats()
+    return stats
+
+
+def _pool_metrics():
+    lines = []
+    for name, gauge in (("checked_out", "db_pool_checked_out"), ("overflow", "db_pool_overflow"), ("size", "db_pool_size")):
+        lines.append(f"# TYPE {gauge} gauge")
+        for pool_name, stats in pool_stats().items():
+            lines.append(f'{gauge}{{pool="{pool_name}"}} {stats[name]}')
+    lines.append("# TYPE db_pool_timeouts_total counter")
+    for pool_name, stats in pool_stats().items():
+        lines.append(f'db_pool_timeouts_total{{pool="{pool_name}"}} {stats["timeouts"]}')
+    return lines
+
+register_collector(_pool_metrics)
+
+
+async def dispose_engines():
+    await engine.dispose()
+    if background_engine is not engine:
+        await background_engine.dispose()
+
 # Base class for models
 Base = declarative_base()
 
+# columns added to tables that may predate them: create_all never alters an existing table,
+# so these are applied (idempotently) on startup before the indexes that depend on them
+ADDED_COLUMNS = [
+    "ALTER TABLE reports ADD COLUMN IF NOT EXISTS status VARCHAR NOT NULL DEFAULT 'done'",
+    "ALTER TABLE reports ADD COLUMN IF NOT EXISTS portfolio_version INTEGER",
+    "ALTER TABLE reports ADD COLUMN IF NOT EXISTS error VARCHAR",
+    "ALTER TABLE reports ADD COLUMN IF NOT EXISTS created_at TIMESTAMP WITHOUT TIME ZONE",
+    "ALTER TABLE reports ADD COLUMN IF NOT EXISTS started_at TIMESTAMP WITHOUT TIME ZONE",
+    "ALTER TABLE reports ADD COLUMN IF NOT EXISTS finished_at TIMESTAMP WITHOUT TIME ZONE",
+    "ALTER TABLE reports ADD COLUMN IF NOT EXISTS content_hash VARCHAR",
+]
+
+def add_missing_columns(sync_conn):
+    for ddl in ADDED_COLUMNS:
+        sync_conn.execute(text(ddl))
+
+def create_missing_indexes(sync_conn):
+    """create_all skips tables that already exist, so indexes added to a model later are created here."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
 # Dependency to get DB session
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     async with AsyncSessionLocal() as session:
-        yield session
\ No newline at end of file
+        yield session
@@ -1,13 +1,21 @@
+import time
+_import_started = time.perf_counter()  # startup breakdown includes app import time
+
 from fastapi import FastAPI, Response, status, HTTPException, Depends
 from .config import settings
-from .import models
-from . database import engine
-from . routers import user, auth, holdings, reports
+from .import models, utils
+from . database import engine, dispose_engines
+from . routers import user, auth, holdings, reports, analytics, snapshots, rebalance, metrics as metrics_router
+from .metrics import MetricsMiddleware
 import asyncio
-from .database import Base,AsyncSessionLocal
+from .database import Base,AsyncSessionLocal, add_missing_columns, create_missing_indexes
 from .services import set_instruments_metadata
 from sqlalchemy.ext.asyncio import AsyncSession
 from .tasks.cleanup import register_cleanup
+from .tasks.instrument_refresh import register_instrument_refresh
+from .services.instrument_registry import instrument_registry
+from .services.snapshots import load_sectors
+from .services import sector_allocations, excel_writer, report_export, report_jobs, prices
 
 
 CLIENT_ID = settings.API_KEY
@@ -15,23 +23,64 @@ CLIENT_SECRET = settings.API_SECRET
 UPSTOX_REDIRECT_URI = settings.REDIRECT_URI
 
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
+app.state.startup_timings = {"imports_ms": round((time.perf_counter() - _import_started) * 1000, 2)}
 
 @app.on_event("startup")
 async def init_models():
+    timings = app.state.startup_timings
+    phase_started = startup_started = time.perf_counter()
+
+    def end_phase(name):
+        nonlocal phase_started
+        now = time.perf_counter()
+        timings[f"{name}_ms"] = round((now - phase_started) * 1000, 2)
+        phase_started = now
+
     async with engine.begin() as conn:
         # print("✅ Connected. Creating tables:", Base.metadata.tables.keys())
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_columns)
+        await conn.run_sync(create_missing_indexes)
+    end_phase("create_tables")
     
     async with AsyncSessionLocal() as session:
         await set_instruments_metadata.set_instruments_metadata(session)
+        end_phase("instruments_metadata")
+        await instrument_registry.load(session)
+        end_phase("instrument_registry")
+        await load_sectors(session)
+        end_phase("sectors")
+        await sector_allocations.ensure_built(session)
+        end_phase("sector_aggregates")
+        abandoned = await report_jobs.fail_abandoned_jobs(session)
+        if abandoned:
+            print(f"Marked {abandoned} abandoned report jobs as failed")
+
+    timings["startup_total_ms"] = round((time.perf_counter() - startup_started) * 1000, 2)
+    print("⏱ Startup breakdown: " + ", ".join(f"{name}={ms}" for name, ms in timings.items()))
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    await report_jobs.report_scheduler.shutdown()
+    excel_writer.shutdown_executor()
+    report_export.shutdown_export_executor()
+    utils.password_hasher.shutdown()
+    await prices.close_price_service()
+    await dispose_engines()
 
 register_cleanup(app)
+register_instrument_refresh(app)
 
 
 app.include_router(user.router)       
 app.include_router(auth.router)
 app.include_router(holdings.router)
 app.include_router(reports.router)
+app.include_router(analytics.router)
+app.include_router(snapshots.router)
+app.include_router(rebalance.router)
+app.include_router(metrics_router.router)
 
 
 
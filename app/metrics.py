@@ -0,0 +1,227 @@
+import contextvars
+import logging
+import re
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy import event
+from .config import settings
+
+logger = logging.getLogger("app.metrics")
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, rendered in the Prometheus text format."""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...], buckets: Tuple[float, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series: Dict[tuple, list] = {}  # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(self._series.items()):
+            labels = _labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{_braces(labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_braces(labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...], kind: str = "counter"):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.kind = kind
+        self._values: Dict[tuple, float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, *label_values):
+        self._values[label_values] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for label_values, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_braces(_labels(self.labels, label_values))} {value}")
+        return lines
+
+
+def _labels(names, values) -> str:
+    return ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+
+
+def _braces(labels: str) -> str:
+    return f"{{{labels}}}" if labels else ""
+
+
+request_duration = Histogram("http_request_duration_seconds", "Request latency by route.", ("method", "route"), REQUEST_BUCKETS)
+requests_total = Counter("http_requests_total", "Requests by route and status.", ("method", "route", "status"))
+requests_in_flight = Counter("http_requests_in_flight", "Requests currently being handled.", (), kind="gauge")
+request_db_queries = Counter("http_request_db_queries_total", "Queries issued while handling requests, by route.", ("method", "route"))
+request_db_seconds = Counter("http_request_db_seconds_total", "Query time spent while handling requests, by route.", ("method", "route"))
+query_duration = Histogram("db_query_duration_seconds", "Duration of every cursor execute (requests and background tasks).", (), QUERY_BUCKETS)
+slow_requests = Counter("http_slow_requests_total", "Requests slower than slow_request_ms.", ("method", "route"))
+pool_wait = Histogram("db_pool_wait_seconds", "Time spent waiting for a pooled connection (incl. connecting).", ("pool",), QUERY_BUCKETS)
+
+METRICS = [request_duration, requests_total, requests_in_flight, request_db_queries, request_db_seconds, query_duration, slow_requests, pool_wait]
+
+# callables returning extra exposition lines, evaluated at scrape time (gauges owned elsewhere)
+_collectors: List[Callable[[], List[str]]] = []
+
+
+def register_collector(collector: Callable[[], List[str]]):
+    _collectors.append(collector)
+
+
+class RequestQueries:
+    """Queries run on behalf of the current request, collected by the cursor hooks."""
+    __slots__ = ("count", "seconds", "statements")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: List[Tuple[str, float]] = []
+
+    def add(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        if len(self.statements) < settings.slow_request_max_queries:
+            self.statements.append((statement, seconds))
+
+
+_current_queries: contextvars.ContextVar[Optional[RequestQueries]] = contextvars.ContextVar("current_queries", default=None)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+    if context is not None:
+        context._query_timed = True
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    elapsed = time.perf_counter() - started
+    query_duration.observe(elapsed)
+    queries = _current_queries.get()
+    if queries is not None:
+        queries.add(statement, elapsed)
+
+
+def _handle_error(exception_context):
+    # a failed execute never reaches after_cursor_execute: pop its start time, or the stack
+    # keeps growing and every later query on this pooled connection is timed from it.
+    # Errors raised before the cursor execute (compile, connect) pushed nothing.
+    conn, context = exception_context.connection, exception_context.execution_context
+    if conn is None or not getattr(context, "_query_timed", False):
+        return
+    context._query_timed = False
+    started = conn.info["query_started"].pop()
+    elapsed = time.perf_counter() - started
+    query_duration.observe(elapsed)
+    queries = _current_queries.get()
+    if queries is not None:
+        queries.add(exception_context.statement or "", elapsed)
+
+
+def instrument_engine(engine):
+    """Attach the query timing hooks to an (async) engine."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+
+
+def query_breakdown(queries: RequestQueries, limit: int = 10) -> List[str]:
+    """Statements grouped by text, most time first; a high count on one statement is an N+1."""
+    grouped: Dict[str, list] = {}
+    for statement, seconds in queries.statements:
+        key = _WHITESPACE.sub(" ", statement).strip()[:200]
+        entry = grouped.setdefault(key, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+    ordered = sorted(grouped.items(), key=lambda item: -item[1][1])
+    return [f"  {count:>5}x {seconds * 1000:9.2f}ms  {statement}" for statement, (count, seconds) in ordered[:limit]]
+
+
+def _route_template(scope) -> str:
+    route = scope.get("route")
+    # the template, not the raw path, so labels stay low-cardinality
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware (no BaseHTTPMiddleware, so streaming responses and contextvars
+    behave): per-route latency, status counts, in-flight gauge, and the queries each
+    request ran. Requests slower than settings.slow_request_ms are logged with a
+    per-statement breakdown.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        queries = RequestQueries()
+        token = _current_queries.set(queries)
+        requests_in_flight.inc(1)
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            requests_in_flight.inc(-1)
+            _current_queries.reset(token)
+
+            method, route = scope["method"], _route_template(scope)
+            request_duration.observe(elapsed, method, route)
+            requests_total.inc(1, method, route, status_code)
+            request_db_queries.inc(queries.count, method, route)
+            request_db_seconds.inc(queries.seconds, method, route)
+
+            if elapsed * 1000 >= settings.slow_request_ms:
+                slow_requests.inc(1, method, route)
+                logger.warning(
+                    "Slow request %s %s -> %s in %.2fms, %d queries in %.2fms%s",
+                    method, scope["path"], status_code, elapsed * 1000, queries.count, queries.seconds * 1000,
+                    "".join("\n" + line for line in query_breakdown(queries)),
+                )
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
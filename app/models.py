@@ -1,5 +1,5 @@
 from .database import Base
-from sqlalchemy import Column, Integer, Boolean, String, Float, ForeignKey,PrimaryKeyConstraint, DateTime, func
+from sqlalchemy import Column, Integer, Boolean, String, Float, ForeignKey,PrimaryKeyConstraint, DateTime, func, Index, LargeBinary
 
 from sqlalchemy.sql.expression import null, text
 from sqlalchemy.sql.sqltypes import TIMESTAMP
@@ -57,6 +57,28 @@ class Instruments(Base):
 
     holdings = relationship("Holdings",back_populates="instrument")
 
+class SectorAllocation(Base):
+    # per-user sector (industry_new_name) totals, kept in sync by the holdings upload/delete paths
+    __tablename__ = "user_sector_allocations"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    sector = Column(String, nullable=False)
+    invested_amount = Column(Float, nullable=False)
+    position_count = Column(Integer, nullable=False)
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=text('now()'), onupdate=text('now()'))
+
+    __table_args__ = (
+        PrimaryKeyConstraint("user_id", "sector"),
+    )
+
+class PortfolioVersion(Base):
+    # bumped on every holdings mutation, drives report caching / ETags
+    __tablename__ = "portfolio_versions"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    version = Column(Integer, nullable=False, server_default=text('0'))
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=text('now()'), onupdate=text('now()'))
+
 class Report(Base):
     __tablename__ = "reports"
 
@@ -66,4 +88,84 @@ class Report(Base):
     expires_at = Column(DateTime, nullable=False)  # expiration time
     downloaded = Column(Boolean, default=False)
     is_deleted = Column(Boolean,default=False)  # for soft-delete tracking
-    deleted_at = Column(DateTime, nullable=True) # for soft-delete tracking
\ No newline at end of file
+    deleted_at = Column(DateTime, nullable=True) # for soft-delete tracking
+
+    # report job tracking (reports created synchronously are inserted as "done")
+    status = Column(String, nullable=False, default="done", server_default="done")  # queued | running | done | failed
+    portfolio_version = Column(Integer, nullable=True)  # holdings version the report was built from
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    # hash of the report inputs; rows with the same hash may share one file_path
+    content_hash = Column(String, nullable=True)
+
+    __table_args__ = (
+        # at most one active job per user and portfolio version, duplicates are coalesced
+        Index(
+            "uq_reports_active_job", "user_id", "portfolio_version",
+            unique=True,
+            postgresql_where=text("status IN ('queued', 'running')"),
+        ),
+        # expired-report sweeps: WHERE is_deleted = false AND expires_at < now()
+        Index("ix_reports_is_deleted_expires_at", "is_deleted", "expires_at"),
+        # reusable artifact lookups, and reference counts of a file before cleanup unlinks it
+        Index("ix_reports_content_hash", "content_hash", postgresql_where=text("content_hash IS NOT NULL AND is_deleted = false")),
+        Index("ix_reports_file_path", "file_path"),
+    )
+
+class MetadataVersion(Base):
+    __tablename__ = "metadata_versions"
+
+    name = Column(String, primary_key=True)  # e.g. "instruments"
+    version = Column(Integer, nullable=False, server_default=text('0'))  # bumped on every change
+    fingerprint = Column(String, nullable=True)  # sha256 of the source file last applied
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=text('now()'), onupdate=text('now()'))
+
+class Sector(Base):
+    # stable small ids for sector (industry_new_name) labels, used by packed snapshot vectors
+    __tablename__ = "sectors"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False, unique=True)
+
+class AllocationSnapshot(Base):
+    # per-user sector weights at a point in time, stored columnar: sector ids and weights
+    # as packed little-endian int32 / float32 arrays of equal length, sorted by sector id
+    __tablename__ = "allocation_snapshots"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    portfolio_version = Column(Integer, nullable=False)
+    instrument_version = Column(Integer, nullable=False)
+    total_invested = Column(Float, nullable=False)
+    sector_count = Column(Integer, nullable=False)
+    sector_ids = Column(LargeBinary, nullable=False)
+    weights = Column(LargeBinary, nullable=False)
+    content_hash = Column(String, nullable=False)  # sha1 of ids + weights, skips writes when nothing moved
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+
+    __table_args__ = (
+        # one snapshot per holdings/instruments version, concurrent report runs can't double write
+        Index("uq_allocation_snapshots_version", "user_id", "portfolio_version", "instrument_version", unique=True),
+        Index("ix_allocation_snapshots_user_created", "user_id", "created_at"),
+    )
+
+class ReportRun(Base):
+    # one batch report run over all users (python -m app.services.nightly_reports), resumable from the checkpoint
+    __tablename__ = "report_runs"
+
+    id = Column(Integer, primary_key=True)
+    status = Column(String, nullable=False, default="running")  # running | done | failed | interrupted
+    checkpoint_user_id = Column(Integer, nullable=False, default=0)  # every user <= this has been handled
+    users_done = Column(Integer, nullable=False, default=0)
+    reports_written = Column(Integer, nullable=False, default=0)
+    # per-stage seconds, accumulated across resumes (compute/write are summed over pool processes)
+    scan_seconds = Column(Float, nullable=False, default=0.0)
+    compute_seconds = Column(Float, nullable=False, default=0.0)
+    write_seconds = Column(Float, nullable=False, default=0.0)
+    db_seconds = Column(Float, nullable=False, default=0.0)
+    error = Column(String, nullable=True)
+    started_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    finished_at = Column(DateTime, nullable=True)
@@ -1,6 +1,8 @@
 from jose import JWTError, jwt
 from datetime import datetime, timedelta, timezone
 from . import schemas, database, models
+from .config import settings
+from .services.lru_cache import LRUTTLCache
 from fastapi import Depends, status, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -41,15 +43,37 @@ def verify_access_token(token: str, credentials_exception):
     
     return token_data
 
+# user id -> schemas.UserOut, so authenticated requests skip the users lookup.
+# The JWT is still verified on every request; only the row fetch is cached.
+principal_cache = LRUTTLCache(settings.auth_cache_max_entries, settings.auth_cache_ttl_seconds)
+
+def invalidate_user(user_id: int):
+    """Call after a user row changes or is deleted (other workers catch up within the TTL)."""
+    principal_cache.pop(user_id)
+
 async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(database.get_db)):
     credentials_exception = HTTPException(status_code = status.HTTP_401_UNAUTHORIZED, detail = f"Could not validate credentials", headers = {"WWW-Authenticate": "Bearer"})
 
     token = verify_access_token(token, credentials_exception)
 
+    principal = principal_cache.get(token.id)
+    if principal is not None:
+        return principal
+
     # user = db.query(models.User).filter(models.User.id == token.id).first()  #old way
     result = await db.execute(
-        select(models.User).where(models.User.id == token.id)
+        select(models.User.id, models.User.email, models.User.created_at).where(models.User.id == token.id)
         )
-    user = result.scalar_one()
-    # print(f"from get_current_user 'user'{user}")
-    return user
\ No newline at end of file
+    row = result.one_or_none()
+    if row is None:
+        # valid token for a user that no longer exists
+        raise credentials_exception
+    principal = schemas.UserOut(id = row.id, email = row.email, created_at = row.created_at)
+    principal_cache.set(token.id, principal)
+    # print(f"from get_current_user 'user'{principal}")
+    return principal
+
+async def get_current_admin(curr_user: schemas.UserOut = Depends(get_current_user)):
+    if curr_user.id not in settings.admin_user_ids:
+        raise HTTPException(status_code = status.HTTP_403_FORBIDDEN, detail = "Admin access required")
+    return curr_user
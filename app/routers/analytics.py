@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import schemas, oauth2
+from .. database import get_db
+from .. config import settings
+from .. services.firm_exposure import compute_firm_exposure
+
+router = APIRouter(
+    prefix = "/analytics",
+    tags = ['Analytics']
+)
+
+# firm-wide exposure across every user's holdings, by sector and industry (admin only)
+@router.get("/sector-exposure")
+async def get_sector_exposure(
+    chunk_size: int = Query(None, gt=0, description="Holdings rows per cursor fetch"),
+    db: AsyncSession = Depends(get_db),
+    admin: schemas.UserOut = Depends(oauth2.get_current_admin)
+):
+    return await compute_firm_exposure(db, chunk_size or settings.analytics_chunk_size)
@@ -23,11 +23,22 @@ async def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Asy
 
     # if email is not present in our db, then return 'invalid credentials'
     if not user:
-        raise HTTPException(status_code = status.HTTP_403_NOT_FOUND, detail = f"Invalid Credentials")
+        raise HTTPException(status_code = status.HTTP_403_FORBIDDEN, detail = f"Invalid Credentials")
     
     # if 'password' doesnt match with 'password in db' then return 'invalid credentials'
-    if not utils.verify(user_credentials.password, user.password):
-        raise HTTPException(status_code = status.HTTP_403_NOT_FOUND, detail = f"Invalid Credentials")
+    # bcrypt runs in the hashing pool, not on the event loop
+    try:
+        valid, new_hash = await utils.password_hasher.verify_and_update(user_credentials.password, user.password)
+    except utils.PasswordHasherBusy:
+        raise HTTPException(status_code = status.HTTP_503_SERVICE_UNAVAILABLE, detail = "Too many login attempts in progress, retry shortly", headers = {"Retry-After": "1"})
+    if not valid:
+        raise HTTPException(status_code = status.HTTP_403_FORBIDDEN, detail = f"Invalid Credentials")
+
+    # stored hash was made with an older bcrypt cost, replace it while we have the plain password
+    if new_hash:
+        user.password = new_hash
+        await db.commit()
+        oauth2.invalidate_user(user.id)
     
     #create a token and return it
     access_token = oauth2.ceate_access_token(data = {
@@ -1,11 +1,19 @@
-from fastapi import status, HTTPException, Depends, APIRouter
-from sqlalchemy.orm import joinedload
+from fastapi import status, HTTPException, Depends, APIRouter, Query, Request
 from sqlalchemy import func
 from sqlalchemy.future import select
 from .. import models, schemas, oauth2
 from .. database import get_db
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+from .. services.holdings_upsert import upsert_holdings
+from .. services.instrument_registry import instrument_registry
+from .. services.holdings_stream import stream_upload_holdings, StreamFormatError, LineTooLong
+from .. services.holdings_listing import fetch_holdings, fetch_holdings_page, shape_holdings, iter_holdings_ndjson, InvalidCursor
+from .. services.serialization import FastJSONResponse
+from .. services import sector_allocations
+from .. services.portfolio_version import bump_portfolio_version
+from .. config import settings
 
 
 router = APIRouter(
@@ -19,11 +27,9 @@ async def create_user(data: List[schemas.StockHolding], db: AsyncSession = Depen
     # 1. Extract ISINs
     input_isins = [item.isin_no for item in data]
 
-    # 2. Get valid ISINs in a single query
-    valid_isins_result = await db.execute(
-        select(models.Instruments.isin_no).where(models.Instruments.isin_no.in_(input_isins))
-    )
-    valid_isins = set(row[0] for row in valid_isins_result.all())
+    # 2. Get valid ISINs from the in-process instrument registry (no DB round trip)
+    await instrument_registry.ensure_loaded(db)
+    valid_isins = instrument_registry.known(input_isins)
 
     if not valid_isins:
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = 'No valid ISIN numbers found')
@@ -31,33 +37,15 @@ async def create_user(data: List[schemas.StockHolding], db: AsyncSession = Depen
     # 3. Separate valid and invalid ISINs
     invalid_isins = [isin_no for isin_no in input_isins if isin_no not in valid_isins]
 
-    inserted, updated = 0, 0
-
-    # 4. Process valid ISINs
-    for item in data:
-        if item.isin_no not in valid_isins:
-            continue  # Skip invalid ISIN
-
-        # Check if holding already exists
-        existing = await db.execute(
-            select(models.Holdings).where(models.Holdings.user_id == curr_user.id, models.Holdings.isin_no == item.isin_no)
-        )
-        existing = existing.scalar_one_or_none()
-
-        if existing:
-            existing.quantity = item.quantity
-            existing.avg_price = item.avg_price  # You can decide whether to replace or recalculate
-            updated += 1
-        else:
-            new_holding = models.Holdings(
-                user_id = curr_user.id,
-                # isin_no = item.isin_no,
-                # quantity = item.quantity,
-                # average_price = item.avg_price
-                **item.model_dump()
-            )
-            db.add(new_holding)
-            inserted += 1
+    # 4. Upsert valid ISINs in batches (one statement per batch instead of one SELECT per row)
+    inserted, updated = await upsert_holdings(
+        db,
+        curr_user.id,
+        (item.model_dump() for item in data if item.isin_no in valid_isins),
+    )
+    # keep per-user sector aggregates in the same transaction
+    await sector_allocations.refresh_user_sectors(db, curr_user.id, valid_isins)
+    await bump_portfolio_version(db, curr_user.id)  # invalidates cached reports / ETags
 
     await db.commit()
 
@@ -69,36 +57,73 @@ async def create_user(data: List[schemas.StockHolding], db: AsyncSession = Depen
         "processed_count": inserted + updated
     }
    
-@router.get("/get-user-holdings", response_model = schemas.HoldingsListResponse, response_model_by_alias=False)
-async def get_user(db: AsyncSession = Depends(get_db), curr_user: schemas.UserOut = Depends(oauth2.get_current_user)):
-    result = await db.execute(
-        select(models.Holdings)
-        .options(joinedload(models.Holdings.instrument))
-        .where(models.Holdings.user_id == curr_user.id)
-    )
-    holdings = result.scalars().all()
-    
-    if not holdings:
+@router.post("/upload-holdings-stream", status_code = status.HTTP_201_CREATED, response_model=schemas.StreamUploadHoldingsResponse)
+async def upload_holdings_stream(
+    request: Request,
+    format: str = Query("csv", enum=["csv", "ndjson"]),
+    db: AsyncSession = Depends(get_db),
+    curr_user: schemas.UserOut = Depends(oauth2.get_current_user)
+):
+    # Body is read incrementally (CSV with isin_no,quantity,avg_price header, or one JSON object per line)
+    try:
+        summary = await stream_upload_holdings(
+            db,
+            curr_user.id,
+            request.stream(),
+            format,
+            settings.holdings_stream_chunk_size,
+            settings.holdings_stream_max_line_bytes,
+        )
+    except LineTooLong as e:
+        await db.rollback()
+        raise HTTPException(status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail = str(e))
+    except (StreamFormatError, UnicodeDecodeError) as e:
+        await db.rollback()
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
+
+    await db.commit()
+    return summary
+
+# encoded by FastJSONResponse, not validated against a response_model; the schema is for the docs
+# and covers the default rows layout (columnar returns parallel arrays per column instead)
+@router.get("/get-user-holdings", response_class = FastJSONResponse,
+            responses = {200: {"model": schemas.HoldingsListResponse}})
+async def get_user(
+    limit: Optional[int] = Query(None, ge=1, le=settings.holdings_page_max_limit, description="page size, enables keyset pagination"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    sector: Optional[str] = Query(None, description="only holdings in this sector_name"),
+    layout: str = Query("rows", enum=["rows", "columnar"], description="array of objects, or parallel arrays per column"),
+    db: AsyncSession = Depends(get_db),
+    curr_user: schemas.UserOut = Depends(oauth2.get_current_user)
+):
+    # rows come out of SQL already shaped and are encoded straight to bytes,
+    # no ORM objects and no per-row HoldingResponse validation
+    next_cursor = None
+    if limit is not None or cursor is not None:
+        # keyset page on (user_id, isin_no)
+        try:
+            rows, next_cursor = await fetch_holdings_page(
+                db, curr_user.id, limit or settings.holdings_page_max_limit, cursor, sector
+            )
+        except InvalidCursor as e:
+            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = str(e))
+    else:
+        rows = await fetch_holdings(db, curr_user.id, sector)
+
+    if not rows and cursor is None and sector is None:
         raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"No holdings found for user {curr_user.id}")
 
-    # return schemas.HoldingsListResponse(
-    #     holdings=[
-    #         schemas.HoldingResponse(
-    #             isin_no=h.isin_no,                
-    #             quantity=h.quantity,
-    #             average_price=h.avg_price,
-
-    #             instrument=schemas.InstrumentResponse(
-    #                 name=h.instrument.name,
-    #                 sector_name=h.instrument.sector_name,
-    #                 trading_symbol=h.instrument.trading_symbol
-    #             )
-    #         )
-    #         for h in holdings
-    #     ]
-    # )
-    return schemas.HoldingsListResponse(
-        holdings=[schemas.HoldingResponse.model_validate(h) for h in holdings]
+    return FastJSONResponse(content={"holdings": shape_holdings(rows, layout), "next_cursor": next_cursor})
+
+@router.get("/stream-user-holdings")
+async def stream_user_holdings(
+    sector: Optional[str] = Query(None, description="only holdings in this sector_name"),
+    curr_user: schemas.UserOut = Depends(oauth2.get_current_user)
+):
+    """Every holding as NDJSON (one HoldingResponse-shaped object per line), streamed from a server-side cursor."""
+    return StreamingResponse(
+        iter_holdings_ndjson(curr_user.id, sector, settings.holdings_list_chunk_size),
+        media_type="application/x-ndjson",
     )
 
 @router.delete("/delete-user-holdings", response_model=schemas.DeleteAllHoldingsResponse)
@@ -118,6 +143,8 @@ async def delete_user_holdings(db: AsyncSession = Depends(get_db), curr_user: sc
     await db.execute(
         models.Holdings.__table__.delete().where(models.Holdings.user_id == curr_user.id)
     )
+    await sector_allocations.clear_user_sectors(db, curr_user.id)
+    await bump_portfolio_version(db, curr_user.id)
     await db.commit()
 
     return {
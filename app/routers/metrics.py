@@ -0,0 +1,11 @@
+from fastapi import APIRouter, Response
+from .. metrics import render_metrics
+
+router = APIRouter(
+    tags = ["Metrics"]
+)
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus scrape endpoint (text exposition format), per worker."""
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
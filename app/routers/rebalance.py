@@ -0,0 +1,43 @@
+from fastapi import APIRouter, Depends, Query, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import schemas, oauth2
+from .. database import get_db
+from .. config import settings
+from .. services import rebalance
+from .. services.serialization import FastJSONResponse
+
+router = APIRouter(
+    prefix = "/rebalance",
+    tags = ['Rebalance']
+)
+
+# trades that bring the user's sector/industry weights back to the given targets
+@router.post("")
+async def rebalance_portfolio(
+    request: schemas.RebalanceRequest,
+    db: AsyncSession = Depends(get_db),
+    curr_user: schemas.UserOut = Depends(oauth2.get_current_user)
+):
+    tolerance_pp = request.tolerance_pp if request.tolerance_pp is not None else settings.rebalance_tolerance_pp
+    try:
+        plan = await rebalance.rebalance_user(db, curr_user.id, request.level, request.targets, tolerance_pp, request.cash)
+    except rebalance.UnknownTargets as e:
+        raise HTTPException(status_code = status.HTTP_422_UNPROCESSABLE_ENTITY, detail = str(e))
+    if plan is None:
+        raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"No holdings found for user {curr_user.id}")
+    return FastJSONResponse(content={"user_id": curr_user.id, **plan})
+
+# every user against one model portfolio in a single vectorized pass (admin only, cash is ignored)
+@router.post("/batch")
+async def rebalance_all_portfolios(
+    request: schemas.RebalanceRequest,
+    chunk_size: int = Query(None, gt=0, description="Holdings rows per cursor fetch"),
+    db: AsyncSession = Depends(get_db),
+    admin: schemas.UserOut = Depends(oauth2.get_current_admin)
+):
+    tolerance_pp = request.tolerance_pp if request.tolerance_pp is not None else settings.rebalance_tolerance_pp
+    try:
+        result = await rebalance.rebalance_batch(db, request.level, request.targets, tolerance_pp, chunk_size or settings.analytics_chunk_size)
+    except rebalance.UnknownTargets as e:
+        raise HTTPException(status_code = status.HTTP_422_UNPROCESSABLE_ENTITY, detail = str(e))
+    return FastJSONResponse(content=result)
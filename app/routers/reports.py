@@ -1,15 +1,27 @@
-from fastapi import APIRouter, Depends, Query, HTTPException, status
+from fastapi import APIRouter, Depends, Query, HTTPException, status, Header, Response
 from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text, func, select
-import pandas as pd
-from io import BytesIO
 from .. import models, schemas, oauth2
 from app.database import get_db  # your db session provider
+from ..services.allocation import get_allocation_rows, get_market_allocation
+from ..services.prices import get_price_service, PriceProviderError
+from ..services import sector_allocations
+from ..services.instrument_registry import instrument_registry
+from ..services.portfolio_version import get_portfolio_version
+from ..services.report_cache import report_cache
+from ..services.excel_writer import write_workbook_async, write_workbook_sheets_async
+from ..services import hierarchy_report, snapshots
+from ..services.report_export import EXPORT_FORMATS, ExportUnavailable, export_stream
+from ..services.serialization import dumps, to_columnar, FastJSONResponse
+from ..services.report_jobs import REPORT_DIR, new_report_path, report_scheduler, job_summary, JobQueueFull
+from ..services.report_artifacts import artifact_hash, reuse_or_write, artifact_stats
+from ..services.nightly_reports import list_runs
+from ..config import settings
 from pathlib import Path
+from typing import Optional
 from datetime import datetime, timedelta
 
-REPORT_DIR = Path("reports")
 REPORT_DIR.mkdir(exist_ok=True)  # ensure folder exists
 
 router = APIRouter(
@@ -20,90 +32,68 @@ router = APIRouter(
 @router.get("/create-allocation-report")
 async def get_allocation_report(
     format: str = Query("json", enum=["json", "excel"]),
+    level: str = Query("stock", enum=["stock", "sector"]),
+    basis: str = Query("cost", enum=["cost", "market"]),
+    layout: str = Query("rows", enum=["rows", "columnar"], description="json only: array of objects, or parallel arrays per column"),
+    if_none_match: Optional[str] = Header(None),
     db: AsyncSession = Depends(get_db),
     curr_user: schemas.UserOut = Depends(oauth2.get_current_user)
 ):
     
-    # Check holdings
-    has_holdings = await db.scalar(
-        select(func.count()).select_from(models.Holdings).where(models.Holdings.user_id == curr_user.id)
-    )
-    if not has_holdings:
-        return {"message": "No holdings found for this user."}
+    # Market value reports depend on live prices, they skip the holdings-versioned cache
+    if basis == "market":
+        return await market_allocation_report(format, level, db, curr_user)
 
-    
-    query = text("""
-        WITH stock_investments AS (
-            SELECT 
-                i.industry_new_name AS sector,
-                i.name AS stock_name,
-                h.isin_no,
-                SUM(h.quantity * h.avg_price) AS stock_investment
-            FROM holdings h
-            JOIN instruments i 
-                ON h.isin_no = i.isin_no
-            WHERE h.user_id = :user_id
-            GROUP BY i.industry_new_name, i.name, h.isin_no
-        ),
-        sector_totals AS (
-            SELECT 
-                sector,
-                SUM(stock_investment) AS sector_total
-            FROM stock_investments
-            GROUP BY sector
-        ),
-        portfolio_total AS (
-            SELECT SUM(stock_investment) AS total_portfolio
-            FROM stock_investments
+    # Cache key / ETag: anything that changes the report content bumps one of these versions
+    await instrument_registry.ensure_loaded(db)
+    portfolio_version = await get_portfolio_version(db, curr_user.id)
+    cache_key = (curr_user.id, portfolio_version, instrument_registry.version, level, format, layout if format == "json" else None)
+    etag = f'"{curr_user.id}-{portfolio_version}-{instrument_registry.version}-{level}{"-columnar" if layout == "columnar" else ""}"'
+
+    if format == "json" and if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        report_cache.not_modified += 1
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    cached = report_cache.get(cache_key)
+    if cached is not None and format == "json":
+        return Response(content=cached, media_type="application/json", headers={"ETag": etag})
+
+    if cached is not None:
+        data = cached
+    elif level == "sector":
+        # Sector-only report is a straight read of the precomputed per-user aggregates
+        data = sector_allocations.build_sector_rows(
+            await sector_allocations.get_user_sectors(db, curr_user.id)
         )
-        SELECT 
-            s.sector,
-            s.stock_name,
-            s.isin_no,
-            s.stock_investment,
-            st.sector_total,
-            ROUND((st.sector_total * 100.0 / p.total_portfolio)::numeric, 2) AS sector_pct_of_portfolio,
-            ROUND((s.stock_investment * 100.0 / st.sector_total)::numeric, 2) AS stock_pct_within_sector,
-            ROUND((s.stock_investment * 100.0 / p.total_portfolio)::numeric, 2) AS stock_pct_of_portfolio
-        FROM stock_investments s
-        JOIN sector_totals st ON s.sector = st.sector
-        JOIN portfolio_total p ON TRUE
-        ORDER BY s.sector, stock_pct_within_sector DESC;
-    """)
-
-    result = await db.execute(query, {"user_id": curr_user.id})
-    rows = result.mappings().all()
-
-    # Convert to list of dicts
-    data = [
-        {
-            "sector": r["sector"],
-            "stock_name": r["stock_name"],
-            "isin_no": r["isin_no"],
-            "stock_investment": float(r["stock_investment"]),
-            "sector_total": float(r["sector_total"]),
-            "sector_pct_of_portfolio": float(r["sector_pct_of_portfolio"]),
-            "stock_pct_within_sector": float(r["stock_pct_within_sector"]),
-            "stock_pct_of_portfolio": float(r["stock_pct_of_portfolio"]),
-        }
-    for r in rows
-    ]
-
-    # JSON response
+    else:
+        # Allocation rows (sector/name resolved from the in-process instrument registry)
+        data = await get_allocation_rows(db, curr_user.id)
+    if not data:
+        return {"message": "No holdings found for this user."}
+
+    # history: one sector-weight snapshot per holdings version (deduplicated, so cheap on repeats)
+    if cached is None:
+        await snapshots.snapshot_report_run(db, curr_user.id, portfolio_version)
+
+    # JSON response (encoded body is cached as-is)
     if format == "json":
-        return JSONResponse(content={"user_id": curr_user.id, "report": data})
-    
-    # Save to Excel file
-    user_dir = REPORT_DIR / f"user_{curr_user.id}"
-    user_dir.mkdir(exist_ok=True)
-    file_path = user_dir / f"allocation_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        await db.commit()
+        body = dumps({"user_id": curr_user.id, "report": to_columnar(data) if layout == "columnar" else data})
+        report_cache.set(cache_key, body)
+        return Response(content=body, media_type="application/json", headers={"ETag": etag})
 
-    df = pd.DataFrame(data)
-    df.to_excel(file_path, index=False, sheet_name="Allocation Report")
+    report_cache.set(cache_key, data)
+    
+    # Save to Excel file, unless an identical one is still live (openpyxl runs in a worker pool, not on the event loop)
+    content_hash = artifact_hash(curr_user.id, portfolio_version, instrument_registry.version, f"allocation-{level}")
+    file_path, _ = await reuse_or_write(
+        db, content_hash, curr_user.id, lambda path: write_workbook_async(path, data, sheet_name="Allocation Report")
+    )
 
-    # Save metadata in DB
-    expires_at = datetime.now() + timedelta(minutes=5)
-    report = models.Report(user_id=curr_user.id, file_path=str(file_path), expires_at=expires_at, downloaded=False)
+    # Save metadata in DB, every request gets its own row (and expiry) even when the file is shared
+    expires_at = datetime.now() + timedelta(minutes=settings.report_expiry_minutes)
+    report = models.Report(user_id=curr_user.id, file_path=file_path, expires_at=expires_at, downloaded=False, status="done",
+                           portfolio_version=portfolio_version if level == "stock" else None, content_hash=content_hash)
     db.add(report)
     await db.commit()
     await db.refresh(report)
@@ -114,6 +104,189 @@ async def get_allocation_report(
         "expires_at": expires_at.isoformat() # convert datetime to string
     })
 
+# direct export: the report body is streamed as it is encoded, no file on disk and no Report row
+# (create-allocation-report?format=excel + /download remains the persisted mode)
+@router.get("/export")
+async def export_allocation_report(
+    format: str = Query("csv", enum=list(EXPORT_FORMATS)),
+    level: str = Query("stock", enum=["stock", "sector"]),
+    db: AsyncSession = Depends(get_db),
+    curr_user: schemas.UserOut = Depends(oauth2.get_current_user)
+):
+    await instrument_registry.ensure_loaded(db)
+    portfolio_version = await get_portfolio_version(db, curr_user.id)
+    # same rows the persisted excel report caches
+    cache_key = (curr_user.id, portfolio_version, instrument_registry.version, level, "excel", None)
+
+    data = report_cache.get(cache_key)
+    if data is None:
+        if level == "sector":
+            data = sector_allocations.build_sector_rows(await sector_allocations.get_user_sectors(db, curr_user.id))
+        else:
+            data = await get_allocation_rows(db, curr_user.id)
+        if not data:
+            raise HTTPException(status_code=404, detail="No holdings found for this user.")
+        report_cache.set(cache_key, data)
+
+    try:
+        body = export_stream(format, data)
+    except ExportUnavailable as e:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail=str(e))
+
+    media_type, extension = EXPORT_FORMATS[format]
+    filename = f"allocation_{level}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return StreamingResponse(body, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+# sector > industry > igroup > isubgroup > stock tree, computed with one ROLLUP query
+@router.get("/create-hierarchy-report")
+async def get_hierarchy_report(
+    format: str = Query("json", enum=["json", "excel"]),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
+    curr_user: schemas.UserOut = Depends(oauth2.get_current_user)
+):
+    await instrument_registry.ensure_loaded(db)
+    portfolio_version = await get_portfolio_version(db, curr_user.id)
+    cache_key = (curr_user.id, portfolio_version, instrument_registry.version, "hierarchy", format)
+    etag = f'"{curr_user.id}-{portfolio_version}-{instrument_registry.version}-hierarchy"'
+
+    if format == "json" and if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        report_cache.not_modified += 1
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    cached = report_cache.get(cache_key)
+    if cached is not None and format == "json":
+        return Response(content=cached, media_type="application/json", headers={"ETag": etag})
+
+    tree = cached if cached is not None else await hierarchy_report.get_hierarchy_report(db, curr_user.id)
+    if not tree:
+        return {"message": "No holdings found for this user."}
+
+    if format == "json":
+        body = dumps({"user_id": curr_user.id, "report": tree})
+        report_cache.set(cache_key, body)
+        return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+    report_cache.set(cache_key, tree)
+
+    # one sheet per level
+    sheets = hierarchy_report.flatten_hierarchy(tree)
+    content_hash = artifact_hash(curr_user.id, portfolio_version, instrument_registry.version, "hierarchy")
+    file_path, _ = await reuse_or_write(
+        db, content_hash, curr_user.id,
+        lambda path: write_workbook_sheets_async(path, [(level.capitalize(), rows, None) for level, rows in sheets.items()]),
+    )
+
+    expires_at = datetime.now() + timedelta(minutes=settings.report_expiry_minutes)
+    report = models.Report(user_id=curr_user.id, file_path=file_path, expires_at=expires_at, downloaded=False, status="done",
+                           content_hash=content_hash)
+    db.add(report)
+    await db.commit()
+    await db.refresh(report)
+
+    return JSONResponse(content={
+        "message": "Report generated",
+        "report_id": report.id,
+        "expires_at": expires_at.isoformat()
+    })
+
+async def market_allocation_report(format: str, level: str, db: AsyncSession, curr_user: schemas.UserOut):
+    try:
+        price_service = get_price_service()
+    except PriceProviderError as e:
+        # misconfigured provider (e.g. missing price file), retried on the next request
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    if price_service is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="No price provider configured")
+    try:
+        report = await get_market_allocation(db, curr_user.id, price_service)
+    except PriceProviderError as e:
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(e))
+    if not report:
+        return {"message": "No holdings found for this user."}
+    if level == "sector":
+        report.pop("report")
+
+    if format == "json":
+        return FastJSONResponse(content={"user_id": curr_user.id, **report})
+
+    file_path = new_report_path(curr_user.id)
+    sheets = [("Sectors", report["sectors"], None)]
+    if "report" in report:
+        sheets.insert(0, ("Allocation Report", report["report"], None))
+    await write_workbook_sheets_async(file_path, sheets)
+
+    expires_at = datetime.now() + timedelta(minutes=settings.report_expiry_minutes)
+    db_report = models.Report(user_id=curr_user.id, file_path=str(file_path), expires_at=expires_at, downloaded=False, status="done")
+    db.add(db_report)
+    await db.commit()
+    await db.refresh(db_report)
+
+    return JSONResponse(content={
+        "message": "Report generated",
+        "report_id": db_report.id,
+        "expires_at": expires_at.isoformat()
+    })
+
+@router.get("/price-stats")
+async def get_price_stats(curr_user: schemas.UserOut = Depends(oauth2.get_current_user)):
+    # per-worker price cache counters
+    try:
+        price_service = get_price_service()
+    except PriceProviderError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    return price_service.stats() if price_service else {"provider": None}
+
+@router.get("/cache-stats")
+async def get_report_cache_stats(curr_user: schemas.UserOut = Depends(oauth2.get_current_user)):
+    # per-worker hit/miss counters of the allocation report cache
+    return report_cache.stats()
+
+@router.get("/artifact-stats")
+async def get_report_artifact_stats(curr_user: schemas.UserOut = Depends(oauth2.get_current_user)):
+    # per-worker counters of excel files reused instead of regenerated
+    return artifact_stats.stats()
+
+# submit an excel report job, returns immediately with a job id
+@router.post("/jobs", status_code=status.HTTP_202_ACCEPTED, response_model=schemas.ReportJobResponse)
+async def submit_report_job(
+    db: AsyncSession = Depends(get_db),
+    curr_user: schemas.UserOut = Depends(oauth2.get_current_user)
+):
+    try:
+        report, coalesced = await report_scheduler.submit(db, curr_user.id)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"Report queue is full, retry later ({e})")
+    return job_summary(report, coalesced)
+
+# poll job status, download with /reports/download?report_id=<job_id> once status is "done"
+@router.get("/status", response_model=schemas.ReportJobResponse)
+async def get_report_status(
+    report_id: int = Query(..., description="Report / job ID"),
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.UserOut = Depends(oauth2.get_current_user)
+):
+    report = await db.get(models.Report, report_id)
+    if not report:
+        raise HTTPException(status_code=404, detail="Report not found")
+    if report.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return job_summary(report)
+
+# progress and per-stage timings of batch report runs (python -m app.services.nightly_reports), admin only
+@router.get("/runs")
+async def get_report_runs(
+    limit: int = Query(20, ge=1, le=200),
+    db: AsyncSession = Depends(get_db),
+    admin: schemas.UserOut = Depends(oauth2.get_current_admin)
+):
+    return FastJSONResponse(content=await list_runs(db, limit))
+
+@router.get("/job-stats")
+async def get_report_job_stats(curr_user: schemas.UserOut = Depends(oauth2.get_current_user)):
+    # per-worker scheduler counters
+    return report_scheduler.stats()
+
 # to download report
 @router.get("/download", response_class=FileResponse)
 async def download_report(
@@ -132,6 +305,8 @@ async def download_report(
             raise HTTPException(status_code=404, detail="Report not found")
         if report.user_id != current_user.id:
             raise HTTPException(status_code=403, detail="Not authorized")
+        if report.status != "done":
+            raise HTTPException(status_code=409, detail=f"Report is {report.status}")
         if datetime.now() > report.expires_at:
             raise HTTPException(status_code=410, detail="Report expired")
         
@@ -146,7 +321,7 @@ async def download_report(
     # Case 2: Latest available report
     result = await db.execute(
         select(models.Report)
-        .where(models.Report.user_id == current_user.id)
+        .where(models.Report.user_id == current_user.id, models.Report.status == "done")
         .order_by(models.Report.expires_at.desc())
     )
     latest_report = result.scalars().first()
@@ -0,0 +1,52 @@
+from fastapi import APIRouter, Depends, Query, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+from typing import Optional
+from .. import schemas, oauth2
+from .. database import get_db
+from .. config import settings
+from .. services import snapshots
+from .. services.instrument_registry import instrument_registry
+from .. services.portfolio_version import get_portfolio_version
+from .. services.serialization import FastJSONResponse
+
+router = APIRouter(
+    prefix = "/snapshots",
+    tags = ['Snapshots']
+)
+
+# allocation reports record snapshots automatically, this records one on demand
+@router.post("", status_code = status.HTTP_201_CREATED)
+async def create_snapshot(db: AsyncSession = Depends(get_db), curr_user: schemas.UserOut = Depends(oauth2.get_current_user)):
+    await instrument_registry.ensure_loaded(db)
+    portfolio_version = await get_portfolio_version(db, curr_user.id)
+    recorded = await snapshots.record_snapshot(db, curr_user.id, portfolio_version)
+    if recorded is None:
+        raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = f"No holdings found for user {curr_user.id}")
+    snapshot, created = recorded
+    await db.commit()
+    return {**snapshot, "created": created}
+
+# sector weights over time (parallel arrays) with per-sector drift across the range
+@router.get("")
+async def get_snapshot_series(
+    start: Optional[datetime] = Query(None),
+    end: Optional[datetime] = Query(None),
+    limit: int = Query(None, ge=1, le=settings.snapshot_series_max),
+    db: AsyncSession = Depends(get_db),
+    curr_user: schemas.UserOut = Depends(oauth2.get_current_user)
+):
+    series = await snapshots.snapshot_series(db, curr_user.id, start, end, limit or settings.snapshot_series_max)
+    return FastJSONResponse(content={"user_id": curr_user.id, **series})
+
+@router.get("/diff")
+async def diff_snapshots(
+    from_id: int = Query(...),
+    to_id: int = Query(...),
+    db: AsyncSession = Depends(get_db),
+    curr_user: schemas.UserOut = Depends(oauth2.get_current_user)
+):
+    diff = await snapshots.diff_snapshots(db, curr_user.id, from_id, to_id)
+    if diff is None:
+        raise HTTPException(status_code = status.HTTP_404_NOT_FOUND, detail = "Snapshot not found")
+    return FastJSONResponse(content={"user_id": curr_user.id, **diff})
@@ -24,7 +24,10 @@ async def create_user(user: schemas.CreateUser, db: AsyncSession = Depends(get_d
         raise HTTPException(status_code = status.HTTP_409_CONFLICT, detail = f"Email already registered. Please use another email")
 
     #hash the password
-    hashed_password = utils.hash(user.password)
+    try:
+        hashed_password = await utils.password_hasher.hash(user.password)
+    except utils.PasswordHasherBusy:
+        raise HTTPException(status_code = status.HTTP_503_SERVICE_UNAVAILABLE, detail = "Too many registrations in progress, retry shortly", headers = {"Retry-After": "1"})
     user.password = hashed_password #updated pydantic user model password
     
     new_user = models.User(**user.model_dump())
@@ -39,4 +42,13 @@ async def get_user(db: AsyncSession = Depends(get_db), curr_user: schemas.UserOu
     print(type(curr_user.id),type(curr_user.email))
     return curr_user
 
-   
\ No newline at end of file
+   
+@router.get("/auth-cache-stats")
+async def get_auth_cache_stats(curr_user: schemas.UserOut = Depends(oauth2.get_current_user)):
+    """Hit rate of this worker's authenticated-user cache."""
+    return oauth2.principal_cache.stats()
+
+@router.get("/password-hash-stats")
+async def get_password_hash_stats(curr_user: schemas.UserOut = Depends(oauth2.get_current_user)):
+    """Load on this worker's bcrypt pool, including requests rejected with 503."""
+    return utils.password_hasher.stats()
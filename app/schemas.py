@@ -1,14 +1,16 @@
-from pydantic import BaseModel, EmailStr, conint, confloat, Field, constr, ConfigDict
-from typing import Optional,List
+from pydantic import BaseModel, EmailStr, conint, confloat, Field, constr, ConfigDict, field_validator
+from typing import Optional,List,Dict,Literal
 from typing_extensions import Annotated
 from datetime import datetime
 
+ISIN_PATTERN = r"^[A-Z]{2}[A-Z0-9]{9}[0-9]$"  # Standard ISIN format
+
 class StockHolding(BaseModel):
     isin_no: str = Field(
         ...,
         min_length=12,
         max_length=12,
-        pattern = r"^[A-Z]{2}[A-Z0-9]{9}[0-9]$",  # Standard ISIN format
+        pattern = ISIN_PATTERN,
         description="12-character ISIN code (e.g., INE001A01036)")
     quantity: int = Field(..., gt=0, example = 50)
     avg_price: float = Field(..., gt=0, example = 50.22)
@@ -24,6 +26,33 @@ class UploadHoldingsResponse(BaseModel):
     processed_count: int
     
     model_config = ConfigDict(from_attributes=True)
+
+
+class RejectedRow(BaseModel):
+    line: int
+    reason: str
+
+
+class StreamChunkStats(BaseModel):
+    chunk: int
+    rows: int
+    accepted: int
+    rejected: int
+    parse_ms: float
+    validate_ms: float
+    copy_ms: float
+    merge_ms: float
+
+
+class StreamUploadHoldingsResponse(BaseModel):
+    status: str
+    inserted_records: int
+    updated_records: int
+    rejected_rows: int
+    rejected_samples: List[RejectedRow]  # capped, full list is not kept in memory
+    processed_count: int
+    total_ms: float
+    chunks: List[StreamChunkStats]
   
    
 class InstrumentResponse(BaseModel):
@@ -46,6 +75,7 @@ class HoldingResponse(BaseModel):
 
 class HoldingsListResponse(BaseModel):
     holdings: List[HoldingResponse]
+    next_cursor: Optional[str] = None  # set when a paginated listing has more pages
 
     model_config = ConfigDict(from_attributes=True,
                               populate_by_name=True)
@@ -81,6 +111,38 @@ class TokenData(BaseModel):
 
 from pydantic import BaseModel
 
+class ReportJobResponse(BaseModel):
+    job_id: int
+    status: str  # queued | running | done | failed
+    coalesced: bool = False  # True when an existing job/report for the same holdings was returned
+    portfolio_version: Optional[int]
+    created_at: Optional[datetime]
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+    queued_ms: Optional[float]
+    run_ms: Optional[float]
+    expires_at: Optional[datetime]
+    error: Optional[str]
+
+
 class DeleteAllHoldingsResponse(BaseModel):
     message: str
-    deleted_count: int
\ No newline at end of file
+    deleted_count: int
+
+
+class RebalanceRequest(BaseModel):
+    level: Literal["sector", "industry"] = "sector"  # instruments.sector_name or industry_new_name
+    targets: Dict[str, float] = Field(..., min_length=1, description="Target weight in percent per sector/industry, summing to 100")
+    tolerance_pp: Optional[float] = Field(None, ge=0, le=100, description="Drift band in percentage points, categories inside it are not traded")
+    cash: float = Field(0.0, ge=0, description="Extra cash to invest (single-user rebalance only)")
+
+    model_config = ConfigDict(extra="forbid")
+
+    @field_validator("targets")
+    @classmethod
+    def targets_sum_to_100(cls, targets):
+        if any(w < 0 for w in targets.values()):
+            raise ValueError("target weights must not be negative")
+        if abs(sum(targets.values()) - 100.0) > 0.01:
+            raise ValueError(f"target weights must sum to 100, got {sum(targets.values()):.4f}")
+        return targets
@@ -0,0 +1,162 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from .instrument_registry import instrument_registry, InstrumentRegistry
+
+UNKNOWN = "Unknown"
+
+# per-ISIN cost basis only, sector/name come from the in-process instrument registry;
+# numeric casts happen in SQL so rows need no per-value conversion in Python
+STOCK_INVESTMENTS_QUERY = text("""
+    SELECT h.isin_no, SUM(h.quantity * h.avg_price)::float8 AS stock_investment
+    FROM holdings h
+    WHERE h.user_id = :user_id
+    GROUP BY h.isin_no
+""")
+
+
+async def fetch_stock_investments(db: AsyncSession, user_id: int) -> List[Tuple[str, float]]:
+    result = await db.execute(STOCK_INVESTMENTS_QUERY, {"user_id": user_id})
+    return result.all()
+
+
+def build_allocation_rows(stock_investments: Iterable[Tuple[str, float]], registry: InstrumentRegistry = instrument_registry) -> List[dict]:
+    """
+    Sector (industry_new_name) allocation rows, same shape and ordering as the old
+    three-CTE report query: sector totals, sector % of portfolio, stock % within sector
+    and stock % of portfolio, rounded to 2 decimals.
+    """
+    stocks = []
+    sector_totals = {}
+    for isin_no, investment in stock_investments:
+        record = registry.get(isin_no)
+        sector = record.industry_new_name if record else UNKNOWN
+        stock_name = record.name if record else isin_no
+        stocks.append((sector, stock_name, isin_no, investment))
+        sector_totals[sector] = sector_totals.get(sector, 0.0) + investment
+
+    total_portfolio = sum(sector_totals.values())
+    if not total_portfolio:
+        return []
+
+    data = []
+    for sector, stock_name, isin_no, investment in stocks:
+        sector_total = sector_totals[sector]
+        data.append({
+            "sector": sector,
+            "stock_name": stock_name,
+            "isin_no": isin_no,
+            "stock_investment": investment,
+            "sector_total": sector_total,
+            "sector_pct_of_portfolio": round(sector_total * 100.0 / total_portfolio, 2),
+            "stock_pct_within_sector": round(investment * 100.0 / sector_total, 2),
+            "stock_pct_of_portfolio": round(investment * 100.0 / total_portfolio, 2),
+        })
+
+    data.sort(key=lambda r: (r["sector"], -r["stock_pct_within_sector"]))
+    return data
+
+
+async def get_allocation_rows(db: AsyncSession, user_id: int) -> List[dict]:
+    stock_investments = await fetch_stock_investments(db, user_id)
+    await instrument_registry.ensure_loaded(db)
+    if any(isin_no not in instrument_registry for isin_no, _ in stock_investments):
+        # a holding references an instrument this worker hasn't seen yet
+        await instrument_registry.load(db)
+    return build_allocation_rows(stock_investments)
+
+
+# quantity and cost per ISIN, for market-value (basis=market) reports
+POSITIONS_QUERY = text("""
+    SELECT h.isin_no, SUM(h.quantity)::float8 AS quantity, SUM(h.quantity * h.avg_price)::float8 AS cost_value
+    FROM holdings h
+    WHERE h.user_id = :user_id
+    GROUP BY h.isin_no
+""")
+
+
+def build_market_allocation(positions: Iterable[Tuple[str, float, float]], prices: Dict[str, Optional[float]], registry: InstrumentRegistry = instrument_registry) -> dict:
+    """
+    Current-value allocation: weights from quantity * last price, plus unrealized P&L
+    per stock and per sector. Stocks without a quote are valued at cost and flagged.
+    """
+    stocks = []
+    sectors: Dict[str, dict] = {}
+    missing_prices = []
+    for isin_no, quantity, cost_value in positions:
+        record = registry.get(isin_no)
+        sector = record.industry_new_name if record else UNKNOWN
+        price = prices.get(isin_no)
+        if price is None:
+            missing_prices.append(isin_no)
+            market_value = cost_value
+        else:
+            market_value = quantity * price
+        stocks.append((sector, record.name if record else isin_no, isin_no, quantity, price, cost_value, market_value))
+        totals = sectors.setdefault(sector, {"cost_value": 0.0, "market_value": 0.0, "positions": 0})
+        totals["cost_value"] += cost_value
+        totals["market_value"] += market_value
+        totals["positions"] += 1
+
+    total_market = sum(t["market_value"] for t in sectors.values())
+    total_cost = sum(t["cost_value"] for t in sectors.values())
+    if not total_market:
+        return {}
+
+    def pnl_pct(market, cost):
+        return round((market - cost) * 100.0 / cost, 2) if cost else 0.0
+
+    rows = []
+    for sector, stock_name, isin_no, quantity, price, cost_value, market_value in stocks:
+        sector_market = sectors[sector]["market_value"]
+        rows.append({
+            "sector": sector,
+            "stock_name": stock_name,
+            "isin_no": isin_no,
+            "quantity": quantity,
+            "last_price": price,
+            "price_source": "market" if price is not None else "cost",
+            "cost_value": cost_value,
+            "market_value": market_value,
+            "unrealized_pnl": round(market_value - cost_value, 2),
+            "unrealized_pnl_pct": pnl_pct(market_value, cost_value),
+            "sector_total": sector_market,
+            "sector_pct_of_portfolio": round(sector_market * 100.0 / total_market, 2),
+            "stock_pct_within_sector": round(market_value * 100.0 / sector_market, 2) if sector_market else 0.0,
+            "stock_pct_of_portfolio": round(market_value * 100.0 / total_market, 2),
+        })
+    rows.sort(key=lambda r: (r["sector"], -r["stock_pct_within_sector"]))
+
+    sector_rows = [
+        {
+            "sector": sector,
+            "positions": t["positions"],
+            "cost_value": t["cost_value"],
+            "market_value": t["market_value"],
+            "unrealized_pnl": round(t["market_value"] - t["cost_value"], 2),
+            "unrealized_pnl_pct": pnl_pct(t["market_value"], t["cost_value"]),
+            "sector_pct_of_portfolio": round(t["market_value"] * 100.0 / total_market, 2),
+        }
+        for sector, t in sorted(sectors.items())
+    ]
+
+    return {
+        "basis": "market",
+        "cost_value": total_cost,
+        "market_value": total_market,
+        "unrealized_pnl": round(total_market - total_cost, 2),
+        "unrealized_pnl_pct": pnl_pct(total_market, total_cost),
+        "missing_prices": missing_prices,
+        "sectors": sector_rows,
+        "report": rows,
+    }
+
+
+async def get_market_allocation(db: AsyncSession, user_id: int, price_service) -> dict:
+    result = await db.execute(POSITIONS_QUERY, {"user_id": user_id})
+    positions = result.all()
+    if not positions:
+        return {}
+    await instrument_registry.ensure_loaded(db)
+    prices = await price_service.get_prices(isin_no for isin_no, _, _ in positions)
+    return build_market_allocation(positions, prices)
@@ -0,0 +1,75 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+from .. config import settings
+
+_executor: Optional[Executor] = None
+
+
+def write_workbook(file_path: str, rows: List[dict], sheet_name: str = "Allocation Report", columns: Optional[Sequence[str]] = None) -> str:
+    """
+    Write rows (list of dicts) to an .xlsx file using openpyxl's write-only mode,
+    which streams rows to disk instead of keeping every cell object in memory.
+    Plain module-level function so it can run in a process pool.
+    """
+    return write_workbook_sheets(file_path, [(sheet_name, rows, columns)])
+
+
+def build_workbook(sheets: List[Tuple[str, List[dict], Optional[Sequence[str]]]]):
+    """Write-only workbook with one sheet per (sheet_name, rows, columns) entry, not yet saved."""
+    from openpyxl import Workbook  # lazy, keeps openpyxl out of app startup
+
+    workbook = Workbook(write_only=True)
+    for sheet_name, rows, columns in sheets:
+        columns = list(columns or (rows[0].keys() if rows else []))
+        sheet = workbook.create_sheet(title=sheet_name)
+        sheet.append(columns)
+        for row in rows:
+            sheet.append([row.get(col) for col in columns])
+    return workbook
+
+
+def write_workbook_stream(fileobj, sheets: List[Tuple[str, List[dict], Optional[Sequence[str]]]]):
+    """Save the workbook into a writable (possibly non-seekable) file object instead of a path."""
+    build_workbook(sheets).save(fileobj)
+
+
+def write_workbook_sheets(file_path: str, sheets: List[Tuple[str, List[dict], Optional[Sequence[str]]]]) -> str:
+    """Same as write_workbook, one sheet per (sheet_name, rows, columns) entry."""
+    workbook = build_workbook(sheets)
+
+    # write to a temp name first so a half-written file is never served
+    tmp_path = Path(file_path).with_suffix(".tmp")
+    workbook.save(tmp_path)
+    tmp_path.replace(file_path)
+    return str(file_path)
+
+
+def get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if settings.report_executor_kind == "process":
+            _executor = ProcessPoolExecutor(max_workers=settings.report_executor_workers)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=settings.report_executor_workers, thread_name_prefix="excel-report")
+    return _executor
+
+
+async def write_workbook_async(file_path: str, rows: List[dict], sheet_name: str = "Allocation Report") -> str:
+    """Run write_workbook in the configured pool so the event loop keeps serving other requests."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), partial(write_workbook, str(file_path), rows, sheet_name))
+
+
+async def write_workbook_sheets_async(file_path: str, sheets: List[Tuple[str, List[dict], Optional[Sequence[str]]]]) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), partial(write_workbook_sheets, str(file_path), sheets))
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
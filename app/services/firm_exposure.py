@@ -0,0 +1,157 @@
+import time
+from typing import List
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from .instrument_registry import instrument_registry
+
+UNKNOWN = "Unknown"
+WEIGHT_BINS = 10001  # per-user weight histogram resolution: 0.01 percentage points
+
+# ordered by user so each user's rows arrive contiguously and can be finalized chunk by chunk
+HOLDINGS_SCAN_QUERY = text("""
+    SELECT h.user_id, h.isin_no, h.quantity * h.avg_price AS amount
+    FROM holdings h
+    ORDER BY h.user_id
+""")
+
+
+class _LevelAccumulator:
+    """Running totals for one classification level (sector or industry), all NumPy arrays."""
+
+    def __init__(self, np, labels: List[str]):
+        self.np = np
+        self.labels = labels
+        n = len(labels)
+        self.exposure = np.zeros(n)
+        self.positions = np.zeros(n, dtype=np.int64)
+        self.holders = np.zeros(n, dtype=np.int64)
+        # histogram of per-user weights, keeps median/p90 exact to 0.01pp with flat memory
+        self.weight_hist = np.zeros((n, WEIGHT_BINS), dtype=np.int64)
+
+    def add(self, user_codes, user_totals, category, amount):
+        np = self.np
+        n = len(self.labels)
+        self.exposure += np.bincount(category, weights=amount, minlength=n)
+        self.positions += np.bincount(category, minlength=n)
+
+        # per (user, category) amounts -> weight of the category in that user's portfolio
+        pair_key = user_codes.astype(np.int64) * n + category
+        pairs, pair_index = np.unique(pair_key, return_inverse=True)
+        pair_amount = np.bincount(pair_index, weights=amount)
+        pair_user = pairs // n
+        pair_category = pairs % n
+        totals = user_totals[pair_user]
+        weights = np.divide(pair_amount, totals, out=np.zeros_like(pair_amount), where=totals > 0)
+
+        self.holders += np.bincount(pair_category, minlength=n)
+        bins = np.clip(np.rint(weights * (WEIGHT_BINS - 1)).astype(np.int64), 0, WEIGHT_BINS - 1)
+        np.add.at(self.weight_hist, (pair_category, bins), 1)
+
+    def percentile_weights(self, q: float):
+        """Nearest-rank percentile of the weight histogram for every category, in percent."""
+        np = self.np
+        cumulative = np.cumsum(self.weight_hist, axis=1)
+        rank = np.ceil(q * self.holders).astype(np.int64)
+        rank = np.maximum(rank, 1)
+        idx = (cumulative < rank[:, None]).sum(axis=1)
+        idx = np.minimum(idx, WEIGHT_BINS - 1)
+        pct = idx * 100.0 / (WEIGHT_BINS - 1)
+        return np.where(self.holders > 0, pct, 0.0)
+
+    def rows(self, firm_total: float, user_count: int) -> List[dict]:
+        median = self.percentile_weights(0.5)
+        p90 = self.percentile_weights(0.9)
+        out = []
+        for i, name in enumerate(self.labels):
+            if not self.positions[i]:
+                continue
+            out.append({
+                "name": name,
+                "exposure": round(float(self.exposure[i]), 2),
+                "pct_of_firm": round(float(self.exposure[i]) * 100.0 / firm_total, 2) if firm_total else 0.0,
+                "positions": int(self.positions[i]),
+                "holders": int(self.holders[i]),
+                "holders_pct": round(int(self.holders[i]) * 100.0 / user_count, 2) if user_count else 0.0,
+                "median_weight_pct": round(float(median[i]), 2),
+                "p90_weight_pct": round(float(p90[i]), 2),
+            })
+        out.sort(key=lambda r: -r["exposure"])
+        return out
+
+
+async def compute_firm_exposure(db: AsyncSession, chunk_size: int) -> dict:
+    """
+    Aggregate exposure across every user's holdings by sector (sector_name) and
+    industry (industry_new_name). Holdings are read through a server-side cursor in
+    chunks of `chunk_size` rows and reduced with NumPy, so memory is bounded by the
+    chunk size and the number of categories, not by the number of holdings.
+    """
+    import numpy as np  # lazy, only this admin path needs it
+
+    started = time.perf_counter()
+    await instrument_registry.ensure_loaded(db)
+
+    # classification label tables, ISIN -> category index is resolved per chunk
+    sector_labels = sorted({r.sector_name for r in instrument_registry.records()} | {UNKNOWN})
+    industry_labels = sorted({r.industry_new_name for r in instrument_registry.records()} | {UNKNOWN})
+    sector_index = {name: i for i, name in enumerate(sector_labels)}
+    industry_index = {name: i for i, name in enumerate(industry_labels)}
+
+    sectors = _LevelAccumulator(np, sector_labels)
+    industries = _LevelAccumulator(np, industry_labels)
+
+    firm_total = 0.0
+    user_count = 0
+    rows_read = 0
+    chunks = 0
+    carry = None  # rows of the last user of the previous chunk, which may continue in the next one
+
+    def reduce(user_ids, isins, amounts):
+        nonlocal firm_total, user_count
+        if not len(user_ids):
+            return
+        unique_users, user_codes = np.unique(user_ids, return_inverse=True)
+        user_totals = np.bincount(user_codes, weights=amounts)
+
+        # map distinct ISINs once per chunk instead of once per row
+        unique_isins, isin_codes = np.unique(isins, return_inverse=True)
+        records = [instrument_registry.get(isin) for isin in unique_isins]
+        sector_of = np.array([sector_index[r.sector_name] if r else sector_index[UNKNOWN] for r in records], dtype=np.int64)
+        industry_of = np.array([industry_index[r.industry_new_name] if r else industry_index[UNKNOWN] for r in records], dtype=np.int64)
+
+        sectors.add(user_codes, user_totals, sector_of[isin_codes], amounts)
+        industries.add(user_codes, user_totals, industry_of[isin_codes], amounts)
+        firm_total += float(amounts.sum())
+        user_count += len(unique_users)
+
+    result = await db.stream(HOLDINGS_SCAN_QUERY.execution_options(yield_per=chunk_size))
+    async for partition in result.partitions(chunk_size):
+        chunks += 1
+        rows_read += len(partition)
+        user_ids = np.fromiter((r[0] for r in partition), dtype=np.int64, count=len(partition))
+        isins = np.array([r[1] for r in partition], dtype=object)
+        amounts = np.fromiter((r[2] for r in partition), dtype=np.float64, count=len(partition))
+
+        if carry is not None:
+            user_ids = np.concatenate([carry[0], user_ids])
+            isins = np.concatenate([carry[1], isins])
+            amounts = np.concatenate([carry[2], amounts])
+
+        # everyone except the last user in this chunk is complete
+        complete = user_ids != user_ids[-1]
+        reduce(user_ids[complete], isins[complete], amounts[complete])
+        carry = (user_ids[~complete], isins[~complete], amounts[~complete])
+
+    if carry is not None:
+        reduce(*carry)
+
+    return {
+        "users": user_count,
+        "holdings": rows_read,
+        "firm_total": round(firm_total, 2),
+        "chunks": chunks,
+        "chunk_size": chunk_size,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        "sectors": sectors.rows(firm_total, user_count),
+        "industries": industries.rows(firm_total, user_count),
+    }
@@ -0,0 +1,143 @@
+from typing import Dict, List, Tuple
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+LEVELS = ["sector", "industry", "igroup", "isubgroup", "stock"]
+
+# GROUPING(...) bitmask -> level, the rightmost bit is the stock (isin) column
+GROUPING_LEVELS = {
+    0b00000: "stock",
+    0b00001: "isubgroup",
+    0b00011: "igroup",
+    0b00111: "industry",
+    0b01111: "sector",
+    0b11111: "total",
+}
+
+# One pass over the user's holdings: ROLLUP yields stock rows plus subtotal rows
+# for every prefix of the classification path and a grand total.
+HIERARCHY_QUERY = text("""
+    SELECT
+        i.sector_name,
+        i.industry_new_name,
+        i.igroup_name,
+        i.isubgroup_name,
+        h.isin_no,
+        MAX(i.name) AS stock_name,
+        SUM(h.quantity * h.avg_price)::float8 AS invested,
+        COUNT(*) AS positions,
+        GROUPING(i.sector_name, i.industry_new_name, i.igroup_name, i.isubgroup_name, h.isin_no) AS grp
+    FROM holdings h
+    JOIN instruments i ON h.isin_no = i.isin_no
+    WHERE h.user_id = :user_id
+    GROUP BY ROLLUP (i.sector_name, i.industry_new_name, i.igroup_name, i.isubgroup_name, h.isin_no)
+""")
+
+# what the flat report does today, one query per level (kept for benchmarking)
+PER_LEVEL_QUERY = """
+    SELECT {columns}, SUM(h.quantity * h.avg_price)::float8 AS invested, COUNT(*) AS positions
+    FROM holdings h
+    JOIN instruments i ON h.isin_no = i.isin_no
+    WHERE h.user_id = :user_id
+    GROUP BY {columns}
+"""
+PER_LEVEL_COLUMNS = {
+    "sector": "i.sector_name",
+    "industry": "i.sector_name, i.industry_new_name",
+    "igroup": "i.sector_name, i.industry_new_name, i.igroup_name",
+    "isubgroup": "i.sector_name, i.industry_new_name, i.igroup_name, i.isubgroup_name",
+}
+
+
+async def fetch_hierarchy_rows(db: AsyncSession, user_id: int) -> List[tuple]:
+    result = await db.execute(HIERARCHY_QUERY, {"user_id": user_id})
+    return result.all()
+
+
+def _pct(part: float, whole: float) -> float:
+    return round(part * 100.0 / whole, 2) if whole else 0.0
+
+
+def build_hierarchy(rows: List[tuple]) -> dict:
+    """Turn ROLLUP rows into a nested tree with % of portfolio and % of parent at every node."""
+    nodes: Dict[Tuple, dict] = {}
+    total = None
+
+    for sector, industry, igroup, isubgroup, isin_no, stock_name, invested, positions, grp in rows:
+        level = GROUPING_LEVELS.get(grp)
+        if level == "total":
+            total = {"invested": invested, "positions": positions}
+            continue
+        depth = LEVELS.index(level) + 1
+        path = (sector, industry, igroup, isubgroup, isin_no)[:depth]
+        node = {
+            "level": level,
+            "name": stock_name if level == "stock" else path[-1],
+            "invested": invested,
+            "positions": positions,
+        }
+        if level == "stock":
+            node["isin_no"] = isin_no
+        else:
+            node["children"] = []
+        nodes[path] = node
+
+    if not total or not total["invested"]:
+        return {}
+
+    portfolio_total = total["invested"]
+    roots = []
+    # parents sort before their children because paths are prefixes
+    for path in sorted(nodes, key=lambda p: (len(p), p)):
+        node = nodes[path]
+        parent = nodes.get(path[:-1]) if len(path) > 1 else None
+        node["pct_of_portfolio"] = _pct(node["invested"], portfolio_total)
+        node["pct_of_parent"] = _pct(node["invested"], parent["invested"] if parent else portfolio_total)
+        (parent["children"] if parent else roots).append(node)
+
+    def sort_tree(children):
+        children.sort(key=lambda n: -n["invested"])
+        for child in children:
+            if "children" in child:
+                sort_tree(child["children"])
+
+    sort_tree(roots)
+    return {"invested": portfolio_total, "positions": total["positions"], "sectors": roots}
+
+
+def flatten_hierarchy(tree: dict) -> Dict[str, List[dict]]:
+    """One list of flat rows per level (for the one-sheet-per-level excel export)."""
+    sheets = {level: [] for level in LEVELS}
+
+    def walk(children, path):
+        for node in children:
+            level = node["level"]
+            row = {lvl: name for lvl, name in zip(LEVELS, path)}
+            row[level] = node["name"]
+            if level == "stock":
+                row["isin_no"] = node["isin_no"]
+            row.update({
+                "invested": node["invested"],
+                "positions": node["positions"],
+                "pct_of_parent": node["pct_of_parent"],
+                "pct_of_portfolio": node["pct_of_portfolio"],
+            })
+            sheets[level].append(row)
+            if "children" in node:
+                walk(node["children"], path + [node["name"]])
+
+    walk(tree.get("sectors", []), [])
+    return sheets
+
+
+async def get_hierarchy_report(db: AsyncSession, user_id: int) -> dict:
+    return build_hierarchy(await fetch_hierarchy_rows(db, user_id))
+
+
+async def get_per_level_reports(db: AsyncSession, user_id: int) -> Dict[str, List[tuple]]:
+    """The per-level alternative: four separate GROUP BY queries."""
+    out = {}
+    for level, columns in PER_LEVEL_COLUMNS.items():
+        result = await db.execute(text(PER_LEVEL_QUERY.format(columns=columns)), {"user_id": user_id})
+        out[level] = result.all()
+    return out
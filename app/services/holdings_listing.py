@@ -0,0 +1,101 @@
+import base64
+import re
+from typing import AsyncIterator, List, Optional, Tuple
+from sqlalchemy import select, cast, Integer
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models
+from .. schemas import ISIN_PATTERN
+from .. database import AsyncSessionLocal
+from .serialization import dumps, to_columnar
+
+_ISIN_RE = re.compile(ISIN_PATTERN)
+
+
+# flat column names of holdings_query rows (columnar layout)
+HOLDING_COLUMNS = ["isin_no", "quantity", "average_price", "name", "sector_name", "trading_symbol"]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(isin_no: str) -> str:
+    """Opaque page token: the last ISIN of the page, holdings are keyed on (user_id, isin_no)."""
+    return base64.urlsafe_b64encode(isin_no.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> str:
+    try:
+        isin_no = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor("Malformed cursor")
+    if not _ISIN_RE.match(isin_no):
+        raise InvalidCursor("Malformed cursor")
+    return isin_no
+
+
+def holdings_query(user_id: int, after: Optional[str] = None, sector: Optional[str] = None, limit: Optional[int] = None):
+    """
+    Plain column select, ordered on the primary key so both pagination and streaming
+    walk the (user_id, isin_no) index instead of sorting. Columns come out in
+    HOLDING_COLUMNS order, already cast to the response types.
+    """
+    h, i = models.Holdings, models.Instruments
+    query = (
+        select(h.isin_no, cast(h.quantity, Integer), h.avg_price, i.name, i.sector_name, i.trading_symbol)
+        .join(i, h.isin_no == i.isin_no)
+        .where(h.user_id == user_id)
+        .order_by(h.isin_no)
+    )
+    if after is not None:
+        query = query.where(h.isin_no > after)
+    if sector is not None:
+        query = query.where(i.sector_name == sector)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def holding_row(row) -> dict:
+    """Same shape as schemas.HoldingResponse (by field name), built without a model."""
+    isin_no, quantity, avg_price, name, sector_name, trading_symbol = row
+    return {
+        "isin_no": isin_no,
+        "quantity": quantity,
+        "average_price": avg_price,
+        "instrument": {"name": name, "sector_name": sector_name, "trading_symbol": trading_symbol},
+    }
+
+
+async def fetch_holdings(db: AsyncSession, user_id: int, sector: Optional[str] = None) -> List[tuple]:
+    result = await db.execute(holdings_query(user_id, sector=sector))
+    return result.all()
+
+
+async def fetch_holdings_page(db: AsyncSession, user_id: int, limit: int, cursor: Optional[str] = None, sector: Optional[str] = None) -> Tuple[List[tuple], Optional[str]]:
+    """One page of holdings rows plus the cursor for the next page (None on the last page)."""
+    after = decode_cursor(cursor) if cursor else None
+    # one extra row tells us whether another page exists without a COUNT
+    result = await db.execute(holdings_query(user_id, after, sector, limit + 1))
+    rows = result.all()
+    next_cursor = encode_cursor(rows[limit - 1][0]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def shape_holdings(rows: List[tuple], layout: str = "rows"):
+    """HoldingResponse-shaped objects, or parallel arrays in HOLDING_COLUMNS order for layout=columnar."""
+    if layout == "columnar":
+        return to_columnar(rows, HOLDING_COLUMNS)
+    return [holding_row(row) for row in rows]
+
+
+async def iter_holdings_ndjson(user_id: int, sector: Optional[str], chunk_size: int) -> AsyncIterator[bytes]:
+    """
+    All holdings as NDJSON, read through a server-side cursor and written one chunk of
+    lines at a time. Opens its own session: the request's session is closed by the time
+    a StreamingResponse body is iterated.
+    """
+    async with AsyncSessionLocal() as session:
+        result = await session.stream(holdings_query(user_id, sector=sector).execution_options(yield_per=chunk_size))
+        async for partition in result.partitions(chunk_size):
+            yield b"".join(dumps(holding_row(row)) + b"\n" for row in partition)
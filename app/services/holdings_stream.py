@@ -0,0 +1,272 @@
+import csv
+import json
+import math
+import re
+import time
+from typing import AsyncIterator, List, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import schemas
+from .instrument_registry import instrument_registry
+from .sector_allocations import refresh_user_sectors
+from .portfolio_version import bump_portfolio_version
+
+ISIN_RE = re.compile(schemas.ISIN_PATTERN)
+REQUIRED_FIELDS = ("isin_no", "quantity", "avg_price")
+STAGING_TABLE = "holdings_staging"
+MAX_REJECTED_SAMPLES = 100
+
+
+class StreamFormatError(ValueError):
+    """Raised when the uploaded stream can't be parsed at all (bad header etc.)."""
+
+
+class LineTooLong(StreamFormatError):
+    """Raised when a line exceeds the configured maximum, so one endless line can't grow the buffer unbounded."""
+
+
+def _decode(line: bytes) -> str:
+    return line.rstrip(b"\r").decode("utf-8-sig")
+
+
+async def iter_lines(byte_stream: AsyncIterator[bytes], max_line_bytes: int) -> AsyncIterator[str]:
+    """
+    Split an async byte stream into decoded lines without buffering the whole body.
+    Each piece is scanned once; only the unfinished tail line is carried over.
+    """
+    buffer = bytearray()
+    async for piece in byte_stream:
+        if not piece:
+            continue
+        start = 0
+        while (end := piece.find(b"\n", start)) >= 0:
+            if len(buffer) + end - start > max_line_bytes:
+                raise LineTooLong(f"Line longer than {max_line_bytes} bytes")
+            if buffer:
+                buffer += piece[start:end]
+                line = bytes(buffer)
+                buffer.clear()
+            else:
+                line = piece[start:end]
+            yield _decode(line)
+            start = end + 1
+        buffer += piece[start:]
+        if len(buffer) > max_line_bytes:
+            raise LineTooLong(f"Line longer than {max_line_bytes} bytes")
+    if buffer:
+        yield _decode(bytes(buffer))
+
+
+async def iter_raw_chunks(byte_stream: AsyncIterator[bytes], fmt: str, chunk_size: int,
+                          max_line_bytes: int) -> AsyncIterator[List[Tuple[int, object]]]:
+    """
+    Yield lists of (line_no, raw_row) with at most `chunk_size` entries.
+    raw_row is a dict for parsed rows, or an error string for rows that didn't parse.
+    """
+    header: Optional[List[str]] = None
+    chunk: List[Tuple[int, object]] = []
+    line_no = 0
+
+    async for line in iter_lines(byte_stream, max_line_bytes):
+        line_no += 1
+        if not line.strip():
+            continue
+
+        if fmt == "csv":
+            if header is None:
+                header = [col.strip().lower() for col in next(csv.reader([line]))]
+                missing = [f for f in REQUIRED_FIELDS if f not in header]
+                if missing:
+                    raise StreamFormatError(f"CSV header is missing columns: {', '.join(missing)}")
+                continue
+            values = next(csv.reader([line]))
+            if len(values) != len(header):
+                chunk.append((line_no, f"expected {len(header)} columns, got {len(values)}"))
+            else:
+                # extra columns (broker exports carry plenty) are ignored, in both formats
+                chunk.append((line_no, {k: v for k, v in zip(header, values) if k in REQUIRED_FIELDS}))
+        else:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                chunk.append((line_no, f"invalid JSON: {e.msg}"))
+            else:
+                if isinstance(row, dict):
+                    chunk.append((line_no, {k: v for k, v in row.items() if k in REQUIRED_FIELDS}))
+                else:
+                    chunk.append((line_no, "expected a JSON object"))
+
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def validate_row(raw: dict) -> Tuple[Optional[Tuple[str, float, float]], Optional[str]]:
+    """
+    Same field rules as schemas.StockHolding, without building a pydantic model per row.
+    Unlike the JSON upload, extra fields are dropped by iter_raw_chunks rather than rejected.
+    """
+    isin_no = raw.get("isin_no")
+    if not isinstance(isin_no, str) or not ISIN_RE.match(isin_no.strip()):
+        return None, f"invalid ISIN: {isin_no!r}"
+    isin_no = isin_no.strip()
+
+    try:
+        quantity = float(raw.get("quantity"))
+        avg_price = float(raw.get("avg_price"))
+    except (TypeError, ValueError):
+        return None, "quantity and avg_price must be numbers"
+
+    if not quantity.is_integer() or quantity <= 0:
+        return None, "quantity must be a positive integer"
+    if not math.isfinite(avg_price):
+        return None, "avg_price must be a finite number"
+    if not avg_price > 0:
+        return None, "avg_price must be greater than 0"
+
+    return (isin_no, quantity, avg_price), None
+
+
+async def create_staging_table(db: AsyncSession):
+    # temp table lives only for this transaction, so concurrent uploads never collide
+    await db.execute(text(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (
+            seq BIGINT NOT NULL,
+            isin_no VARCHAR NOT NULL,
+            quantity DOUBLE PRECISION NOT NULL,
+            avg_price DOUBLE PRECISION NOT NULL
+        ) ON COMMIT DROP
+    """))
+
+
+async def copy_to_staging(db: AsyncSession, records: List[Tuple[int, str, float, float]]):
+    conn = await db.connection()
+    raw_conn = await conn.get_raw_connection()
+    await raw_conn.driver_connection.copy_records_to_table(
+        STAGING_TABLE,
+        records=records,
+        columns=["seq", "isin_no", "quantity", "avg_price"],
+    )
+
+
+async def merge_staging(db: AsyncSession, user_id: int) -> Tuple[int, int]:
+    """Merge the staged chunk into holdings and empty the staging table. Returns (inserted, updated)."""
+    result = await db.execute(text(f"""
+        INSERT INTO holdings (user_id, isin_no, quantity, avg_price)
+        SELECT DISTINCT ON (isin_no) :user_id, isin_no, quantity, avg_price
+        FROM {STAGING_TABLE}
+        ORDER BY isin_no, seq DESC
+        ON CONFLICT (user_id, isin_no) DO UPDATE
+        SET quantity = EXCLUDED.quantity,
+            avg_price = EXCLUDED.avg_price,
+            updated_at = now()
+        RETURNING (xmax = 0) AS inserted
+    """), {"user_id": user_id})
+    flags = [row[0] for row in result.all()]
+    await db.execute(text(f"TRUNCATE {STAGING_TABLE}"))
+
+    inserted = sum(1 for f in flags if f)
+    return inserted, len(flags) - inserted
+
+
+async def stream_upload_holdings(db: AsyncSession, user_id: int, byte_stream: AsyncIterator[bytes], fmt: str, chunk_size: int,
+                                 max_line_bytes: int) -> dict:
+    """
+    Parse a CSV/NDJSON body chunk by chunk, COPY valid rows into a staging table and
+    merge each chunk into holdings. Only one chunk is held in memory at a time.
+    Does not commit, the caller owns the transaction.
+    """
+    started = time.perf_counter()
+    inserted, updated, rejected = 0, 0, 0
+    rejected_samples: List[dict] = []
+    chunk_stats: List[dict] = []
+    touched_isins = set()  # bounded by the instrument universe, not by file size
+    seq = 0
+
+    def reject(line_no: int, reason: str):
+        nonlocal rejected
+        rejected += 1
+        if len(rejected_samples) < MAX_REJECTED_SAMPLES:
+            rejected_samples.append({"line": line_no, "reason": reason})
+
+    await instrument_registry.ensure_loaded(db)
+    await create_staging_table(db)
+
+    chunks = iter_raw_chunks(byte_stream, fmt, chunk_size, max_line_bytes)
+    chunk_no = 0
+    while True:
+        t0 = time.perf_counter()
+        try:
+            raw_chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            break
+        chunk_no += 1
+        t1 = time.perf_counter()
+
+        # 1. Shape checks (regex, numbers)
+        candidates = []
+        chunk_rejected = 0
+        for line_no, raw in raw_chunk:
+            if isinstance(raw, str):
+                reject(line_no, raw)
+                chunk_rejected += 1
+                continue
+            row, error = validate_row(raw)
+            if error:
+                reject(line_no, error)
+                chunk_rejected += 1
+                continue
+            candidates.append((line_no, row))
+
+        # 2. Known-instrument check against the in-process registry
+        valid = instrument_registry.known({row[0] for _, row in candidates})
+        records = []
+        for line_no, (isin_no, quantity, avg_price) in candidates:
+            if isin_no not in valid:
+                reject(line_no, f"unknown ISIN: {isin_no}")
+                chunk_rejected += 1
+                continue
+            seq += 1
+            records.append((seq, isin_no, quantity, avg_price))
+            touched_isins.add(isin_no)
+        t2 = time.perf_counter()
+
+        # 3. COPY into staging and merge
+        if records:
+            await copy_to_staging(db, records)
+        t3 = time.perf_counter()
+        if records:
+            chunk_inserted, chunk_updated = await merge_staging(db, user_id)
+            inserted += chunk_inserted
+            updated += chunk_updated
+        t4 = time.perf_counter()
+
+        chunk_stats.append({
+            "chunk": chunk_no,
+            "rows": len(raw_chunk),
+            "accepted": len(records),
+            "rejected": chunk_rejected,
+            "parse_ms": round((t1 - t0) * 1000, 2),
+            "validate_ms": round((t2 - t1) * 1000, 2),
+            "copy_ms": round((t3 - t2) * 1000, 2),
+            "merge_ms": round((t4 - t3) * 1000, 2),
+        })
+
+    # keep per-user sector aggregates in the same transaction
+    await refresh_user_sectors(db, user_id, touched_isins)
+    if inserted or updated:
+        await bump_portfolio_version(db, user_id)
+
+    return {
+        "status": "success",
+        "inserted_records": inserted,
+        "updated_records": updated,
+        "rejected_rows": rejected,
+        "rejected_samples": rejected_samples,
+        "processed_count": inserted + updated,
+        "total_ms": round((time.perf_counter() - started) * 1000, 2),
+        "chunks": chunk_stats,
+    }
@@ -0,0 +1,58 @@
+from sqlalchemy import func, literal_column
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Iterable, Optional, Tuple
+from .. import models
+from .. config import settings
+
+# asyncpg caps a single statement at 32767 bind parameters (4 per row here)
+MAX_ROWS_PER_STATEMENT = 32767 // 4
+
+
+async def upsert_holdings(db: AsyncSession, user_id: int, rows: Iterable[dict], batch_size: Optional[int] = None) -> Tuple[int, int]:
+    """
+    Insert or update holdings for a user with set-based INSERT ... ON CONFLICT statements.
+    `rows` are dicts with isin_no, quantity and avg_price. Returns (inserted, updated).
+    Does not commit, the caller owns the transaction.
+    """
+    batch_size = batch_size or settings.holdings_upsert_batch_size
+    batch_size = max(1, min(batch_size, MAX_ROWS_PER_STATEMENT))
+
+    # Postgres can't touch the same row twice in one ON CONFLICT statement,
+    # so repeated ISINs are collapsed (last one wins, like the old row-by-row loop)
+    deduped = {}
+    for row in rows:
+        deduped[row["isin_no"]] = row
+    values = list(deduped.values())
+
+    table = models.Holdings.__table__
+    inserted, updated = 0, 0
+
+    for start in range(0, len(values), batch_size):
+        batch = values[start:start + batch_size]
+        stmt = insert(table).values([
+            {
+                "user_id": user_id,
+                "isin_no": row["isin_no"],
+                "quantity": row["quantity"],
+                "avg_price": row["avg_price"],
+            }
+            for row in batch
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.isin_no],
+            set_={
+                "quantity": stmt.excluded.quantity,
+                "avg_price": stmt.excluded.avg_price,
+                "updated_at": func.now(),
+            },
+        ).returning(literal_column("(xmax = 0)").label("inserted"))  # xmax = 0 -> fresh insert
+
+        result = await db.execute(stmt)
+        for (was_inserted,) in result.all():
+            if was_inserted:
+                inserted += 1
+            else:
+                updated += 1
+
+    return inserted, updated
@@ -0,0 +1,116 @@
+from typing import Dict, Iterable, NamedTuple, Optional
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models
+
+INSTRUMENTS_VERSION_KEY = "instruments"
+
+
+class InstrumentRecord(NamedTuple):
+    isin_no: str
+    trading_symbol: str
+    name: str
+    sector_name: str
+    industry_new_name: str
+    igroup_name: str
+    isubgroup_name: str
+
+
+async def get_stored_version(db: AsyncSession, name: str = INSTRUMENTS_VERSION_KEY) -> int:
+    version = await db.scalar(
+        select(models.MetadataVersion.version).where(models.MetadataVersion.name == name)
+    )
+    return version or 0
+
+
+async def get_stored_fingerprint(db: AsyncSession, name: str = INSTRUMENTS_VERSION_KEY) -> Optional[str]:
+    return await db.scalar(
+        select(models.MetadataVersion.fingerprint).where(models.MetadataVersion.name == name)
+    )
+
+
+async def bump_stored_version(db: AsyncSession, name: str = INSTRUMENTS_VERSION_KEY, fingerprint: Optional[str] = None) -> int:
+    """Increment the stored version (creating the row if needed), optionally recording a new fingerprint. Does not commit."""
+    result = await db.execute(text("""
+        INSERT INTO metadata_versions (name, version, fingerprint)
+        VALUES (:name, 1, :fingerprint)
+        ON CONFLICT (name) DO UPDATE
+        SET version = metadata_versions.version + 1,
+            fingerprint = COALESCE(EXCLUDED.fingerprint, metadata_versions.fingerprint),
+            updated_at = now()
+        RETURNING version
+    """), {"name": name, "fingerprint": fingerprint})
+    return result.scalar_one()
+
+
+class InstrumentRegistry:
+    """
+    In-process copy of the instruments table (~4,600 rows), keyed by ISIN.
+    Loaded once at startup and reloaded whenever the stored instruments version changes,
+    so ISIN validation and sector lookups don't need a DB round trip.
+    """
+
+    def __init__(self):
+        self._by_isin: Dict[str, InstrumentRecord] = {}
+        self.version: Optional[int] = None
+        self.loaded_at: Optional[datetime] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.version is not None
+
+    def __len__(self) -> int:
+        return len(self._by_isin)
+
+    def __contains__(self, isin_no: str) -> bool:
+        return isin_no in self._by_isin
+
+    def get(self, isin_no: str) -> Optional[InstrumentRecord]:
+        return self._by_isin.get(isin_no)
+
+    def records(self) -> Iterable[InstrumentRecord]:
+        return self._by_isin.values()
+
+    def known(self, isins: Iterable[str]) -> set:
+        by_isin = self._by_isin
+        return {isin_no for isin_no in isins if isin_no in by_isin}
+
+    async def load(self, db: AsyncSession):
+        version = await get_stored_version(db)
+        result = await db.execute(
+            select(
+                models.Instruments.isin_no,
+                models.Instruments.trading_symbol,
+                models.Instruments.name,
+                models.Instruments.sector_name,
+                models.Instruments.industry_new_name,
+                models.Instruments.igroup_name,
+                models.Instruments.isubgroup_name,
+            )
+        )
+        # build the new map first and swap it in, readers never see a half-loaded registry
+        self._by_isin = {row[0]: InstrumentRecord(*row) for row in result.all()}
+        self.version = version
+        self.loaded_at = datetime.now()
+        print(f"✅ Instrument registry loaded: {len(self._by_isin)} instruments (version {version})")
+
+    async def ensure_loaded(self, db: AsyncSession):
+        if not self.loaded:
+            await self.load(db)
+
+    async def refresh_if_stale(self, db: AsyncSession) -> bool:
+        """Reload if the stored version moved on. Returns True if a reload happened."""
+        version = await get_stored_version(db)
+        if version == self.version:
+            return False
+        await self.load(db)
+        return True
+
+    def invalidate(self):
+        """Force a reload on next ensure_loaded/refresh_if_stale (used after local metadata writes)."""
+        self.version = None
+
+
+instrument_registry = InstrumentRegistry()
@@ -0,0 +1,293 @@
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+from sqlalchemy import insert, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models
+from .. config import settings
+from .. database import BackgroundSessionLocal
+from .allocation import build_allocation_rows
+from .excel_writer import write_workbook
+from .instrument_registry import instrument_registry
+from .report_artifacts import REPORT_DIR, artifact_hash
+
+# every holding of every user after the checkpoint, in one pass ordered by user so each user's
+# rows arrive contiguously; the portfolio version comes from the same snapshot as the holdings
+SCAN_QUERY = text("""
+    SELECT h.user_id, h.isin_no, (h.quantity * h.avg_price)::float8 AS amount,
+           i.name, i.industry_new_name, COALESCE(pv.version, 0) AS portfolio_version
+    FROM holdings h
+    JOIN instruments i ON i.isin_no = h.isin_no
+    LEFT JOIN portfolio_versions pv ON pv.user_id = h.user_id
+    WHERE h.user_id > :after
+    ORDER BY h.user_id
+""")
+
+RESUMABLE_STATUSES = ("running", "failed", "interrupted")
+
+
+class _Classification(NamedTuple):
+    # the two InstrumentRecord fields build_allocation_rows reads
+    name: str
+    industry_new_name: str
+
+
+def nightly_report_path(user_id: int, run_id: int) -> Path:
+    """Fixed per run, so a resumed run overwrites a file it wrote before being interrupted."""
+    user_dir = REPORT_DIR / f"user_{user_id}"
+    user_dir.mkdir(parents=True, exist_ok=True)
+    return user_dir / f"allocation_report_nightly_{run_id}.xlsx"
+
+
+def build_user_reports(run_id: int, users: List[Tuple[int, int, list]]) -> dict:
+    """
+    Runs in a pool process: allocation rows + workbook for each (user_id, portfolio_version,
+    holdings) entry, holdings being (isin_no, amount, name, industry_new_name) tuples.
+    Returns the written files and the time spent per stage.
+    """
+    reports = []
+    compute_seconds = write_seconds = 0.0
+    for user_id, portfolio_version, holdings in users:
+        t0 = time.perf_counter()
+        # a plain dict stands in for the instrument registry, build_allocation_rows only calls .get()
+        classification = {isin_no: _Classification(name, sector) for isin_no, _, name, sector in holdings}
+        rows = build_allocation_rows(((isin_no, amount) for isin_no, amount, _, _ in holdings), classification)
+        t1 = time.perf_counter()
+        compute_seconds += t1 - t0
+        if not rows:
+            continue
+        file_path = nightly_report_path(user_id, run_id)
+        write_workbook(file_path, rows, sheet_name="Allocation Report")
+        write_seconds += time.perf_counter() - t1
+        reports.append((user_id, portfolio_version, str(file_path)))
+    return {"reports": reports, "compute_seconds": compute_seconds, "write_seconds": write_seconds}
+
+
+async def start_run(db: AsyncSession, resume: bool) -> models.ReportRun:
+    """The latest unfinished run when resuming (none left -> a new run), else a new run."""
+    run = None
+    if resume:
+        result = await db.execute(
+            select(models.ReportRun)
+            .where(models.ReportRun.status.in_(RESUMABLE_STATUSES))
+            .order_by(models.ReportRun.id.desc())
+            .limit(1)
+        )
+        run = result.scalars().first()
+    if run is None:
+        run = models.ReportRun(status="running", checkpoint_user_id=0, users_done=0, reports_written=0,
+                               scan_seconds=0.0, compute_seconds=0.0, write_seconds=0.0, db_seconds=0.0)
+        db.add(run)
+    else:
+        run.status = "running"
+        run.error = None
+    await db.commit()
+    await db.refresh(run)
+    return run
+
+
+# run columns tracked in memory while the run is going, written with every checkpoint
+RUN_STATE_COLUMNS = ("status", "checkpoint_user_id", "users_done", "reports_written", "scan_seconds",
+                     "compute_seconds", "write_seconds", "db_seconds", "error", "started_at", "finished_at")
+
+
+def run_state(run: models.ReportRun) -> dict:
+    return {"id": run.id, **{column: getattr(run, column) for column in RUN_STATE_COLUMNS}}
+
+
+def run_summary(state: dict) -> dict:
+    started_at, finished_at = state["started_at"], state["finished_at"]
+    elapsed = ((finished_at or datetime.now()) - started_at).total_seconds() if started_at else 0.0
+    return {
+        "run_id": state["id"],
+        "status": state["status"],
+        "checkpoint_user_id": state["checkpoint_user_id"],
+        "users_done": state["users_done"],
+        "reports_written": state["reports_written"],
+        "users_per_second": round(state["users_done"] / elapsed, 1) if elapsed else 0.0,
+        "scan_ms": round(state["scan_seconds"] * 1000, 2),
+        "compute_ms": round(state["compute_seconds"] * 1000, 2),
+        "write_ms": round(state["write_seconds"] * 1000, 2),
+        "db_ms": round(state["db_seconds"] * 1000, 2),
+        "started_at": started_at,
+        "finished_at": finished_at,
+        "error": state["error"],
+    }
+
+
+class _Task(NamedTuple):
+    last_user_id: int
+    user_count: int
+    future: asyncio.Future
+
+
+async def run_nightly_reports(resume: bool = False, workers: Optional[int] = None, users_per_task: Optional[int] = None,
+                              chunk_size: Optional[int] = None, progress_seconds: float = 10.0) -> dict:
+    """
+    Allocation report (excel) for every user with holdings. One ordered server-side scan
+    feeds batches of `users_per_task` users to a process pool; at most
+    nightly_tasks_per_worker tasks per process are pending, so memory stays bounded no
+    matter how many users there are. Tasks finish out of order but are recorded in scan
+    order: each recorded task inserts its Report rows and advances the run's checkpoint in
+    one transaction, so an interrupted run resumes (resume=True) right after the last
+    recorded user without duplicating reports.
+    """
+    workers = workers or settings.nightly_report_workers or os.cpu_count() or 1
+    users_per_task = users_per_task or settings.nightly_users_per_task
+    chunk_size = chunk_size or settings.analytics_chunk_size
+    max_in_flight = workers * settings.nightly_tasks_per_worker
+
+    async with BackgroundSessionLocal() as db, BackgroundSessionLocal() as scan:
+        run = run_state(await start_run(db, resume))
+        await instrument_registry.ensure_loaded(db)
+        instrument_version = instrument_registry.version
+        print(f"[Nightly Reports] run {run['id']} {'resumed after user ' + str(run['checkpoint_user_id']) if run['checkpoint_user_id'] else 'started'}"
+              f", {workers} processes, {users_per_task} users per task")
+
+        async def save_run(state: dict):
+            await db.execute(
+                update(models.ReportRun).where(models.ReportRun.id == run["id"])
+                .values(**{column: state[column] for column in RUN_STATE_COLUMNS if column != "started_at"})
+            )
+
+        loop = asyncio.get_running_loop()
+        executor = ProcessPoolExecutor(max_workers=workers)
+        in_flight: deque = deque()
+        started = time.perf_counter()
+        last_progress = started
+        users_this_session = 0
+
+        async def record_finished():
+            """Record finished tasks at the head of the queue (scan order) and advance the checkpoint."""
+            nonlocal last_progress, users_this_session
+            while in_flight and in_flight[0].future.done():
+                task = in_flight.popleft()
+                output = task.future.result()  # a failed task fails the run, the checkpoint stays before it
+                t0 = time.perf_counter()
+                expires_at = datetime.now() + timedelta(hours=settings.nightly_report_expiry_hours)
+                if output["reports"]:
+                    await db.execute(insert(models.Report), [
+                        {
+                            "user_id": user_id,
+                            "file_path": file_path,
+                            "expires_at": expires_at,
+                            "downloaded": False,
+                            "status": "done",
+                            "portfolio_version": portfolio_version,
+                            # same address as create-allocation-report, so later requests reuse these files
+                            "content_hash": artifact_hash(user_id, portfolio_version, instrument_version, "allocation-stock"),
+                        }
+                        for user_id, portfolio_version, file_path in output["reports"]
+                    ])
+                checkpoint = {
+                    **run,
+                    "checkpoint_user_id": task.last_user_id,
+                    "users_done": run["users_done"] + task.user_count,
+                    "reports_written": run["reports_written"] + len(output["reports"]),
+                    "compute_seconds": run["compute_seconds"] + output["compute_seconds"],
+                    "write_seconds": run["write_seconds"] + output["write_seconds"],
+                }
+                await save_run(checkpoint)
+                await db.commit()
+                # the in-memory state only moves once the reports and checkpoint are committed
+                run.update(checkpoint)
+                run["db_seconds"] += time.perf_counter() - t0
+                users_this_session += task.user_count
+
+                now = time.perf_counter()
+                if now - last_progress >= progress_seconds:
+                    last_progress = now
+                    print(f"[Nightly Reports] run {run['id']}: {run['users_done']} users, {run['reports_written']} reports, "
+                          f"{users_this_session / (now - started):.1f} users/s, checkpoint user {run['checkpoint_user_id']}")
+
+        async def wait_head():
+            # only the head can be recorded; waiting on any future would wake (and spin) every
+            # time a later task finishes while the head is still running
+            await asyncio.wait([in_flight[0].future])
+            await record_finished()
+
+        async def submit(batch: list):
+            while len(in_flight) >= max_in_flight:
+                await wait_head()
+            future = loop.run_in_executor(executor, build_user_reports, run["id"], batch)
+            in_flight.append(_Task(batch[-1][0], len(batch), future))
+
+        try:
+            batch: list = []
+            user_id = portfolio_version = None
+            holdings: list = []
+            t_scan = time.perf_counter()
+            result = await scan.stream(SCAN_QUERY.execution_options(yield_per=chunk_size), {"after": run["checkpoint_user_id"]})
+            async for partition in result.partitions(chunk_size):
+                for row_user_id, isin_no, amount, name, sector, row_version in partition:
+                    if row_user_id != user_id:
+                        if user_id is not None:
+                            batch.append((user_id, portfolio_version, holdings))
+                        if len(batch) >= users_per_task:
+                            run["scan_seconds"] += time.perf_counter() - t_scan
+                            await submit(batch)
+                            batch = []
+                            t_scan = time.perf_counter()
+                        user_id, portfolio_version, holdings = row_user_id, row_version, []
+                    holdings.append((isin_no, amount, name, sector))
+            if user_id is not None:
+                batch.append((user_id, portfolio_version, holdings))
+            run["scan_seconds"] += time.perf_counter() - t_scan
+            await scan.rollback()  # end the read-only scan transaction
+            if batch:
+                await submit(batch)
+
+            while in_flight:
+                await wait_head()
+
+            run["status"] = "done"
+            run["finished_at"] = datetime.now()
+        except (asyncio.CancelledError, KeyboardInterrupt):
+            run["status"] = "interrupted"
+            raise
+        except Exception as e:
+            run["status"] = "failed"
+            run["error"] = str(e)[:500]
+            print(f"[Nightly Reports Error] run {run['id']}: {e}")
+        finally:
+            # only recorded tasks count: anything in flight is redone on resume
+            executor.shutdown(wait=False, cancel_futures=True)
+            await db.rollback()
+            await save_run(run)
+            await db.commit()
+        return run_summary(run)
+
+
+async def list_runs(db: AsyncSession, limit: int = 20) -> List[dict]:
+    result = await db.execute(select(models.ReportRun).order_by(models.ReportRun.id.desc()).limit(limit))
+    return [run_summary(run_state(run)) for run in result.scalars().all()]
+
+
+if __name__ == "__main__":
+    # Nightly run:        python -m app.services.nightly_reports [--workers 8] [--users-per-task 50]
+    # After a crash/kill: python -m app.services.nightly_reports --resume
+    import argparse
+    from tabulate import tabulate
+    from ..database import dispose_engines
+
+    parser = argparse.ArgumentParser(description="Allocation report (excel) for every user, fanned out over a process pool")
+    parser.add_argument("--resume", action="store_true", help="continue the latest unfinished run from its checkpoint")
+    parser.add_argument("--workers", type=int, help="pool processes (default nightly_report_workers, else cpu count)")
+    parser.add_argument("--users-per-task", type=int)
+    parser.add_argument("--chunk-size", type=int, help="holdings rows per cursor fetch")
+    parser.add_argument("--progress-seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    async def _main():
+        try:
+            summary = await run_nightly_reports(args.resume, args.workers, args.users_per_task, args.chunk_size, args.progress_seconds)
+        finally:
+            await dispose_engines()
+        print(tabulate(summary.items(), headers=["metric", "value"]))
+
+    asyncio.run(_main())
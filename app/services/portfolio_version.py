@@ -0,0 +1,24 @@
+from sqlalchemy import text
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models
+
+
+async def get_portfolio_version(db: AsyncSession, user_id: int) -> int:
+    version = await db.scalar(
+        select(models.PortfolioVersion.version).where(models.PortfolioVersion.user_id == user_id)
+    )
+    return version or 0
+
+
+async def bump_portfolio_version(db: AsyncSession, user_id: int) -> int:
+    """Call on every holdings mutation, in the same transaction. Does not commit."""
+    result = await db.execute(text("""
+        INSERT INTO portfolio_versions (user_id, version)
+        VALUES (:user_id, 1)
+        ON CONFLICT (user_id) DO UPDATE
+        SET version = portfolio_versions.version + 1,
+            updated_at = now()
+        RETURNING version
+    """), {"user_id": user_id})
+    return result.scalar_one()
@@ -0,0 +1,234 @@
+import asyncio
+import json
+from abc import ABC, abstractmethod
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+from .. config import settings, BASE_URL
+from .instrument_registry import instrument_registry
+
+
+class PriceProviderError(Exception):
+    pass
+
+
+class PriceProvider(ABC):
+    """
+    Fetches last traded prices for a batch of instruments.
+    `fetch` takes ISINs and returns {isin: price}; ISINs without a quote are simply left out.
+    """
+    name = "base"
+    max_batch_size = 500
+
+    @abstractmethod
+    async def fetch(self, isins: List[str]) -> Dict[str, float]:
+        ...
+
+    async def close(self):
+        pass
+
+
+class StaticPriceProvider(PriceProvider):
+    """In-memory prices keyed by ISIN or trading symbol (tests, offline runs)."""
+    name = "static"
+
+    def __init__(self, prices: Dict[str, float]):
+        self.prices = {key: float(value) for key, value in prices.items()}
+
+    async def fetch(self, isins: List[str]) -> Dict[str, float]:
+        out = {}
+        for isin_no in isins:
+            price = self.prices.get(isin_no)
+            if price is None:
+                record = instrument_registry.get(isin_no)
+                price = self.prices.get(record.trading_symbol) if record else None
+            if price is not None:
+                out[isin_no] = price
+        return out
+
+
+class FilePriceProvider(StaticPriceProvider):
+    """Prices from a local JSON ({"INE117A01022": 5120.5, "ABB": ...}) or CSV (key,price) file."""
+    name = "file"
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        super().__init__(self._read())
+
+    def _read(self) -> Dict[str, float]:
+        if not self.path.is_file():
+            raise PriceProviderError(f"Price file not found: {self.path}")
+        if self.path.suffix == ".json":
+            return json.loads(self.path.read_text())
+        prices = {}
+        for line in self.path.read_text().splitlines():
+            key, _, value = line.partition(",")
+            try:
+                prices[key.strip()] = float(value)
+            except ValueError:
+                continue  # header / junk line
+        return prices
+
+
+class UpstoxPriceProvider(PriceProvider):
+    """Upstox v2 LTP quotes, instrument keys are NSE_EQ|<ISIN>. Connections come from one shared async pool."""
+    name = "upstox"
+    max_batch_size = 500  # Upstox limit per market-quote request
+    LTP_URL = "https://api.upstox.com/v2/market-quote/ltp"
+
+    def __init__(self, access_token: str, max_connections: int):
+        import httpx  # lazy, only needed when live prices are configured
+
+        self._client = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {access_token}", "Accept": "application/json"},
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(10.0),
+        )
+
+    async def fetch(self, isins: List[str]) -> Dict[str, float]:
+        keys = ",".join(f"NSE_EQ|{isin_no}" for isin_no in isins)
+        response = await self._client.get(self.LTP_URL, params={"instrument_key": keys})
+        if response.status_code != 200:
+            raise PriceProviderError(f"Upstox LTP request failed ({response.status_code}): {response.text[:200]}")
+        out = {}
+        for quote in response.json().get("data", {}).values():
+            token = quote.get("instrument_token", "")
+            price = quote.get("last_price")
+            if "|" in token and price is not None:
+                out[token.split("|", 1)[1]] = float(price)
+        return out
+
+    async def close(self):
+        await self._client.aclose()
+
+
+class PriceService:
+    """
+    Shared TTL cache in front of a PriceProvider. Misses are split into provider-sized
+    batches fetched concurrently (bounded), and concurrent callers asking for the same
+    ISIN wait on the one in-flight fetch instead of issuing their own.
+    """
+
+    def __init__(self, provider: PriceProvider, ttl_seconds: float, batch_size: int, max_concurrency: int):
+        self.provider = provider
+        self.ttl_seconds = ttl_seconds
+        self.batch_size = max(1, min(batch_size, provider.max_batch_size))
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._cache: Dict[str, tuple] = {}  # isin -> (price or None, expires_at)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.errors = 0
+
+    async def _fetch_batch(self, batch: List[str], futures: Dict[str, asyncio.Future]):
+        try:
+            async with self._semaphore:
+                self.batches += 1
+                prices = await self.provider.fetch(batch)
+        except Exception as e:
+            self.errors += 1
+            for isin_no in batch:
+                futures[isin_no].set_exception(e)
+        else:
+            expires_at = time.monotonic() + self.ttl_seconds
+            for isin_no in batch:
+                price = prices.get(isin_no)
+                self._cache[isin_no] = (price, expires_at)  # cache misses too, so unknown quotes aren't refetched
+                futures[isin_no].set_result(price)
+        finally:
+            for isin_no in batch:
+                self._inflight.pop(isin_no, None)
+                # only still pending when the initiating request was cancelled (e.g. client
+                # disconnect): release the callers coalesced onto this fetch
+                if not futures[isin_no].done():
+                    futures[isin_no].set_exception(PriceProviderError("Price fetch was cancelled"))
+
+    async def get_prices(self, isins: Iterable[str]) -> Dict[str, Optional[float]]:
+        now = time.monotonic()
+        result: Dict[str, Optional[float]] = {}
+        waiting: Dict[str, asyncio.Future] = {}
+        to_fetch: List[str] = []
+
+        for isin_no in set(isins):
+            cached = self._cache.get(isin_no)
+            if cached and cached[1] > now:
+                self.hits += 1
+                result[isin_no] = cached[0]
+            elif isin_no in self._inflight:
+                self.coalesced += 1
+                waiting[isin_no] = self._inflight[isin_no]
+            else:
+                self.misses += 1
+                to_fetch.append(isin_no)
+
+        if to_fetch:
+            loop = asyncio.get_running_loop()
+            futures = {isin_no: loop.create_future() for isin_no in to_fetch}
+            self._inflight.update(futures)
+            waiting.update(futures)
+            batches = [to_fetch[i:i + self.batch_size] for i in range(0, len(to_fetch), self.batch_size)]
+            await asyncio.gather(*(self._fetch_batch(batch, futures) for batch in batches))
+
+        values = await asyncio.gather(*waiting.values(), return_exceptions=True)
+        for isin_no, value in zip(waiting, values):
+            if isinstance(value, Exception):
+                raise PriceProviderError(f"Price fetch failed: {value}") from value
+            result[isin_no] = value
+        return result
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "provider": self.provider.name,
+            "cached": len(self._cache),
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "batches": self.batches,
+            "errors": self.errors,
+        }
+
+
+_price_service: Optional[PriceService] = None
+
+
+def build_provider() -> Optional[PriceProvider]:
+    if settings.price_provider == "upstox":
+        return UpstoxPriceProvider(settings.upstox_access_token, settings.price_max_concurrency)
+    if settings.price_provider == "file":
+        path = Path(settings.price_file_path)
+        return FilePriceProvider(path if path.is_absolute() else BASE_URL / path)
+    return None
+
+
+def get_price_service() -> Optional[PriceService]:
+    """Process-wide price service, None when no provider is configured."""
+    global _price_service
+    if _price_service is None:
+        provider = build_provider()
+        if provider is None:
+            return None
+        _price_service = PriceService(
+            provider,
+            ttl_seconds=settings.price_cache_ttl_seconds,
+            batch_size=settings.price_batch_size,
+            max_concurrency=settings.price_max_concurrency,
+        )
+    return _price_service
+
+
+def set_price_service(service: Optional[PriceService]):
+    """Swap the price service (e.g. a StaticPriceProvider in tests)."""
+    global _price_service
+    _price_service = service
+
+
+async def close_price_service():
+    global _price_service
+    if _price_service is not None:
+        await _price_service.provider.close()
+        _price_service = None
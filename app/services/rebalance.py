@@ -0,0 +1,306 @@
+import time
+from typing import Dict, List, Optional
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from .instrument_registry import instrument_registry
+
+UNKNOWN = "Unknown"
+LEVEL_FIELDS = {"sector": "sector_name", "industry": "industry_new_name"}
+
+# positions are valued at average cost, same basis as the allocation reports
+USER_HOLDINGS_QUERY = text("""
+    SELECT h.isin_no, h.quantity, h.avg_price
+    FROM holdings h
+    WHERE h.user_id = :user_id
+""")
+
+# ordered by user so each user's rows arrive contiguously, as in the firm exposure scan
+ALL_HOLDINGS_QUERY = text("""
+    SELECT h.user_id, h.isin_no, h.quantity, h.avg_price
+    FROM holdings h
+    ORDER BY h.user_id
+""")
+
+ACCOUNT_COLUMNS = ["user_id", "total", "turnover_pct", "out_of_band", "buy_amount", "sell_amount"]
+
+
+class UnknownTargets(ValueError):
+    pass
+
+
+def category_labels(level: str, targets: Dict[str, float]) -> List[str]:
+    """Every category of `level` in the instrument metadata; target names must be among them."""
+    field = LEVEL_FIELDS[level]
+    known = {getattr(r, field) for r in instrument_registry.records()} | {UNKNOWN}
+    unknown = sorted(set(targets) - known)
+    if unknown:
+        raise UnknownTargets(f"Unknown {level} name(s): {', '.join(unknown)}")
+    return sorted(known)
+
+
+def target_vector(labels: List[str], targets: Dict[str, float]):
+    """Target weights as fractions, aligned with `labels` (categories without a target get 0)."""
+    import numpy as np  # lazy, keeps numpy out of app startup
+    return np.array([targets.get(label, 0.0) / 100.0 for label in labels])
+
+
+def category_codes(isins, level: str, label_index: Dict[str, int]) -> tuple:
+    """(distinct ISINs, ISIN code per row, category code per row), each distinct ISIN resolved once."""
+    import numpy as np
+    field = LEVEL_FIELDS[level]
+    unique_isins, isin_codes = np.unique(isins, return_inverse=True)
+    records = [instrument_registry.get(isin) for isin in unique_isins]
+    category_of = np.array([label_index[getattr(r, field)] if r else label_index[UNKNOWN] for r in records], dtype=np.int64)
+    return unique_isins, isin_codes, category_of[isin_codes]
+
+
+def rebalance_arrays(user_codes, categories, quantities, prices, n_users: int, target_weights, tolerance_pp: float, cash=0.0) -> dict:
+    """
+    Rebalance `n_users` portfolios against one target weight vector in a single pass.
+    Rows are holdings (user code, category code, quantity, price). Categories that drifted
+    more than `tolerance_pp` from target are traded back to target, categories inside the
+    band are left alone. Trades are self-funding: when the buys cost more than the sells
+    plus `cash` bring in, every buy is scaled down by the same factor; whatever is left
+    over (cash, or sells nothing needed to be bought with) goes to the categories still
+    under target, pro rata to their shortfall, in band or not.
+    A category's trade is split over its holdings pro rata to their current value, in
+    whole shares: buys round down and sells round up, so the placed buys stay funded too.
+    A category with a 0 target is sold out completely. Buys into categories a user holds
+    nothing in can't be split and come back as `unplaced`.
+    """
+    import numpy as np
+    n = len(target_weights)
+    cells = user_codes * n + categories
+    amounts = quantities * prices
+    current = np.bincount(cells, weights=amounts, minlength=n_users * n).reshape(n_users, n)
+    totals = current.sum(axis=1)
+    weights = np.divide(current, totals[:, None], out=np.zeros_like(current), where=totals[:, None] > 0)
+    drift_pp = (weights - target_weights) * 100.0
+    out_of_band = np.abs(drift_pp) > tolerance_pp
+    target_values = (totals + cash)[:, None] * target_weights
+    trades = np.where(out_of_band, target_values - current, 0.0)
+
+    buys = np.maximum(trades, 0.0).sum(axis=1)
+    funding = np.maximum(-trades, 0.0).sum(axis=1) + cash
+    scale = np.minimum(np.divide(funding, buys, out=np.ones_like(buys), where=buys > 0), 1.0)
+    trades = np.where(trades > 0, trades * scale[:, None], trades)
+    leftover = funding - buys * scale
+    shortfall = np.maximum(target_values - current - trades, 0.0)
+    short_total = shortfall.sum(axis=1)
+    fill = np.minimum(np.divide(leftover, short_total, out=np.zeros_like(leftover), where=short_total > 0), 1.0)
+    trades = trades + shortfall * fill[:, None]
+
+    held = current[user_codes, categories]
+    share = np.divide(amounts, held, out=np.zeros_like(amounts), where=held > 0)
+    row_trades = trades[user_codes, categories] * share
+    # rounded to 9 places first so float noise doesn't tip an exact share count over
+    row_shares = np.round(np.divide(row_trades, prices, out=np.zeros_like(row_trades), where=prices > 0), 9)
+    whole_shares = np.maximum(np.floor(row_shares), -quantities)
+    sell_out = out_of_band[user_codes, categories] & (target_weights[categories] == 0)
+    quantity_change = np.where(sell_out, -quantities, whole_shares)
+    traded = quantity_change * prices
+
+    return {
+        "current": current,
+        "totals": totals,
+        "weights": weights,
+        "drift_pp": drift_pp,
+        "out_of_band": out_of_band,
+        "trades": trades,
+        "placed": np.bincount(cells, weights=traded, minlength=n_users * n).reshape(n_users, n),
+        "unplaced": np.where((current == 0) & (trades > 0), trades, 0.0),
+        "quantity_change": quantity_change,
+        "traded": traded,
+    }
+
+
+def _action(amount: float) -> str:
+    return "buy" if amount > 0 else "sell" if amount < 0 else "hold"
+
+
+async def rebalance_user(db: AsyncSession, user_id: int, level: str, targets: Dict[str, float],
+                         tolerance_pp: float, cash: float = 0.0) -> Optional[dict]:
+    """Buy/sell amount per category and quantity changes per ISIN for one user. None when the user has no holdings."""
+    import numpy as np
+    await instrument_registry.ensure_loaded(db)
+    labels = category_labels(level, targets)
+    rows = (await db.execute(USER_HOLDINGS_QUERY, {"user_id": user_id})).all()
+    if not rows:
+        return None
+
+    isins = np.array([r[0] for r in rows], dtype=object)
+    quantities = np.fromiter((r[1] for r in rows), dtype=np.float64, count=len(rows))
+    prices = np.fromiter((r[2] for r in rows), dtype=np.float64, count=len(rows))
+    target_weights = target_vector(labels, targets)
+    _, _, categories = category_codes(isins, level, {name: i for i, name in enumerate(labels)})
+
+    r = rebalance_arrays(np.zeros(len(rows), dtype=np.int64), categories, quantities, prices, 1, target_weights, tolerance_pp, cash)
+    current, trades, placed = r["current"][0], r["trades"][0], r["placed"][0]
+    total = float(r["totals"][0])
+    traded = r["traded"]
+
+    relevant = np.flatnonzero((current > 0) | (target_weights > 0))
+    relevant = relevant[np.argsort(-np.abs(trades[relevant]), kind="stable")]
+    changed = np.flatnonzero(r["quantity_change"])
+    changed = changed[np.lexsort((-np.abs(traded[changed]), categories[changed]))]
+
+    buys = float(traded[traded > 0].sum())
+    sells = float(-traded[traded < 0].sum())
+    return {
+        "level": level,
+        "tolerance_pp": tolerance_pp,
+        "total": round(total, 2),
+        "cash": cash,
+        "buy_amount": round(buys, 2),
+        "sell_amount": round(sells, 2),
+        "net_cash_after": round(cash + sells - buys, 2),
+        "turnover_pct": round(float(np.abs(trades).sum()) * 50.0 / total, 4) if total else 0.0,
+        "categories": [
+            {
+                "name": labels[i],
+                "current_value": round(float(current[i]), 2),
+                "current_pct": round(float(r["weights"][0, i]) * 100.0, 4),
+                "target_pct": round(float(target_weights[i]) * 100.0, 4),
+                "drift_pp": round(float(r["drift_pp"][0, i]), 4),
+                "in_band": not r["out_of_band"][0, i],
+                "action": _action(trades[i]),
+                "amount": round(abs(float(trades[i])), 2),
+                # after rounding to whole shares
+                "placed_amount": round(abs(float(placed[i])), 2),
+                "unplaced_amount": round(float(r["unplaced"][0, i]), 2),
+            }
+            for i in relevant
+        ],
+        "trades": [
+            {
+                "isin_no": isins[i],
+                "name": getattr(instrument_registry.get(isins[i]), "name", isins[i]),
+                "category": labels[categories[i]],
+                "quantity": float(quantities[i]),
+                "price": float(prices[i]),
+                "quantity_change": float(r["quantity_change"][i]),
+                "amount": round(float(traded[i]), 2),
+            }
+            for i in changed
+        ],
+    }
+
+
+async def rebalance_batch(db: AsyncSession, level: str, targets: Dict[str, float], tolerance_pp: float, chunk_size: int) -> dict:
+    """
+    Rebalance every user against one model portfolio. Holdings are read through a
+    server-side cursor in chunks of `chunk_size` rows; each chunk's complete users go
+    through rebalance_arrays in one call. Returns firm-wide buy/sell per category,
+    net order quantities per ISIN, and the accounts that need trades (columnar).
+    """
+    import numpy as np
+    started = time.perf_counter()
+    await instrument_registry.ensure_loaded(db)
+    labels = category_labels(level, targets)
+    label_index = {name: i for i, name in enumerate(labels)}
+    target_weights = target_vector(labels, targets)
+    n = len(labels)
+
+    category_buy = np.zeros(n)
+    category_sell = np.zeros(n)
+    category_unplaced = np.zeros(n)
+    accounts_out_of_band = np.zeros(n, dtype=np.int64)
+    isin_orders: Dict[str, list] = {}  # isin -> [buy quantity, sell quantity]
+    accounts: List[list] = [[] for _ in ACCOUNT_COLUMNS]
+    user_count = rows_read = chunks = 0
+    compute_seconds = 0.0
+    carry = None  # rows of the last user of the previous chunk, which may continue in the next one
+
+    def process(user_ids, isins, quantities, prices):
+        nonlocal user_count, compute_seconds
+        if not len(user_ids):
+            return
+        t0 = time.perf_counter()
+        unique_users, user_codes = np.unique(user_ids, return_inverse=True)
+        unique_isins, isin_codes, categories = category_codes(isins, level, label_index)
+        r = rebalance_arrays(user_codes, categories, quantities, prices, len(unique_users), target_weights, tolerance_pp)
+
+        traded = r["traded"]
+        buys = np.maximum(traded, 0.0)
+        sells = np.maximum(-traded, 0.0)
+        category_buy[:] += np.bincount(categories, weights=buys, minlength=n)
+        category_sell[:] += np.bincount(categories, weights=sells, minlength=n)
+        category_unplaced[:] += r["unplaced"].sum(axis=0)
+        accounts_out_of_band[:] += r["out_of_band"].sum(axis=0)
+
+        quantity_change = r["quantity_change"]
+        buy_qty = np.bincount(isin_codes, weights=np.maximum(quantity_change, 0.0), minlength=len(unique_isins))
+        sell_qty = np.bincount(isin_codes, weights=np.maximum(-quantity_change, 0.0), minlength=len(unique_isins))
+        for i in np.flatnonzero(buy_qty + sell_qty):
+            order = isin_orders.setdefault(unique_isins[i], [0.0, 0.0])
+            order[0] += buy_qty[i]
+            order[1] += sell_qty[i]
+
+        totals = r["totals"]
+        needs_trades = (r["trades"] != 0).any(axis=1) & (totals > 0)
+        columns = (
+            unique_users,
+            np.round(totals, 2),
+            np.round(np.divide(np.abs(r["trades"]).sum(axis=1) * 50.0, totals, out=np.zeros_like(totals), where=totals > 0), 4),
+            r["out_of_band"].sum(axis=1),
+            np.round(np.bincount(user_codes, weights=buys, minlength=len(unique_users)), 2),
+            np.round(np.bincount(user_codes, weights=sells, minlength=len(unique_users)), 2),
+        )
+        for column, values in zip(accounts, columns):
+            column.extend(values[needs_trades].tolist())
+        user_count += len(unique_users)
+        compute_seconds += time.perf_counter() - t0
+
+    result = await db.stream(ALL_HOLDINGS_QUERY.execution_options(yield_per=chunk_size))
+    async for partition in result.partitions(chunk_size):
+        chunks += 1
+        rows_read += len(partition)
+        user_ids = np.fromiter((r[0] for r in partition), dtype=np.int64, count=len(partition))
+        isins = np.array([r[1] for r in partition], dtype=object)
+        quantities = np.fromiter((r[2] for r in partition), dtype=np.float64, count=len(partition))
+        prices = np.fromiter((r[3] for r in partition), dtype=np.float64, count=len(partition))
+
+        if carry is not None:
+            user_ids = np.concatenate([carry[0], user_ids])
+            isins = np.concatenate([carry[1], isins])
+            quantities = np.concatenate([carry[2], quantities])
+            prices = np.concatenate([carry[3], prices])
+
+        # everyone except the last user in this chunk is complete
+        complete = user_ids != user_ids[-1]
+        process(user_ids[complete], isins[complete], quantities[complete], prices[complete])
+        carry = (user_ids[~complete], isins[~complete], quantities[~complete], prices[~complete])
+
+    if carry is not None:
+        process(*carry)
+
+    elapsed = time.perf_counter() - started
+    return {
+        "level": level,
+        "tolerance_pp": tolerance_pp,
+        "users": user_count,
+        "holdings": rows_read,
+        "chunks": chunks,
+        "chunk_size": chunk_size,
+        "elapsed_ms": round(elapsed * 1000, 2),
+        "compute_ms": round(compute_seconds * 1000, 2),
+        "users_per_second": round(user_count / elapsed, 1) if elapsed else 0.0,
+        "categories": [
+            {
+                "name": labels[i],
+                "target_pct": round(float(target_weights[i]) * 100.0, 4),
+                "accounts_out_of_band": int(accounts_out_of_band[i]),
+                "buy_amount": round(float(category_buy[i]), 2),
+                "sell_amount": round(float(category_sell[i]), 2),
+                # buys for accounts holding nothing in the category yet
+                "unplaced_amount": round(float(category_unplaced[i]), 2),
+            }
+            for i in range(n)
+            if category_buy[i] or category_sell[i] or target_weights[i] or accounts_out_of_band[i]
+        ],
+        "isin_orders": [
+            {"isin_no": isin_no, "buy_quantity": float(buy), "sell_quantity": float(sell), "net_quantity": float(buy - sell)}
+            for isin_no, (buy, sell) in sorted(isin_orders.items())
+        ],
+        "accounts": {"columns": ACCOUNT_COLUMNS, "data": accounts, "count": len(accounts[0])},
+    }
@@ -0,0 +1,96 @@
+import hashlib
+import os
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models
+from .. config import settings
+
+REPORT_DIR = Path("reports")
+
+
+def new_report_path(user_id: int) -> Path:
+    user_dir = REPORT_DIR / f"user_{user_id}"
+    user_dir.mkdir(parents=True, exist_ok=True)
+    return user_dir / f"allocation_report_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.xlsx"
+
+
+def artifact_hash(user_id: int, portfolio_version: int, instrument_version: int, kind: str, format: str = "excel") -> str:
+    """
+    Content address of a report file: (user, holdings version) pins the holdings state,
+    the instruments version pins names/sectors, kind + format pin the layout. Equal
+    hashes mean byte-for-byte the same report.
+    """
+    return hashlib.sha256(f"{user_id}:{portfolio_version}:{instrument_version}:{kind}:{format}".encode()).hexdigest()
+
+
+class ArtifactStats:
+    """Per-worker counters: how often a report file was reused instead of written."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.generation_seconds = 0.0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        avg_ms = self.generation_seconds * 1000 / self.misses if self.misses else 0.0
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "generation_ms_total": round(self.generation_seconds * 1000, 2),
+            "avg_generation_ms": round(avg_ms, 2),
+            # estimate: each hit skipped one average-cost generation
+            "est_saved_ms": round(self.hits * avg_ms, 2),
+        }
+
+
+artifact_stats = ArtifactStats()
+
+
+async def find_artifact(db: AsyncSession, content_hash: str) -> Optional[str]:
+    """
+    File path of a finished, live report with this hash. Only files that stay live for
+    report_reuse_min_remaining_seconds qualify, so the cleanup sweep can't unlink a file
+    between this lookup and the new row referencing it being committed.
+    """
+    min_expires_at = datetime.now() + timedelta(seconds=settings.report_reuse_min_remaining_seconds)
+    result = await db.execute(
+        select(models.Report.file_path)
+        .where(
+            models.Report.content_hash == content_hash,
+            models.Report.is_deleted == False,
+            models.Report.status == "done",
+            models.Report.expires_at > min_expires_at,
+        )
+        .order_by(models.Report.expires_at.desc())
+        .limit(1)
+    )
+    file_path = result.scalar()
+    # files are node-local, another worker's file may not be here
+    if file_path is None or not os.path.isfile(file_path):
+        return None
+    return file_path
+
+
+async def reuse_or_write(db: AsyncSession, content_hash: str, user_id: int,
+                         write: Callable[[Path], Awaitable], file_path: Optional[str] = None) -> Tuple[str, bool]:
+    """
+    Path of a live report file with this hash, or `write(path)` a new one (to `file_path`
+    when given, else a fresh path). Returns (file_path, reused).
+    """
+    existing = await find_artifact(db, content_hash)
+    if existing is not None:
+        artifact_stats.hits += 1
+        return existing, True
+
+    path = Path(file_path) if file_path else new_report_path(user_id)
+    started = time.perf_counter()
+    await write(path)
+    artifact_stats.misses += 1
+    artifact_stats.generation_seconds += time.perf_counter() - started
+    return str(path), False
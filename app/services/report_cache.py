@@ -0,0 +1,19 @@
+from .. config import settings
+from .lru_cache import LRUTTLCache
+
+
+class ReportCache(LRUTTLCache):
+    """
+    Allocation report results. Keys include the user's portfolio version, so a holdings
+    change never serves stale data; the TTL only bounds how long unused entries hang around.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        super().__init__(max_entries, ttl_seconds)
+        self.not_modified = 0  # 304s answered from the ETag alone
+
+    def stats(self) -> dict:
+        return {**super().stats(), "not_modified": self.not_modified}
+
+
+report_cache = ReportCache(settings.report_cache_max_entries, settings.report_cache_ttl_seconds)
@@ -0,0 +1,175 @@
+import asyncio
+import csv
+import io
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, List, Optional, Sequence
+from .. config import settings
+from .excel_writer import write_workbook_stream
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "excel": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+}
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+class ExportUnavailable(Exception):
+    pass
+
+
+class _ExportCancelled(Exception):
+    pass
+
+
+class _QueueWriter(io.RawIOBase):
+    """
+    Write-only, non-seekable file object used by a worker thread. Bytes are buffered up
+    to `chunk_bytes` and handed to the event loop through a bounded asyncio queue, so a
+    slow client throttles the writer instead of the body piling up in memory.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue, chunk_bytes: int):
+        super().__init__()
+        self.loop = loop
+        self.queue = queue
+        self.chunk_bytes = chunk_bytes
+        self.buffer = bytearray()
+        self.position = 0
+        self.cancelled = False
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        if self.cancelled:
+            if self.closed:
+                return len(data)  # late writes from a writer's finalizer, e.g. ZipFile.__del__
+            self.close()
+            raise _ExportCancelled()
+        self.buffer += data
+        self.position += len(data)
+        if len(self.buffer) >= self.chunk_bytes:
+            self._put(bytes(self.buffer))
+            self.buffer.clear()
+        return len(data)
+
+    def flush(self):
+        # the writer's finalizer (ZipFile.__del__ -> close -> flush) may run after a cancel
+        # closed us, and IOBase.flush raises on a closed file
+        if self.cancelled or self.closed:
+            return
+        super().flush()
+
+    def _put(self, item):
+        asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop).result()
+
+    def finish(self, error: Optional[BaseException] = None):
+        if self.buffer and error is None:
+            self._put(bytes(self.buffer))
+            self.buffer.clear()
+        self._put(error)  # None marks the end of the body
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.report_executor_workers, thread_name_prefix="report-export")
+    return _executor
+
+
+async def stream_from_writer(write: Callable[[io.RawIOBase], None]) -> AsyncIterator[bytes]:
+    """
+    Run `write(fileobj)` in the export thread pool and yield what it writes, as it
+    writes it. Nothing touches the reports directory and no Report row is created.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=settings.report_export_queue_chunks)
+    writer = _QueueWriter(loop, queue, settings.report_export_chunk_bytes)
+
+    def produce():
+        try:
+            write(writer)
+        except _ExportCancelled:
+            return
+        except BaseException as e:
+            writer.finish(e)
+            return
+        writer.finish()
+
+    producer = loop.run_in_executor(_get_executor(), produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # client went away (or we failed): unblock the writer thread and let it stop
+        writer.cancelled = True
+        while not producer.done():
+            while not queue.empty():
+                queue.get_nowait()
+            await asyncio.sleep(0.01)
+
+
+async def iter_csv(rows: List[dict], columns: Sequence[str], chunk_rows: int) -> AsyncIterator[bytes]:
+    """CSV is cheap enough to encode on the event loop, one chunk of rows per yield."""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    for start in range(0, len(rows), chunk_rows):
+        writer.writerows([row.get(col) for col in columns] for row in rows[start:start + chunk_rows])
+        yield out.getvalue().encode()
+        out.seek(0)
+        out.truncate()
+    if out.tell():
+        yield out.getvalue().encode()
+
+
+def write_parquet(fileobj, rows: List[dict], columns: Sequence[str], row_group_rows: int):
+    """One row group per `row_group_rows` rows, each flushed to fileobj as soon as it is encoded."""
+    import pyarrow as pa  # lazy and optional
+    import pyarrow.parquet as pq
+
+    schema = None
+    writer = None
+    try:
+        for start in range(0, max(len(rows), 1), row_group_rows):
+            chunk = rows[start:start + row_group_rows]
+            table = pa.Table.from_pydict({col: [row.get(col) for row in chunk] for col in columns}, schema=schema)
+            if writer is None:
+                schema = table.schema
+                writer = pq.ParquetWriter(fileobj, schema, compression="snappy")
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def export_stream(format: str, rows: List[dict], sheet_name: str = "Allocation Report") -> AsyncIterator[bytes]:
+    """Body iterator for a direct (not persisted) export of report rows."""
+    columns = list(rows[0].keys()) if rows else []
+    if format == "csv":
+        return iter_csv(rows, columns, settings.report_export_chunk_rows)
+    if format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ExportUnavailable("Parquet export needs pyarrow installed")
+        return stream_from_writer(lambda f: write_parquet(f, rows, columns, settings.report_export_chunk_rows))
+    # openpyxl write-only mode; the zip is written straight into the response stream
+    return stream_from_writer(lambda f: write_workbook_stream(f, [(sheet_name, rows, columns)]))
+
+
+def shutdown_export_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,231 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set, Tuple
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models
+from .. config import settings
+from .. database import BackgroundSessionLocal
+from .allocation import get_allocation_rows
+from .excel_writer import write_workbook_async
+from .instrument_registry import instrument_registry
+from .portfolio_version import get_portfolio_version
+from .report_artifacts import REPORT_DIR, new_report_path, artifact_hash, reuse_or_write
+from .snapshots import snapshot_report_run
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class NoHoldings(Exception):
+    pass
+
+
+def job_summary(report: models.Report, coalesced: bool = False) -> dict:
+    def ms(start, end):
+        return round((end - start).total_seconds() * 1000, 2) if start and end else None
+
+    return {
+        "job_id": report.id,
+        "status": report.status,
+        "coalesced": coalesced,
+        "portfolio_version": report.portfolio_version,
+        "created_at": report.created_at,
+        "started_at": report.started_at,
+        "finished_at": report.finished_at,
+        "queued_ms": ms(report.created_at, report.started_at),
+        "run_ms": ms(report.started_at, report.finished_at),
+        "expires_at": report.expires_at if report.status == "done" else None,
+        "error": report.error,
+    }
+
+
+async def find_reusable_report(db: AsyncSession, user_id: int, portfolio_version: int) -> Optional[models.Report]:
+    """
+    An active job, or an unexpired finished report, built from the same holdings version.
+    An active job's expires_at is its lease (report_jobs_stale_seconds from when it was
+    queued, renewed when it starts running), so a job whose worker died isn't reused past it.
+    """
+    result = await db.execute(
+        select(models.Report)
+        .where(
+            models.Report.user_id == user_id,
+            models.Report.portfolio_version == portfolio_version,
+            models.Report.is_deleted == False,
+            models.Report.status.in_(ACTIVE_STATUSES + ("done",)),
+            models.Report.expires_at > datetime.now(),
+        )
+        .order_by(models.Report.id.desc())
+    )
+    return result.scalars().first()
+
+
+class ReportJobScheduler:
+    """
+    In-process scheduler for excel report jobs. Job state lives on models.Report so any
+    worker can answer status requests; this worker only bounds how many of its own jobs
+    run at once (semaphore) and how many may wait (queue limit).
+    """
+
+    def __init__(self, max_concurrent: int, max_queued: int):
+        self.max_queued = max_queued
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._tasks: Set[asyncio.Task] = set()
+        self._submit_locks: Dict[Tuple[int, int], list] = {}  # key -> [lock, submits holding or waiting]
+        self.submitted = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    async def submit(self, db: AsyncSession, user_id: int) -> Tuple[models.Report, bool]:
+        """Returns (report, coalesced). Raises JobQueueFull when this worker's queue is full."""
+        portfolio_version = await get_portfolio_version(db, user_id)
+        key = (user_id, portfolio_version)
+
+        # serialize submits for the same key within this worker, the partial unique
+        # index on reports covers concurrent submits from other workers. The entry is
+        # refcounted: dropping it while a submit still waits on its lock would let the
+        # next submit create a second lock for the same key
+        entry = self._submit_locks.setdefault(key, [asyncio.Lock(), 0])
+        lock = entry[0]
+        entry[1] += 1
+        try:
+            async with lock:
+                existing = await find_reusable_report(db, user_id, portfolio_version)
+                if existing:
+                    self.coalesced += 1
+                    return existing, True
+
+                if self.pending >= self.max_queued:
+                    raise JobQueueFull(f"{self.pending} report jobs already pending")
+
+                # a job past its lease would still block this one on uq_reports_active_job
+                await db.execute(abandon_expired_jobs(
+                    models.Report.user_id == user_id, models.Report.portfolio_version == portfolio_version
+                ))
+
+                report = models.Report(
+                    user_id=user_id,
+                    file_path=str(new_report_path(user_id)),
+                    # placeholder until the job finishes, reset to finished_at + expiry
+                    expires_at=datetime.now() + timedelta(seconds=settings.report_jobs_stale_seconds),
+                    downloaded=False,
+                    status="queued",
+                    portfolio_version=portfolio_version,
+                )
+                db.add(report)
+                try:
+                    await db.commit()
+                except IntegrityError:
+                    await db.rollback()
+                    existing = await find_reusable_report(db, user_id, portfolio_version)
+                    if existing is None:
+                        raise
+                    self.coalesced += 1
+                    return existing, True
+                await db.refresh(report)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._submit_locks[key]
+
+        self.submitted += 1
+        task = asyncio.create_task(self._run(report.id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return report, False
+
+    async def _build(self, session: AsyncSession, report_id: int) -> dict:
+        report = await session.get(models.Report, report_id)
+        user_id, file_path, portfolio_version = report.user_id, report.file_path, report.portfolio_version
+        report.status = "running"
+        report.started_at = datetime.now()
+        report.expires_at = report.started_at + timedelta(seconds=settings.report_jobs_stale_seconds)  # renew the lease
+        await session.commit()
+
+        async def write(path):
+            data = await get_allocation_rows(session, user_id)
+            if not data:
+                raise NoHoldings("No holdings found for this user.")
+            await write_workbook_async(path, data, sheet_name="Allocation Report")
+
+        # same content address as the synchronous stock-level excel report
+        await instrument_registry.ensure_loaded(session)
+        content_hash = artifact_hash(user_id, portfolio_version, instrument_registry.version, "allocation-stock")
+        file_path, _ = await reuse_or_write(session, content_hash, user_id, write, file_path)
+        await snapshot_report_run(session, user_id, portfolio_version)
+        finished_at = datetime.now()
+        return {
+            "status": "done",
+            "file_path": file_path,
+            "content_hash": content_hash,
+            "finished_at": finished_at,
+            "expires_at": finished_at + timedelta(minutes=settings.report_expiry_minutes),
+        }
+
+    async def _run(self, report_id: int):
+        async with BackgroundSessionLocal() as session:
+            values = None
+            error = "cancelled"
+            try:
+                async with self._semaphore:
+                    values = await self._build(session, report_id)
+                self.completed += 1
+            except Exception as e:
+                error = str(e)[:500]
+                print(f"[Report Job Error] report {report_id}: {e}")
+            finally:
+                # also on cancellation (shutdown), so the job never stays queued/running
+                if values is None:
+                    await session.rollback()
+                    finished_at = datetime.now()
+                    values = {"status": "failed", "error": error, "finished_at": finished_at, "expires_at": finished_at}
+                    self.failed += 1
+                await session.execute(
+                    update(models.Report).where(models.Report.id == report_id).values(**values)
+                )
+                await session.commit()
+
+    async def shutdown(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "max_queued": self.max_queued,
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+def abandon_expired_jobs(*where):
+    """Fail active jobs past their lease: their worker died (or was killed) before finishing them."""
+    now = datetime.now()
+    return (
+        update(models.Report)
+        .where(models.Report.status.in_(ACTIVE_STATUSES), models.Report.expires_at <= now, *where)
+        .values(status="failed", error="abandoned", finished_at=now)
+    )
+
+
+async def fail_abandoned_jobs(db: AsyncSession) -> int:
+    """Startup hook: jobs left queued/running by a worker that died will never finish."""
+    result = await db.execute(abandon_expired_jobs())
+    await db.commit()
+    return result.rowcount
+
+
+report_scheduler = ReportJobScheduler(settings.report_jobs_max_concurrent, settings.report_jobs_max_queued)
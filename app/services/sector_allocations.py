@@ -0,0 +1,198 @@
+import time
+from typing import Iterable, List, Optional
+from sqlalchemy import text, exists
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models
+
+# Recompute the given user's totals for the sectors the touched ISINs belong to.
+# Uploads overwrite quantity/avg_price, so recomputing the touched sectors from holdings
+# is both exact and cheap (one grouped statement over a single user's rows).
+REFRESH_USER_SECTORS_QUERY = text("""
+    INSERT INTO user_sector_allocations (user_id, sector, invested_amount, position_count)
+    SELECT h.user_id, i.industry_new_name, SUM(h.quantity * h.avg_price), COUNT(*)
+    FROM holdings h
+    JOIN instruments i ON h.isin_no = i.isin_no
+    WHERE h.user_id = :user_id
+      AND i.industry_new_name IN (
+          SELECT industry_new_name FROM instruments WHERE isin_no = ANY(:isins)
+      )
+    GROUP BY h.user_id, i.industry_new_name
+    ON CONFLICT (user_id, sector) DO UPDATE
+    SET invested_amount = EXCLUDED.invested_amount,
+        position_count = EXCLUDED.position_count,
+        updated_at = now()
+""")
+
+REBUILD_SQL = """
+    INSERT INTO user_sector_allocations (user_id, sector, invested_amount, position_count)
+    SELECT h.user_id, i.industry_new_name, SUM(h.quantity * h.avg_price), COUNT(*)
+    FROM holdings h
+    JOIN instruments i ON h.isin_no = i.isin_no
+    {where}
+    GROUP BY h.user_id, i.industry_new_name
+"""
+
+# users whose stored totals differ from what holdings say right now
+CHECK_QUERY = text("""
+    WITH expected AS (
+        SELECT h.user_id, i.industry_new_name AS sector,
+               SUM(h.quantity * h.avg_price) AS invested_amount, COUNT(*) AS position_count
+        FROM holdings h
+        JOIN instruments i ON h.isin_no = i.isin_no
+        GROUP BY h.user_id, i.industry_new_name
+    )
+    SELECT DISTINCT COALESCE(e.user_id, a.user_id) AS user_id
+    FROM expected e
+    FULL OUTER JOIN user_sector_allocations a
+        ON a.user_id = e.user_id AND a.sector = e.sector
+    WHERE e.user_id IS NULL
+       OR a.user_id IS NULL
+       OR a.position_count <> e.position_count
+       OR abs(a.invested_amount - e.invested_amount) > 0.01
+    ORDER BY 1
+""")
+
+
+# first key of the two-key advisory locks below, so per-user locks don't share a key
+# space with other advisory locks in the database (user 42 vs. some other lock on 42)
+SECTOR_LOCK_NAMESPACE = 7301
+
+# transaction-scoped, released on commit/rollback
+LOCK_USER_QUERY = text("SELECT pg_advisory_xact_lock(:namespace, :user_id)")
+
+# several users in ascending id order (the subquery fixes the order the locks are taken in),
+# so two bulk rebuilds can't deadlock on each other
+LOCK_USERS_QUERY = text("""
+    SELECT pg_advisory_xact_lock(:namespace, u.user_id)
+    FROM (SELECT DISTINCT user_id FROM unnest(CAST(:user_ids AS integer[])) AS user_id ORDER BY user_id) u
+""")
+
+# a full rebuild locks out every concurrent refresh instead of taking one lock per user:
+# the refresh INSERT waits here, and its snapshot is taken after the lock is granted
+LOCK_TABLE_QUERY = text("LOCK TABLE user_sector_allocations IN SHARE ROW EXCLUSIVE MODE")
+
+
+async def lock_user_sectors(db: AsyncSession, user_id: int):
+    """
+    Serialize aggregate writes per user. Without it two concurrent uploads each recompute
+    from a snapshot missing the other's uncommitted holdings, and whichever commits last
+    leaves a stale total. Once the lock is granted the other transaction has committed,
+    and the next statement (READ COMMITTED) sees its rows.
+    """
+    await db.execute(LOCK_USER_QUERY, {"namespace": SECTOR_LOCK_NAMESPACE, "user_id": user_id})
+
+
+async def refresh_user_sectors(db: AsyncSession, user_id: int, isins: Iterable[str]):
+    """Bring the user's aggregates for the sectors of `isins` up to date. Does not commit."""
+    isins = list(isins)
+    if not isins:
+        return
+    await lock_user_sectors(db, user_id)
+    await db.execute(REFRESH_USER_SECTORS_QUERY, {"user_id": user_id, "isins": isins})
+
+
+async def clear_user_sectors(db: AsyncSession, user_id: int):
+    """Used when all of a user's holdings are deleted. Does not commit."""
+    await lock_user_sectors(db, user_id)
+    await db.execute(
+        models.SectorAllocation.__table__.delete().where(models.SectorAllocation.user_id == user_id)
+    )
+
+
+async def get_user_sectors(db: AsyncSession, user_id: int) -> List[dict]:
+    result = await db.execute(
+        select(
+            models.SectorAllocation.sector,
+            models.SectorAllocation.invested_amount,
+            models.SectorAllocation.position_count,
+        )
+        .where(models.SectorAllocation.user_id == user_id)
+        .order_by(models.SectorAllocation.sector)
+    )
+    return [dict(r) for r in result.mappings().all()]
+
+
+def build_sector_rows(sectors: List[dict]) -> List[dict]:
+    total_portfolio = sum(s["invested_amount"] for s in sectors)
+    if not total_portfolio:
+        return []
+    return [
+        {
+            "sector": s["sector"],
+            "sector_total": s["invested_amount"],
+            "position_count": s["position_count"],
+            "sector_pct_of_portfolio": round(s["invested_amount"] * 100.0 / total_portfolio, 2),
+        }
+        for s in sectors
+    ]
+
+
+async def rebuild_sector_allocations(db: AsyncSession, user_ids: Optional[List[int]] = None, commit: bool = True) -> dict:
+    """
+    Recompute aggregates from holdings in bulk (all users, or just `user_ids`), holding
+    the same per-user locks as refresh_user_sectors so a concurrent upload can't interleave.
+    """
+    started = time.perf_counter()
+    table = models.SectorAllocation.__table__
+    if user_ids is None:
+        await db.execute(LOCK_TABLE_QUERY)
+        await db.execute(table.delete())
+        result = await db.execute(text(REBUILD_SQL.format(where="")))
+    else:
+        await db.execute(LOCK_USERS_QUERY, {"namespace": SECTOR_LOCK_NAMESPACE, "user_ids": list(user_ids)})
+        await db.execute(table.delete().where(table.c.user_id.in_(user_ids)))
+        result = await db.execute(
+            text(REBUILD_SQL.format(where="WHERE h.user_id = ANY(:user_ids)")),
+            {"user_ids": user_ids},
+        )
+    if commit:
+        await db.commit()
+    return {"rows_written": result.rowcount, "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+
+async def check_sector_allocations(db: AsyncSession) -> List[int]:
+    """User IDs whose stored aggregates don't match their holdings."""
+    result = await db.execute(CHECK_QUERY)
+    return [row[0] for row in result.all()]
+
+
+async def ensure_built(db: AsyncSession) -> bool:
+    """Startup hook: build aggregates once for databases that have holdings but no aggregates yet."""
+    has_aggregates = await db.scalar(select(exists().select_from(models.SectorAllocation)))
+    if has_aggregates:
+        return False
+    has_holdings = await db.scalar(select(exists().select_from(models.Holdings)))
+    if not has_holdings:
+        return False
+    stats = await rebuild_sector_allocations(db)
+    print(f"✅ Built sector allocation aggregates: {stats['rows_written']} rows in {stats['elapsed_ms']} ms")
+    return True
+
+
+if __name__ == "__main__":
+    # python -m app.services.sector_allocations --check
+    # python -m app.services.sector_allocations --rebuild [--user-id 1 --user-id 2]
+    # python -m app.services.sector_allocations --repair   (check, then rebuild only mismatched users)
+    import argparse
+    import asyncio
+    from ..database import AsyncSessionLocal
+
+    parser = argparse.ArgumentParser(description="Consistency check / rebuild of per-user sector aggregates")
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--rebuild", action="store_true")
+    parser.add_argument("--repair", action="store_true")
+    parser.add_argument("--user-id", type=int, action="append", dest="user_ids")
+    args = parser.parse_args()
+
+    async def _main():
+        async with AsyncSessionLocal() as session:
+            if args.rebuild:
+                print(await rebuild_sector_allocations(session, args.user_ids))
+                return
+            mismatched = await check_sector_allocations(session)
+            print(f"{len(mismatched)} user(s) with inconsistent aggregates: {mismatched[:50]}")
+            if args.repair and mismatched:
+                print(await rebuild_sector_allocations(session, mismatched))
+
+    asyncio.run(_main())
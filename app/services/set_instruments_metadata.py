@@ -1,124 +1,285 @@
-# upstox_basic_fetch.py
-from upstox_client import Configuration, ApiClient
-import requests
-import gzip
-import json
-import pandas as pd
-from io import BytesIO
-from tabulate import tabulate
-from .. import models,schemas
+# pandas is only needed to clean Equity.csv, it is imported inside read_instruments_csv
+# so importing this module (and app.main) stays cheap
+from .. import models
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from datetime import datetime
-from sqlalchemy import text
+from sqlalchemy import text, exists
 from .. config import BASE_URL
+from .instrument_registry import bump_stored_version, get_stored_fingerprint, instrument_registry
+from .sector_allocations import rebuild_sector_allocations
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import pickle
+import time
 import re
 
+CSV_FILE_PATH = BASE_URL / "data/Equity.csv"
+# optional precompiled snapshot of the cleaned CSV, build with --build-snapshot
+SNAPSHOT_FILE_PATH = BASE_URL / "data/Equity.snapshot.pkl"
+SNAPSHOT_FORMAT_VERSION = 1
 
+INSTRUMENT_COLUMNS = ["isin_no", "trading_symbol", "name", "sector_name", "industry_new_name", "igroup_name", "isubgroup_name"]
 
-async def set_instruments_metadata(db: AsyncSession):
-   
-    # ✅ Check if any row exists
-    result = await db.execute(select(models.Instruments))
-    existing_instrument = result.fetchone()
-    if existing_instrument:
-        print("✅ Instrument metadata already exists in DB. Skipping insert.")
-        return
-    csv_file_path = BASE_URL / "data/Equity.csv"
-    df = pd.read_csv(csv_file_path)
-    # display(df)
-    # display(df.info())
+UPSERT_QUERY = text("""
+    INSERT INTO instruments (
+        isin_no,
+        trading_symbol,
+        name,
+        sector_name,
+        industry_new_name,
+        igroup_name,
+        isubgroup_name
+    )
+    VALUES (
+        :isin_no,
+        :trading_symbol,
+        :name,
+        :sector_name,
+        :industry_new_name,
+        :igroup_name,
+        :isubgroup_name
+    )
+    ON CONFLICT (isin_no) DO UPDATE
+    SET trading_symbol = EXCLUDED.trading_symbol,
+        name = EXCLUDED.name,
+        sector_name = EXCLUDED.sector_name,
+        industry_new_name = EXCLUDED.industry_new_name,
+        igroup_name = EXCLUDED.igroup_name,
+        isubgroup_name = EXCLUDED.isubgroup_name,
+        updated_at = now()
+""")
 
-    cols_to_convert = df.columns.difference(['Security Code','Face Value'])
-    print((cols_to_convert))
+# delisted ISINs still referenced by a holding are kept, deleting them would cascade into user holdings
+DELETE_DELISTED_QUERY = text("""
+    DELETE FROM instruments i
+    WHERE i.isin_no = ANY(:isins)
+      AND NOT EXISTS (SELECT 1 FROM holdings h WHERE h.isin_no = i.isin_no)
+    RETURNING i.isin_no
+""")
 
-    df[cols_to_convert] = df[cols_to_convert].astype("string[python]")
-    # display(df.info())
-    # df
 
-    # df_clean_check = df.replace('',pd.NA)
-    # blank_rows = df_clean_check[df_clean_check.isna().any(axis=1)]
-    # display(blank_rows)
+def to_snake_case(name):
+    # Replace spaces with underscores, lowercase everything, and remove non-alphanumeric characters
+    name = re.sub(r'[^\w\s]', '', name)         # Remove special chars
+    name = re.sub(r'[\s]+', '_', name)          # Replace spaces with _
+    return name.strip().lower()
 
-    # Step 1: Define "bad values" that should be treated as null
-    null_like_values = ['-','--','N/A','n/a','null','NULL','',' ']
 
-    #step 2: replace them with actual nulls in the entire dataframe
-    df = df.replace(null_like_values, pd.NA)
-
-    # Step 3: Now, to view rows where there are blank rows
-    # blank_rows = df[df.isna().any(axis=1)]
-    # blank_rows
-    # df
+def file_fingerprint(path: Path) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
 
 
-    # df = df[df['ISIN No'].notna()]
-    # df
+def read_instruments_csv(csv_file_path: Path = CSV_FILE_PATH) -> List[dict]:
+    """Load and clean Equity.csv into instrument rows (dicts keyed by INSTRUMENT_COLUMNS)."""
+    import pandas as pd
 
-    # df.columns
+    df = pd.read_csv(csv_file_path)
 
-    # import pandas as pd
-    # import re
+    cols_to_convert = df.columns.difference(['Security Code','Face Value'])
+    df[cols_to_convert] = df[cols_to_convert].astype("string[python]")
 
-    def to_snake_case(name):
-        # Replace spaces with underscores, lowercase everything, and remove non-alphanumeric characters
-        name = re.sub(r'[^\w\s]', '', name)         # Remove special chars
-        name = re.sub(r'[\s]+', '_', name)          # Replace spaces with _
-        return name.strip().lower()
+    # Step 1: Define "bad values" that should be treated as null
+    null_like_values = ['-','--','N/A','n/a','null','NULL','',' ']
 
+    #step 2: replace them with actual nulls in the entire dataframe
+    df = df.replace(null_like_values, pd.NA)
 
     df.columns = [to_snake_case(col) for col in df.columns]
 
-    # print(df.columns)
-
     # Replace nulls in specific columns to 'Unknown'
     col_list = df.columns.tolist()
     columns_to_fill = col_list[-6:]
-    replacement_value = 'Unknown'
 
     # Remove rows where 'isin_Number' is NaN
     df = df.dropna(subset=['isin_no'])
 
     df.loc[:, columns_to_fill] = df.loc[:, columns_to_fill].fillna('Unknown')
-    # df
     df = df.rename(columns = {
         "issuer_name": "name",
         "security_id": "trading_symbol"
     })
 
-    df = df[["isin_no","trading_symbol","name",'sector_name', 'industry_new_name', 'igroup_name', 'isubgroup_name']]
-     # Step 3: Convert DataFrame to list of dicts for executemany
-    rows_to_insert = df.to_dict(orient="records")
-
-    
-    # Step 2: Prepare raw SQL INSERT
-    insert_query = text("""
-        INSERT INTO instruments (
-            isin_no,
-            trading_symbol,
-            name,
-            sector_name,
-            industry_new_name,
-            igroup_name,
-            isubgroup_name   
-        )
-        VALUES (
-            :isin_no,
-            :trading_symbol,
-            :name,
-            :sector_name,
-            :industry_new_name,
-            :igroup_name,
-            :isubgroup_name  
-        )
-    """)
+    df = df[INSTRUMENT_COLUMNS]
+    # plain python values, pd.NA -> None
+    return [
+        {col: (None if pd.isna(value) else str(value)) for col, value in row.items()}
+        for row in df.to_dict(orient="records")
+    ]
+
+
+def write_snapshot(rows: List[dict], fingerprint: str, snapshot_path: Path = SNAPSHOT_FILE_PATH):
+    """Store cleaned rows as a compact pickle of tuples, tagged with the source CSV fingerprint."""
+    payload = {
+        "format": SNAPSHOT_FORMAT_VERSION,
+        "source_fingerprint": fingerprint,
+        "columns": INSTRUMENT_COLUMNS,
+        "rows": [tuple(row[col] for col in INSTRUMENT_COLUMNS) for row in rows],
+    }
+    tmp_path = snapshot_path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path.replace(snapshot_path)
+
+
+def read_snapshot(fingerprint: str, snapshot_path: Path = SNAPSHOT_FILE_PATH) -> Optional[List[dict]]:
+    """Cleaned rows from the snapshot, or None if it's missing or was built from a different CSV."""
+    if not snapshot_path.is_file():
+        return None
+    try:
+        with open(snapshot_path, "rb") as f:
+            payload = pickle.load(f)
+    except Exception as e:
+        print(f"Ignoring unreadable instruments snapshot {snapshot_path}: {e}")
+        return None
+    if (payload.get("format") != SNAPSHOT_FORMAT_VERSION
+            or payload.get("source_fingerprint") != fingerprint
+            or payload.get("columns") != INSTRUMENT_COLUMNS):
+        return None
+    return [dict(zip(INSTRUMENT_COLUMNS, row)) for row in payload["rows"]]
+
+
+def load_source_rows(csv_file_path: Path, fingerprint: str) -> Tuple[List[dict], str]:
+    """Cleaned rows from the snapshot when it matches the CSV, else through the pandas pipeline."""
+    rows = read_snapshot(fingerprint)
+    if rows is not None:
+        return rows, "snapshot"
+    return read_instruments_csv(csv_file_path), "csv"
 
-   
-    # # Print first 5 records
-    # for row in rows_to_insert[:5]:
-    #     print(row)
 
-    # Step 4: Execute as bulk insert
-    await db.execute(insert_query, rows_to_insert)  # asyncpg supports list of dicts
+async def instruments_exist(db: AsyncSession) -> bool:
+    return bool(await db.scalar(select(exists().select_from(models.Instruments))))
+
+
+async def fetch_existing_instruments(db: AsyncSession) -> Dict[str, Tuple]:
+    result = await db.execute(
+        select(*[getattr(models.Instruments, col) for col in INSTRUMENT_COLUMNS])
+    )
+    return {row[0]: tuple(row) for row in result.all()}
+
+
+def diff_instruments(source_rows: List[dict], existing: Dict[str, Tuple]) -> Tuple[List[dict], List[dict], List[str]]:
+    """Row-level diff of the source file against the DB. Returns (added, changed, delisted_isins)."""
+    added, changed = [], []
+    seen = set()
+    for row in source_rows:
+        isin_no = row["isin_no"]
+        seen.add(isin_no)
+        current = existing.get(isin_no)
+        if current is None:
+            added.append(row)
+        elif current != tuple(row[col] for col in INSTRUMENT_COLUMNS):
+            changed.append(row)
+    delisted = [isin_no for isin_no in existing if isin_no not in seen]
+    return added, changed, delisted
+
+
+async def refresh_instruments_metadata(db: AsyncSession, csv_file_path: Path = CSV_FILE_PATH, force: bool = False) -> dict:
+    """
+    Apply Equity.csv to the instruments table incrementally.
+    Skips work when the file fingerprint matches the stored one (unless force=True),
+    otherwise upserts only added/changed rows and removes unreferenced delisted ISINs.
+    Returns timings (ms) and row counts.
+    """
+    started = time.perf_counter()
+    stats = {"status": "unchanged", "source_file": str(csv_file_path)}
+
+    fingerprint = file_fingerprint(csv_file_path)
+    stored_fingerprint = await get_stored_fingerprint(db)
+    t_fingerprint = time.perf_counter()
+    stats["fingerprint"] = fingerprint
+    stats["fingerprint_ms"] = round((t_fingerprint - started) * 1000, 2)
+
+    # EXISTS probe guards against a matching fingerprint over an emptied table
+    if fingerprint == stored_fingerprint and not force and await instruments_exist(db):
+        stats["total_ms"] = stats["fingerprint_ms"]
+        print(f"✅ Instrument metadata up to date (fingerprint {fingerprint[:12]}). Skipping refresh.")
+        return stats
+
+    source_rows, stats["source"] = load_source_rows(csv_file_path, fingerprint)
+    t_read = time.perf_counter()
+
+    existing = await fetch_existing_instruments(db)
+    added, changed, delisted = diff_instruments(source_rows, existing)
+    t_diff = time.perf_counter()
+
+    # Apply only the delta
+    to_upsert = added + changed
+    if to_upsert:
+        await db.execute(UPSERT_QUERY, to_upsert)  # asyncpg supports list of dicts
+    removed = []
+    if delisted:
+        result = await db.execute(DELETE_DELISTED_QUERY, {"isins": delisted})
+        removed = [row[0] for row in result.all()]
+
+    # a reclassified ISIN moves money between sectors, rebuild aggregates of the users holding it
+    affected_users = []
+    if changed:
+        result = await db.execute(
+            text("SELECT DISTINCT user_id FROM holdings WHERE isin_no = ANY(:isins)"),
+            {"isins": [row["isin_no"] for row in changed]},
+        )
+        affected_users = [row[0] for row in result.all()]
+        if affected_users:
+            await rebuild_sector_allocations(db, affected_users, commit=False)
+
+    version = await bump_stored_version(db, fingerprint=fingerprint)  # other workers pick this up and reload their registry
     await db.commit()
-    print(f"✅ Inserted {len(rows_to_insert)} instruments.")
\ No newline at end of file
+    instrument_registry.invalidate()
+    t_apply = time.perf_counter()
+
+    stats.update({
+        "status": "refreshed",
+        "version": version,
+        "source_rows": len(source_rows),
+        "existing_rows": len(existing),
+        "added": len(added),
+        "changed": len(changed),
+        "unchanged": len(source_rows) - len(added) - len(changed),
+        "delisted": len(delisted),
+        "delisted_removed": len(removed),
+        "delisted_retained": len(delisted) - len(removed),
+        "aggregate_users_rebuilt": len(affected_users),
+        "read_ms": round((t_read - t_fingerprint) * 1000, 2),
+        "diff_ms": round((t_diff - t_read) * 1000, 2),
+        "apply_ms": round((t_apply - t_diff) * 1000, 2),
+        "total_ms": round((t_apply - started) * 1000, 2),
+    })
+    print(
+        f"✅ Instruments refreshed to version {version}: +{len(added)} added, ~{len(changed)} changed, "
+        f"-{len(removed)} delisted removed ({stats['delisted_retained']} still held, kept) in {stats['total_ms']} ms"
+    )
+    return stats
+
+
+async def set_instruments_metadata(db: AsyncSession):
+    # Startup hook: first boot inserts everything (diff against an empty table), later boots only apply changes
+    return await refresh_instruments_metadata(db)
+
+
+if __name__ == "__main__":
+    # On-demand refresh: python -m app.services.set_instruments_metadata [--force]
+    # Precompile the snapshot (e.g. at image build time): python -m app.services.set_instruments_metadata --build-snapshot
+    import asyncio
+    import sys
+    from tabulate import tabulate
+
+    if "--build-snapshot" in sys.argv:
+        fingerprint = file_fingerprint(CSV_FILE_PATH)
+        rows = read_instruments_csv(CSV_FILE_PATH)
+        write_snapshot(rows, fingerprint)
+        print(f"✅ Wrote {len(rows)} instruments to {SNAPSHOT_FILE_PATH}")
+        sys.exit(0)
+
+    from ..database import AsyncSessionLocal
+
+    async def _main():
+        async with AsyncSessionLocal() as session:
+            stats = await refresh_instruments_metadata(session, force="--force" in sys.argv)
+        print(tabulate(stats.items(), headers=["metric", "value"]))
+
+    asyncio.run(_main())
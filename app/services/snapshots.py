@@ -0,0 +1,246 @@
+import hashlib
+import sys
+from array import array
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models
+from .instrument_registry import instrument_registry
+from .sector_allocations import get_user_sectors
+
+# sector name <-> id, ids never change once assigned so this only grows
+_sector_ids: Dict[str, int] = {}
+_sector_names: Dict[int, str] = {}
+
+
+def pack(values: Iterable, typecode: str) -> bytes:
+    """Little-endian packed array ('i' int32 sector ids, 'f' float32 weights)."""
+    packed = array(typecode, values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _remember(rows):
+    for sector_id, name in rows:
+        _sector_ids[name] = sector_id
+        _sector_names[sector_id] = name
+
+
+async def load_sectors(db: AsyncSession):
+    """
+    Store a sector row for every industry in the instrument metadata and cache all ids,
+    so recording a snapshot normally resolves its sector ids without a query. Runs at
+    startup and whenever the instrument registry reloads. Commits.
+    """
+    names = {r.industry_new_name for r in instrument_registry.records() if r.industry_new_name}
+    if names:
+        await db.execute(
+            insert(models.Sector).values([{"name": name} for name in names]).on_conflict_do_nothing(index_elements=["name"])
+        )
+    result = await db.execute(select(models.Sector.id, models.Sector.name))
+    await db.commit()
+    _remember(result.all())
+
+
+async def resolve_sector_ids(db: AsyncSession, names: Iterable[str]) -> Dict[str, int]:
+    """
+    Ids for sector names. A name load_sectors hasn't seen is inserted through the
+    caller's session, in the report's savepoint, and deliberately not cached: that
+    transaction may still roll back. The next load_sectors caches it once committed.
+    """
+    names = set(names)
+    ids = {name: _sector_ids[name] for name in names if name in _sector_ids}
+    missing = [name for name in names if name not in ids]
+    if missing:
+        await db.execute(
+            insert(models.Sector).values([{"name": name} for name in missing]).on_conflict_do_nothing(index_elements=["name"])
+        )
+        result = await db.execute(select(models.Sector.name, models.Sector.id).where(models.Sector.name.in_(missing)))
+        ids.update(result.all())
+    return ids
+
+
+async def sector_names(db: AsyncSession, sector_ids: Iterable[int]) -> Dict[int, str]:
+    sector_ids = set(int(i) for i in sector_ids)
+    if any(i not in _sector_names for i in sector_ids):
+        result = await db.execute(select(models.Sector.id, models.Sector.name))
+        _remember(result.all())
+    return {i: _sector_names.get(i, f"sector #{i}") for i in sector_ids}
+
+
+SNAPSHOT_META_COLUMNS = (
+    models.AllocationSnapshot.id,
+    models.AllocationSnapshot.portfolio_version,
+    models.AllocationSnapshot.instrument_version,
+    models.AllocationSnapshot.content_hash,
+    models.AllocationSnapshot.created_at,
+)
+
+
+async def latest_snapshot(db: AsyncSession, user_id: int):
+    result = await db.execute(
+        select(*SNAPSHOT_META_COLUMNS)
+        .where(models.AllocationSnapshot.user_id == user_id)
+        .order_by(models.AllocationSnapshot.created_at.desc(), models.AllocationSnapshot.id.desc())
+        .limit(1)
+    )
+    return result.first()
+
+
+async def record_snapshot(db: AsyncSession, user_id: int, portfolio_version: int) -> Optional[Tuple[dict, bool]]:
+    """
+    Store the user's current sector weights unless nothing changed since the last
+    snapshot (same holdings + instruments version, or identical weights).
+    Returns (snapshot, created), None when the user has no holdings. Does not commit.
+    """
+    instrument_version = instrument_registry.version
+    latest = await latest_snapshot(db, user_id)
+    if latest and (latest.portfolio_version, latest.instrument_version) == (portfolio_version, instrument_version):
+        return dict(latest._mapping), False
+
+    sectors = await get_user_sectors(db, user_id)
+    total = sum(s["invested_amount"] for s in sectors)
+    if not total:
+        return None
+
+    ids = await resolve_sector_ids(db, (s["sector"] for s in sectors))
+    ordered = sorted((ids[s["sector"]], s["invested_amount"] / total) for s in sectors)
+    sector_ids = pack((sector_id for sector_id, _ in ordered), "i")
+    weights = pack((weight for _, weight in ordered), "f")
+    content_hash = hashlib.sha1(sector_ids + weights).hexdigest()
+    if latest and latest.content_hash == content_hash:
+        return dict(latest._mapping), False
+
+    result = await db.execute(
+        insert(models.AllocationSnapshot)
+        .values(
+            user_id=user_id,
+            portfolio_version=portfolio_version,
+            instrument_version=instrument_version,
+            total_invested=total,
+            sector_count=len(ordered),
+            sector_ids=sector_ids,
+            weights=weights,
+            content_hash=content_hash,
+        )
+        .on_conflict_do_nothing(index_elements=["user_id", "portfolio_version", "instrument_version"])
+        .returning(*SNAPSHOT_META_COLUMNS)
+    )
+    row = result.first()
+    if row is None:
+        # a concurrent report run stored this version first
+        return dict((await latest_snapshot(db, user_id))._mapping), False
+    return dict(row._mapping), True
+
+
+async def snapshot_report_run(db: AsyncSession, user_id: int, portfolio_version: int):
+    """Report hook: record a snapshot in a savepoint so a failure here never fails the report."""
+    try:
+        async with db.begin_nested():
+            await record_snapshot(db, user_id, portfolio_version)
+    except SQLAlchemyError as e:
+        print(f"[Snapshot Error] user {user_id}: {e}")
+
+
+async def list_snapshots(db: AsyncSession, user_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                         limit: int = 1000, snapshot_ids: Optional[List[int]] = None) -> list:
+    s = models.AllocationSnapshot
+    query = (
+        select(s.id, s.created_at, s.portfolio_version, s.total_invested, s.sector_ids, s.weights)
+        .where(s.user_id == user_id)
+        .order_by(s.created_at.desc(), s.id.desc())
+        .limit(limit)
+    )
+    if start is not None:
+        query = query.where(s.created_at >= start)
+    if end is not None:
+        query = query.where(s.created_at <= end)
+    if snapshot_ids is not None:
+        query = query.where(s.id.in_(snapshot_ids))
+    # newest `limit` snapshots, returned oldest first
+    result = await db.execute(query)
+    return result.all()[::-1]
+
+
+def weight_matrix(snapshots) -> tuple:
+    """
+    Dense (snapshots x sectors) weight matrix in percent, built with one scatter over
+    all packed arrays. Columns are the sorted union of sector ids.
+    """
+    import numpy as np  # lazy, keeps numpy out of app startup
+    ids = [np.frombuffer(s.sector_ids, dtype="<i4") for s in snapshots]
+    weights = [np.frombuffer(s.weights, dtype="<f4") for s in snapshots]
+    columns, column_index = np.unique(np.concatenate(ids), return_inverse=True)
+    row_index = np.repeat(np.arange(len(snapshots)), [len(x) for x in ids])
+    matrix = np.zeros((len(snapshots), len(columns)))
+    matrix[row_index, column_index] = np.concatenate(weights).astype(np.float64) * 100.0
+    return matrix, columns
+
+
+async def diff_snapshots(db: AsyncSession, user_id: int, from_id: int, to_id: int) -> Optional[dict]:
+    """Sector weight drift (percentage points) from one snapshot to another."""
+    import numpy as np
+    rows = {r.id: r for r in await list_snapshots(db, user_id, snapshot_ids=[from_id, to_id])}
+    if from_id not in rows or to_id not in rows:
+        return None
+    matrix, columns = weight_matrix([rows[from_id], rows[to_id]])
+    drift = matrix[1] - matrix[0]
+    names = await sector_names(db, columns)
+
+    order = np.argsort(-np.abs(drift), kind="stable")
+    return {
+        "from": {"snapshot_id": from_id, "created_at": rows[from_id].created_at, "total_invested": rows[from_id].total_invested},
+        "to": {"snapshot_id": to_id, "created_at": rows[to_id].created_at, "total_invested": rows[to_id].total_invested},
+        # half the summed absolute drift: the share of the portfolio that moved between sectors
+        "turnover_pct": round(float(np.abs(drift).sum()) / 2, 4),
+        "sectors": [
+            {
+                "sector": names[int(columns[i])],
+                "from_weight_pct": round(float(matrix[0, i]), 4),
+                "to_weight_pct": round(float(matrix[1, i]), 4),
+                "drift_pp": round(float(drift[i]), 4),
+            }
+            for i in order
+        ],
+    }
+
+
+SERIES_STATS = ("first_pct", "last_pct", "min_pct", "max_pct", "drift_pp", "max_abs_drift_pp")
+
+
+def build_series(rows, matrix, columns, names: Dict[int, str]) -> dict:
+    """Per-sector first/last/min/max and drift, plus turnover between consecutive snapshots, all as whole-matrix reductions."""
+    import numpy as np
+    drift = matrix[-1] - matrix[0]
+    max_abs_drift = np.abs(matrix - matrix[0]).max(axis=0)
+    step_turnover = np.abs(np.diff(matrix, axis=0)).sum(axis=1) / 2
+    stats = np.round(np.stack([matrix[0], matrix[-1], matrix.min(axis=0), matrix.max(axis=0), drift, max_abs_drift]), 4).T.tolist()
+    sectors = [names[int(c)] for c in columns]
+    order = np.argsort(-np.abs(drift), kind="stable")
+
+    return {
+        "snapshots": len(rows),
+        "snapshot_ids": [r.id for r in rows],
+        "created_at": [r.created_at for r in rows],
+        "total_invested": [r.total_invested for r in rows],
+        "sectors": sectors,
+        "weights_pct": np.round(matrix, 4).tolist(),
+        "step_turnover_pct": np.round(step_turnover, 4).tolist(),
+        "drift": [
+            {"sector": sectors[i], **dict(zip(SERIES_STATS, stats[i]))}
+            for i in order
+        ],
+    }
+
+
+async def snapshot_series(db: AsyncSession, user_id: int, start: Optional[datetime], end: Optional[datetime], limit: int) -> dict:
+    """Weights over time as parallel arrays (one matrix row per snapshot) with drift across the range."""
+    rows = await list_snapshots(db, user_id, start, end, limit)
+    if not rows:
+        return {"snapshots": 0}
+    matrix, columns = weight_matrix(rows)
+    return build_series(rows, matrix, columns, await sector_names(db, columns))
@@ -1,69 +1,141 @@
 import asyncio
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+from sqlalchemy import update
 from sqlalchemy.future import select
-from ..database import AsyncSessionLocal
+from ..database import BackgroundSessionLocal
+from ..config import settings
 from .. import models
-from pathlib import Path
 
 REPORT_DIR = "reports"
 os.makedirs(REPORT_DIR, exist_ok=True)
 
+ACTIVE_STATUSES = ("queued", "running")
+
+_unlink_executor: Optional[ThreadPoolExecutor] = None
+
+
+def unlink_report_file(file_path: str) -> bool:
+    """Runs in the unlink pool. True if a file was removed."""
+    file = Path(file_path)
+    try:
+        if file.is_file():
+            file.unlink(missing_ok=True)
+            return True
+    except Exception as e:
+        # ❌ Log the error but don’t stop the batch
+        print(f"Error deleting file {file}: {e}")
+    return False
+
+
+async def unlink_files(file_paths: List[str]) -> int:
+    global _unlink_executor
+    if _unlink_executor is None:
+        _unlink_executor = ThreadPoolExecutor(max_workers=settings.cleanup_unlink_workers, thread_name_prefix="report-cleanup")
+    loop = asyncio.get_running_loop()
+    removed = await asyncio.gather(*(loop.run_in_executor(_unlink_executor, unlink_report_file, path) for path in file_paths))
+    return sum(removed)
+
+
+async def cleanup_batch(session, batch_size: int) -> tuple:
+    """
+    Claim up to `batch_size` expired reports, soft delete the rows in one UPDATE and,
+    once that is committed, delete their files. Rows are locked FOR UPDATE SKIP LOCKED, so every worker can sweep at
+    the same time without two of them claiming the same report.
+    Returns (claimed, files_removed, files_kept) - kept files are still shared by a live report.
+    """
+    now = datetime.now()
+    result = await session.execute(
+        select(models.Report.id, models.Report.file_path)
+        .where(
+            models.Report.is_deleted == False,
+            models.Report.expires_at < now,
+            models.Report.status.notin_(ACTIVE_STATUSES),
+        )
+        .order_by(models.Report.expires_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    claimed = result.all()
+    if not claimed:
+        await session.rollback()
+        return 0, 0, 0
+
+    await session.execute(
+        update(models.Report)
+        .where(models.Report.id.in_([report_id for report_id, _ in claimed]))
+        .values(is_deleted=True, deleted_at=now)
+    )
+    file_paths = {file_path for _, file_path in claimed}
+    shared = await live_file_paths(session, file_paths, now)
+    # rows first: a failed commit (or a worker dying here) must not leave live rows pointing
+    # at unlinked files; a failed unlink only leaves an orphan file behind
+    await session.commit()
+    removed = await unlink_files(list(file_paths - shared))
+    return len(claimed), removed, len(shared)
+
+
+async def live_file_paths(session, file_paths, now) -> set:
+    """
+    Files still referenced by a live report. Rows with the same content hash share one
+    file, so a file goes only once its last referencing row has expired.
+    """
+    if not file_paths:
+        return set()
+    result = await session.execute(
+        select(models.Report.file_path)
+        .where(
+            models.Report.file_path.in_(file_paths),
+            models.Report.is_deleted == False,
+            (models.Report.expires_at >= now) | models.Report.status.in_(ACTIVE_STATUSES),
+        )
+        .distinct()
+    )
+    return set(result.scalars().all())
+
+
+async def sweep_expired_reports() -> tuple:
+    """One sweep: batches until the backlog is gone or the per-sweep cap is hit. Returns (claimed, removed, kept, backlog_left)."""
+    claimed_total = removed_total = kept_total = 0
+    async with BackgroundSessionLocal() as session:
+        for _ in range(settings.cleanup_max_batches_per_sweep):
+            claimed, removed, kept = await cleanup_batch(session, settings.cleanup_batch_size)
+            claimed_total += claimed
+            removed_total += removed
+            kept_total += kept
+            if claimed < settings.cleanup_batch_size:
+                return claimed_total, removed_total, kept_total, False
+    return claimed_total, removed_total, kept_total, True
+
 
 async def cleanup_expired_reports():
     """Background async task to delete expired reports."""
+    interval = settings.cleanup_min_interval_seconds
     while True:
+        backlog = False
         try:
-            async with AsyncSessionLocal() as session:
-                result = await session.execute(
-                    select(models.Report).where(models.Report.expires_at < datetime.now(),
-                                                models.Report.is_deleted == False)
-                )
-                expired_reports = result.scalars().all()
-                for report in expired_reports:
-                    file = Path(report.file_path)
-                    
-
-                    try:
-                        # ✅ Attempt file deletion first
-                        if file.exists() and file.is_file():
-                            file.unlink(missing_ok=True)
-                            print(f"Deleted expired file: {file}")
-                           
-                             
-                        else:
-                            print(f"File not found (already deleted?): {file}")
-
-                    except Exception as e:
-                        # ❌ Log the error but don’t stop the loop
-                        print(f"Error deleting file {file}: {e}")
-                    
-                    # Soft delete the db record
-                    try:
-                         # ✅ Mark report as deleted in DB
-                        report.is_deleted = True
-                        report.deleted_at = datetime.now()
-                        print(f"Soft deleted DB record for report {report.id}")
-                    except Exception as e:
-                        print(f"Error updating DB record for report {report.id}: {e}")
-
-               
-
-
-                # Commit once at the end
-                try:
-                    await session.commit()
-                    print("Expired report cleanup committed successfully.")
-                except Exception as e:
-                    print(f"Error committing DB deletions: {e}")
-
-                
-
+            claimed, removed, kept, backlog = await sweep_expired_reports()
+            if claimed:
+                print(f"Expired report cleanup: {claimed} reports soft deleted, {removed} files removed, {kept} shared files kept")
         except Exception as e:
             print(f"[Cleanup Error] {e}")
 
-        # wait 60 seconds before next cleanup cycle
-        await asyncio.sleep(60)
+        # come back quickly while expired reports are piling up, back off while idle
+        if backlog:
+            interval = settings.cleanup_min_interval_seconds
+        else:
+            interval = min(interval * 2, settings.cleanup_max_interval_seconds)
+        await asyncio.sleep(interval)
+
+
+def shutdown_cleanup():
+    global _unlink_executor
+    if _unlink_executor is not None:
+        _unlink_executor.shutdown(wait=False)
+        _unlink_executor = None
 
 
 def register_cleanup(app):
@@ -72,3 +144,6 @@ def register_cleanup(app):
     async def start_cleanup_task():
         asyncio.create_task(cleanup_expired_reports())
 
+    @app.on_event("shutdown")
+    async def stop_cleanup_task():
+        shutdown_cleanup()
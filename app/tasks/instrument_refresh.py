@@ -0,0 +1,25 @@
+import asyncio
+from ..database import BackgroundSessionLocal
+from ..config import settings
+from ..services.instrument_registry import instrument_registry
+from ..services.snapshots import load_sectors
+
+
+async def refresh_instrument_registry():
+    """Background async task that reloads the instrument registry when the stored version changes."""
+    while True:
+        await asyncio.sleep(settings.instrument_registry_refresh_seconds)
+        try:
+            async with BackgroundSessionLocal() as session:
+                if await instrument_registry.refresh_if_stale(session):
+                    print(f"Instrument registry refreshed to version {instrument_registry.version}")
+                    await load_sectors(session)
+        except Exception as e:
+            print(f"[Instrument Registry Refresh Error] {e}")
+
+
+def register_instrument_refresh(app):
+    """Register instrument registry refresh task with FastAPI app."""
+    @app.on_event("startup")
+    async def start_instrument_refresh_task():
+        asyncio.create_task(refresh_instrument_registry())
@@ -1,11 +1,93 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
 from passlib.context import CryptContext
-from passlib.context import CryptContext
+from .config import settings
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated = "auto")
+# every hash is made at bcrypt_rounds; hashes at any other cost are flagged by
+# needs_update and rewritten on the user's next successful login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated = "auto",
+    bcrypt__default_rounds = settings.bcrypt_rounds,
+    bcrypt__min_rounds = settings.bcrypt_rounds,
+    bcrypt__max_rounds = settings.bcrypt_rounds,
+)
 
 def hash(password: str):
     return (pwd_context.hash(password))
 
 def verify(plain_password, hash_password):
-    return pwd_context.verify(plain_password,hash_password)
\ No newline at end of file
+    return pwd_context.verify(plain_password,hash_password)
+
+def verify_and_update(plain_password, hash_password) -> Tuple[bool, Optional[str]]:
+    """(valid, new_hash), new_hash is set when the stored hash should be replaced."""
+    return pwd_context.verify_and_update(plain_password, hash_password)
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt off the event loop in a small dedicated thread pool (bcrypt releases
+    the GIL). At most `workers` hashes run at once and at most `max_queued` wait;
+    anything beyond that is rejected straight away instead of piling up.
+    """
+
+    def __init__(self, workers: int, max_queued: int):
+        self.workers = workers
+        self.max_queued = max_queued
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.workers + self.max_queued:
+            self.rejected += 1
+            raise PasswordHasherBusy(f"{self.pending} password hashes already pending")
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        future = self._executor.submit(fn, *args)
+        # counted down when the hash itself finishes (or is cancelled before it started), not
+        # when the caller stops waiting: a disconnected client's bcrypt call keeps its thread
+        future.add_done_callback(lambda _: loop.is_closed() or loop.call_soon_threadsafe(self._finished))
+        return await asyncio.wrap_future(future)
+
+    def _finished(self):
+        self.pending -= 1
+        self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash, password)
+
+    async def verify_and_update(self, plain_password, hash_password) -> Tuple[bool, Optional[str]]:
+        valid, new_hash = await self._run(verify_and_update, plain_password, hash_password)
+        if new_hash:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_queued": self.max_queued,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "bcrypt_rounds": settings.bcrypt_rounds,
+        }
+
+
+password_hasher = PasswordHasher(settings.password_hash_workers, settings.password_hash_max_queued)
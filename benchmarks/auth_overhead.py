@@ -0,0 +1,72 @@
+"""
+Per-request authentication overhead: oauth2.get_current_user with the principal cache
+cold (JWT verify + users lookup) vs. warm (JWT verify + cache hit), plus the JWT verify
+alone as the floor.
+
+Runs against the database configured in .env, for an existing user:
+    python -m benchmarks.auth_overhead --user-id 1 --iterations 2000 --output auth.json
+"""
+import argparse
+import asyncio
+import json
+import time
+from pathlib import Path
+
+from fastapi import HTTPException
+
+from app import oauth2
+from app.database import AsyncSessionLocal, engine
+from benchmarks.hierarchy_rollup import summarize
+
+
+async def run(args):
+    token = oauth2.ceate_access_token({"user_id": args.user_id})
+    credentials_exception = HTTPException(status_code=401)
+    jwt_only, cold, warm = [], [], []
+
+    async with AsyncSessionLocal() as session:
+        await oauth2.get_current_user(token, session)  # warm up connection
+
+        for _ in range(args.iterations):
+            t0 = time.perf_counter()
+            oauth2.verify_access_token(token, credentials_exception)
+            t1 = time.perf_counter()
+
+            oauth2.invalidate_user(args.user_id)
+            t2 = time.perf_counter()
+            await oauth2.get_current_user(token, session)
+            t3 = time.perf_counter()
+            await oauth2.get_current_user(token, session)
+            t4 = time.perf_counter()
+
+            jwt_only.append((t1 - t0) * 1000)
+            cold.append((t3 - t2) * 1000)
+            warm.append((t4 - t3) * 1000)
+    await engine.dispose()
+
+    return {
+        "benchmark": "auth_overhead",
+        "user_id": args.user_id,
+        "iterations": args.iterations,
+        "jwt_verify": summarize(jwt_only),
+        "cache_miss": summarize(cold),
+        "cache_hit": summarize(warm),
+        "cache": oauth2.principal_cache.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", type=int, required=True)
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
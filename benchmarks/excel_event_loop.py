@@ -0,0 +1,150 @@
+"""
+JSON latency while excel reports are being written.
+
+Runs a small FastAPI app in-process (httpx ASGITransport, no network, no DB) with a cheap
+JSON endpoint and an excel endpoint that writes an allocation-shaped workbook through
+app.services.excel_writer. Concurrent JSON clients are timed while excel requests run
+back to back, once per mode:
+
+  inline   old behaviour, workbook written on the event loop
+  thread   write_workbook_async with a thread pool
+  process  write_workbook_async with a process pool
+
+Usage (needs the same .env as the app, plus httpx):
+    python -m benchmarks.excel_event_loop --rows 20000 --json-clients 10 --json-rate 10 --excel-clients 2 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI
+
+from app.config import settings
+from app.services import excel_writer
+
+
+def make_rows(n):
+    return [
+        {
+            "sector": f"Sector {i % 40}",
+            "stock_name": f"Stock {i}",
+            "isin_no": f"INE{i:08d}0",
+            "stock_investment": 1000.0 + i,
+            "sector_total": 50000.0,
+            "sector_pct_of_portfolio": 2.5,
+            "stock_pct_within_sector": 1.25,
+            "stock_pct_of_portfolio": 0.03,
+        }
+        for i in range(n)
+    ]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+def build_app(mode, rows, out_dir):
+    app = FastAPI()
+    small_report = {"user_id": 1, "report": rows[:25]}
+    counter = {"n": 0}
+
+    @app.get("/json")
+    async def json_report():
+        return small_report
+
+    @app.get("/excel")
+    async def excel_report():
+        counter["n"] += 1
+        path = Path(out_dir) / f"report_{counter['n']}.xlsx"
+        if mode == "inline":
+            excel_writer.write_workbook(str(path), rows)
+        else:
+            await excel_writer.write_workbook_async(str(path), rows)
+        path.unlink(missing_ok=True)
+        return {"ok": True}
+
+    return app
+
+
+async def run_mode(mode, args, rows):
+    if mode != "inline":
+        excel_writer.shutdown_executor()
+        settings.report_executor_kind = mode
+        settings.report_executor_workers = args.excel_clients
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        app = build_app(mode, rows, out_dir)
+        transport = httpx.ASGITransport(app=app)
+        json_latencies, excel_latencies = [], []
+        deadline = time.perf_counter() + args.duration
+
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def json_client():
+                # fixed request schedule: latency is measured from when the request was *due*,
+                # so time spent stalled behind a blocked event loop is counted (no coordinated omission)
+                interval = 1.0 / args.json_rate
+                due = time.perf_counter()
+                while due < deadline:
+                    await asyncio.sleep(max(0.0, due - time.perf_counter()))
+                    await client.get("/json")
+                    json_latencies.append((time.perf_counter() - due) * 1000)
+                    due += interval
+
+            async def excel_client():
+                while time.perf_counter() < deadline:
+                    t0 = time.perf_counter()
+                    await client.get("/excel", timeout=None)
+                    excel_latencies.append((time.perf_counter() - t0) * 1000)
+
+            await asyncio.gather(
+                *[json_client() for _ in range(args.json_clients)],
+                *[excel_client() for _ in range(args.excel_clients)],
+            )
+
+    excel_writer.shutdown_executor()
+    return {
+        "mode": mode,
+        "json_requests": len(json_latencies),
+        "json_p50_ms": round(percentile(json_latencies, 50), 2),
+        "json_p95_ms": round(percentile(json_latencies, 95), 2),
+        "json_p99_ms": round(percentile(json_latencies, 99), 2),
+        "json_max_ms": round(max(json_latencies, default=0.0), 2),
+        "excel_reports": len(excel_latencies),
+        "excel_mean_ms": round(statistics.mean(excel_latencies), 2) if excel_latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--json-clients", type=int, default=10)
+    parser.add_argument("--json-rate", type=float, default=10.0, help="requests/second per JSON client")
+    parser.add_argument("--excel-clients", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--modes", default="inline,thread,process")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    results = [asyncio.run(run_mode(mode, args, rows)) for mode in args.modes.split(",")]
+
+    for r in results:
+        print(
+            f"{r['mode']:>8}: json p50={r['json_p50_ms']}ms p99={r['json_p99_ms']}ms max={r['json_max_ms']}ms "
+            f"({r['json_requests']} reqs), excel mean={r['excel_mean_ms']}ms ({r['excel_reports']} files)"
+        )
+    if args.output:
+        Path(args.output).write_text(json.dumps({"benchmark": "excel_event_loop", "args": vars(args), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Direct report export (GET /reports/export) per format vs. the persisted excel mode.
+
+  persisted   write_workbook to a file on disk (what create-allocation-report?format=excel does
+              before the client's second request to /reports/download); first byte = file written
+  csv         export_stream("csv")      encoded on the loop, one chunk per report_export_chunk_rows
+  excel       export_stream("excel")    write-only openpyxl in the export pool, zip streamed out
+  parquet     export_stream("parquet")  one row group per chunk (skipped when pyarrow is missing)
+
+Time to first byte and total time are measured without tracing; peak memory (tracemalloc, all
+threads) is a separate run per format. No database needed:
+    python -m benchmarks.export_formats --rows 50000 --iterations 5 --output export_formats.json
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from app.services.excel_writer import write_workbook
+from app.services.report_export import ExportUnavailable, export_stream
+from benchmarks.excel_event_loop import make_rows
+from benchmarks.hierarchy_rollup import summarize
+
+
+async def drain(format, rows):
+    started = time.perf_counter()
+    first_byte = None
+    size = 0
+    async for chunk in export_stream(format, rows):
+        if first_byte is None:
+            first_byte = time.perf_counter() - started
+        size += len(chunk)
+    return first_byte * 1000, (time.perf_counter() - started) * 1000, size
+
+
+async def persist(rows, out_dir):
+    started = time.perf_counter()
+    path = Path(out_dir) / "report.xlsx"
+    await asyncio.get_running_loop().run_in_executor(None, write_workbook, path, rows, "Allocation Report")
+    elapsed = (time.perf_counter() - started) * 1000
+    size = path.stat().st_size
+    path.unlink()
+    return elapsed, elapsed, size
+
+
+async def peak_memory(run):
+    tracemalloc.start()
+    try:
+        await run()
+        return round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+    finally:
+        tracemalloc.stop()
+
+
+async def measure(run, iterations):
+    await run()  # warm up
+    ttfb, total = [], []
+    for _ in range(iterations):
+        first_byte, elapsed, size = await run()
+        ttfb.append(first_byte)
+        total.append(elapsed)
+    return {"ttfb": summarize(ttfb), "total": summarize(total), "bytes": size, "peak_mb": await peak_memory(run)}
+
+
+async def run(args):
+    rows = make_rows(args.rows)
+    results = {"benchmark": "export_formats", "rows": args.rows, "iterations": args.iterations, "formats": {}}
+    with tempfile.TemporaryDirectory() as out_dir:
+        results["formats"]["persisted_excel"] = await measure(lambda: persist(rows, out_dir), args.iterations)
+    for format in ("csv", "excel", "parquet"):
+        try:
+            results["formats"][format] = await measure(lambda: drain(format, rows), args.iterations)
+        except ExportUnavailable as e:
+            results["formats"][format] = {"skipped": str(e)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
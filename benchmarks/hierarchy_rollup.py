@@ -0,0 +1,74 @@
+"""
+Hierarchy report: one ROLLUP query vs. the per-level GROUP BY query run four times
+(sector, industry, igroup, isubgroup).
+
+Runs against the database configured in .env, for an existing user with holdings:
+    python -m benchmarks.hierarchy_rollup --user-id 1 --iterations 200 --output rollup.json
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from pathlib import Path
+
+from app.database import AsyncSessionLocal, engine
+from app.services import hierarchy_report
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "mean_ms": round(statistics.mean(ordered), 3),
+        "p50_ms": round(ordered[len(ordered) // 2], 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "min_ms": round(ordered[0], 3),
+    }
+
+
+async def run(args):
+    rollup, per_level, build = [], [], []
+    async with AsyncSessionLocal() as session:
+        # warm up connections / plans
+        await hierarchy_report.fetch_hierarchy_rows(session, args.user_id)
+        await hierarchy_report.get_per_level_reports(session, args.user_id)
+
+        for _ in range(args.iterations):
+            t0 = time.perf_counter()
+            rows = await hierarchy_report.fetch_hierarchy_rows(session, args.user_id)
+            t1 = time.perf_counter()
+            hierarchy_report.build_hierarchy(rows)
+            t2 = time.perf_counter()
+            await hierarchy_report.get_per_level_reports(session, args.user_id)
+            t3 = time.perf_counter()
+            rollup.append((t1 - t0) * 1000)
+            build.append((t2 - t1) * 1000)
+            per_level.append((t3 - t2) * 1000)
+    await engine.dispose()
+
+    return {
+        "benchmark": "hierarchy_rollup",
+        "user_id": args.user_id,
+        "iterations": args.iterations,
+        "rollup_rows": len(rows),
+        "rollup_query": summarize(rollup),
+        "rollup_tree_build": summarize(build),
+        "per_level_x4": summarize(per_level),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", type=int, required=True)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+End-to-end load test: seed users and holdings, then drive the API the way a client does.
+
+1. Seed (skip with --no-seed): instruments from data/Equity.csv through the normal metadata
+   refresh, then --users users (loadtest+<i>@example.com) with --holdings random holdings
+   each, written straight to the database. Seeding is idempotent for the same --seed.
+2. Drive: --concurrency virtual clients share the seeded users; each session runs
+   /login, /holdings/upload-holdings-json, /holdings/get-user-holdings and
+   /reports/create-allocation-report (format=json, then format=excel), --rounds times.
+3. Report throughput and p50/p95/p99 latency per endpoint, as JSON.
+
+By default the real app (app.main) runs in-process over httpx ASGITransport with its
+startup hooks; --base-url points the clients at a running server instead.
+
+    python -m benchmarks.load_test --users 200 --holdings 50 --concurrency 20 --rounds 3 --output load.json
+    python -m benchmarks.load_test --no-seed --users 200 --base-url http://127.0.0.1:8000 --output load.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import random
+import subprocess
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+from sqlalchemy import text
+
+from app import utils
+from app.database import AsyncSessionLocal, engine
+from app.services import sector_allocations, set_instruments_metadata
+from app.services.holdings_upsert import upsert_holdings
+from app.services.instrument_registry import instrument_registry
+from app.services.portfolio_version import bump_portfolio_version
+from benchmarks.excel_event_loop import percentile
+
+PASSWORD = "loadtest-password"
+
+UPSERT_USER = text("""
+    INSERT INTO users (email, password) VALUES (:email, :password)
+    ON CONFLICT (email) DO UPDATE SET password = EXCLUDED.password
+    RETURNING id
+""")
+
+ENDPOINTS = ["login", "upload_holdings", "get_holdings", "report_json", "report_excel"]
+
+
+def user_email(i: int) -> str:
+    return f"loadtest+{i}@example.com"
+
+
+def make_holdings(rng: random.Random, isins, count: int):
+    return [
+        {"isin_no": isin_no, "quantity": rng.randint(1, 500), "avg_price": round(rng.uniform(10, 5000), 2)}
+        for isin_no in rng.sample(isins, min(count, len(isins)))
+    ]
+
+
+async def seed(args):
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as session:
+        await set_instruments_metadata.set_instruments_metadata(session)
+        await instrument_registry.load(session)
+        isins = sorted(r.isin_no for r in instrument_registry.records())
+        rng = random.Random(args.seed)
+
+        # one bcrypt hash shared by every seeded user, hashing N times would dominate seeding
+        password_hash = utils.hash(PASSWORD)
+        user_ids = []
+        for i in range(args.users):
+            result = await session.execute(UPSERT_USER, {"email": user_email(i), "password": password_hash})
+            user_id = result.scalar_one()
+            user_ids.append(user_id)
+            await upsert_holdings(session, user_id, make_holdings(rng, isins, args.holdings))
+            await bump_portfolio_version(session, user_id)
+        await session.commit()
+        await sector_allocations.rebuild_sector_allocations(session, user_ids)
+
+    return {
+        "users": len(user_ids),
+        "holdings_per_user": args.holdings,
+        "instruments": len(isins),
+        "seed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }, isins
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+
+    async def timed(self, endpoint, request, expect=(200, 201)):
+        t0 = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError as e:
+            self.errors[endpoint] += 1
+            self.statuses[endpoint][type(e).__name__] += 1
+            return None
+        self.latencies[endpoint].append((time.perf_counter() - t0) * 1000)
+        self.statuses[endpoint][str(response.status_code)] += 1
+        if response.status_code not in expect:
+            self.errors[endpoint] += 1
+        return response
+
+    def summary(self, wall_seconds: float) -> dict:
+        out = {}
+        for endpoint in ENDPOINTS:
+            samples = self.latencies.get(endpoint, [])
+            out[endpoint] = {
+                "requests": len(samples),
+                "errors": self.errors.get(endpoint, 0),
+                "status_codes": dict(self.statuses.get(endpoint, {})),
+                "throughput_rps": round(len(samples) / wall_seconds, 2) if wall_seconds else 0.0,
+                "mean_ms": round(sum(samples) / len(samples), 2) if samples else 0.0,
+                "p50_ms": round(percentile(samples, 50), 2),
+                "p95_ms": round(percentile(samples, 95), 2),
+                "p99_ms": round(percentile(samples, 99), 2),
+                "max_ms": round(max(samples, default=0.0), 2),
+            }
+        return out
+
+
+async def user_session(client, recorder: Recorder, rng: random.Random, isins, user_index: int, holdings: int):
+    response = await recorder.timed("login", client.post("/login", data={"username": user_email(user_index), "password": PASSWORD}))
+    if response is None or response.status_code != 200:
+        return
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    await recorder.timed("upload_holdings", client.post("/holdings/upload-holdings-json", json=make_holdings(rng, isins, holdings), headers=headers))
+    await recorder.timed("get_holdings", client.get("/holdings/get-user-holdings", headers=headers))
+    await recorder.timed("report_json", client.get("/reports/create-allocation-report", params={"format": "json"}, headers=headers))
+    await recorder.timed("report_excel", client.get("/reports/create-allocation-report", params={"format": "excel"}, headers=headers))
+
+
+async def drive(args, isins) -> dict:
+    recorder = Recorder()
+    queue = asyncio.Queue()
+    for _ in range(args.rounds):
+        for i in range(args.users):
+            queue.put_nowait(i)
+
+    async with contextlib.AsyncExitStack() as stack:
+        if args.base_url:
+            transport, base_url = None, args.base_url
+        else:
+            from app.main import app
+            # ASGITransport doesn't send lifespan events, run startup/shutdown hooks ourselves
+            await stack.enter_async_context(app.router.lifespan_context(app))
+            transport, base_url = httpx.ASGITransport(app=app), "http://loadtest"
+        client = await stack.enter_async_context(httpx.AsyncClient(transport=transport, base_url=base_url, timeout=args.timeout))
+
+        async def worker(worker_id):
+            rng = random.Random(args.seed * 1000 + worker_id)
+            while True:
+                try:
+                    user_index = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await user_session(client, recorder, rng, isins, user_index, args.holdings)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(w) for w in range(args.concurrency)))
+        wall_seconds = time.perf_counter() - started
+
+    return {"wall_seconds": round(wall_seconds, 3), "sessions": args.users * args.rounds, "endpoints": recorder.summary(wall_seconds)}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+async def run(args):
+    seeding = None
+    if args.seed_only or not args.no_seed:
+        seeding, isins = await seed(args)
+    else:
+        async with AsyncSessionLocal() as session:
+            await instrument_registry.load(session)
+        isins = sorted(r.isin_no for r in instrument_registry.records())
+
+    results = None if args.seed_only else await drive(args, isins)
+    await engine.dispose()
+
+    return {
+        "benchmark": "load_test",
+        "revision": git_revision(),
+        "config": {
+            "users": args.users,
+            "holdings": args.holdings,
+            "concurrency": args.concurrency,
+            "rounds": args.rounds,
+            "seed": args.seed,
+            "target": args.base_url or "in-process",
+        },
+        "seeding": seeding,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--holdings", type=int, default=50, help="holdings per user")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=1, help="sessions per user")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-seed", action="store_true", help="reuse users seeded by an earlier run")
+    parser.add_argument("--seed-only", action="store_true")
+    parser.add_argument("--base-url", help="target a running server instead of the in-process app")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Rebalancing throughput: every user against one model portfolio in one
+rebalance_arrays call (per chunk of holdings rows, as /rebalance/batch does)
+vs. one call per user (what calling POST /rebalance for each user amounts to).
+Both produce the same quantity changes, which is checked.
+
+No database needed (synthetic holdings, category codes drawn directly):
+    python -m benchmarks.rebalance --users 5000 --holdings 30 --categories 25 --output rebalance.json
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from app.services.rebalance import rebalance_arrays
+from benchmarks.hierarchy_rollup import summarize
+
+
+def make_holdings(users, holdings, categories, seed=7):
+    rng = np.random.default_rng(seed)
+    n = users * holdings
+    user_ids = np.repeat(np.arange(users, dtype=np.int64), holdings)
+    category_codes = rng.integers(0, categories, n)
+    quantities = rng.integers(1, 500, n).astype(np.float64)
+    prices = rng.uniform(10, 5000, n)
+    return user_ids, category_codes, quantities, prices
+
+
+def batch(holdings, targets, tolerance_pp, chunk_rows):
+    user_ids, category_codes, quantities, prices = holdings
+    changes = []
+    # chunk on user boundaries, like the server-side cursor carry in rebalance_batch
+    bounds = np.flatnonzero(np.diff(user_ids)) + 1
+    start = 0
+    while start < len(user_ids):
+        i = np.searchsorted(bounds, start + chunk_rows)
+        end = bounds[i] if i < len(bounds) else len(user_ids)
+        unique_users, user_codes = np.unique(user_ids[start:end], return_inverse=True)
+        r = rebalance_arrays(user_codes, category_codes[start:end], quantities[start:end], prices[start:end],
+                             len(unique_users), targets, tolerance_pp)
+        changes.append(r["quantity_change"])
+        start = end
+    return np.concatenate(changes)
+
+
+def per_user(holdings, targets, tolerance_pp):
+    user_ids, category_codes, quantities, prices = holdings
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(user_ids)) + 1, [len(user_ids)]])
+    changes = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        r = rebalance_arrays(np.zeros(end - start, dtype=np.int64), category_codes[start:end], quantities[start:end],
+                             prices[start:end], 1, targets, tolerance_pp)
+        changes.append(r["quantity_change"])
+    return np.concatenate(changes)
+
+
+def time_it(fn, iterations, users):
+    fn()  # warm up
+    samples = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        out = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    stats = summarize(samples)
+    return {**stats, "users_per_second": round(users / (stats["p50_ms"] / 1000), 1)}, out
+
+
+def run(args):
+    holdings = make_holdings(args.users, args.holdings, args.categories)
+    targets = np.full(args.categories, 1.0 / (args.categories - 1))
+    targets[-1] = 0.0  # one category is sold out everywhere
+
+    batch_stats, batch_changes = time_it(lambda: batch(holdings, targets, args.tolerance_pp, args.chunk_rows), args.iterations, args.users)
+    per_user_stats, per_user_changes = time_it(lambda: per_user(holdings, targets, args.tolerance_pp), args.iterations, args.users)
+    return {
+        "benchmark": "rebalance",
+        "users": args.users,
+        "holdings_per_user": args.holdings,
+        "categories": args.categories,
+        "tolerance_pp": args.tolerance_pp,
+        "chunk_rows": args.chunk_rows,
+        "iterations": args.iterations,
+        "same_result": bool(np.array_equal(batch_changes, per_user_changes)),
+        "batch": batch_stats,
+        "per_user": per_user_stats,
+        "speedup": round(per_user_stats["p50_ms"] / batch_stats["p50_ms"], 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--holdings", type=int, default=30)
+    parser.add_argument("--categories", type=int, default=25)
+    parser.add_argument("--tolerance-pp", type=float, default=2.0)
+    parser.add_argument("--chunk-rows", type=int, default=50000)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run(args)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
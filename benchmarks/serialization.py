@@ -0,0 +1,95 @@
+"""
+Response serialization: the previous path vs. SQL-shaped rows encoded with
+app.services.serialization.dumps (orjson), plus the columnar layout.
+
+  allocation report  JSONResponse(stdlib json) on row dicts  vs  dumps(rows)  vs  dumps(to_columnar(rows))
+  holdings listing   HoldingResponse.model_validate per ORM row + response_model dump + stdlib json
+                     vs  shape_holdings(rows) + dumps  vs  columnar
+
+No database needed (synthetic rows, same shapes as the endpoints):
+    python -m benchmarks.serialization --rows 20000 --iterations 20 --output serialization.json
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from fastapi.responses import JSONResponse
+
+from app import schemas
+from app.services.holdings_listing import shape_holdings
+from app.services.serialization import dumps, to_columnar
+from benchmarks.excel_event_loop import make_rows
+from benchmarks.hierarchy_rollup import summarize
+
+
+def make_holding_rows(n):
+    return [
+        (f"INE{i:08d}0", 10 + i % 500, 100.0 + i * 0.37, f"Company {i}", f"Sector {i % 40}", f"SYM{i}")
+        for i in range(n)
+    ]
+
+
+def make_orm_holdings(rows):
+    return [
+        SimpleNamespace(
+            isin_no=isin_no, quantity=float(quantity), avg_price=avg_price,
+            instrument=SimpleNamespace(name=name, sector_name=sector_name, trading_symbol=trading_symbol),
+        )
+        for isin_no, quantity, avg_price, name, sector_name, trading_symbol in rows
+    ]
+
+
+def time_it(fn, iterations):
+    fn()  # warm up
+    samples = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        body = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return {**summarize(samples), "bytes": len(body)}
+
+
+def run(args):
+    report_rows = make_rows(args.rows)
+    holding_rows = make_holding_rows(args.rows)
+    orm_holdings = make_orm_holdings(holding_rows)
+
+    def holdings_previous():
+        model = schemas.HoldingsListResponse(holdings=[schemas.HoldingResponse.model_validate(h) for h in orm_holdings])
+        return JSONResponse(content=model.model_dump(mode="json", by_alias=False)).body
+
+    return {
+        "benchmark": "serialization",
+        "rows": args.rows,
+        "iterations": args.iterations,
+        "encoder": "orjson",
+        "allocation_report": {
+            "previous": time_it(lambda: JSONResponse(content={"user_id": 1, "report": report_rows}).body, args.iterations),
+            "fast_rows": time_it(lambda: dumps({"user_id": 1, "report": report_rows}), args.iterations),
+            "fast_columnar": time_it(lambda: dumps({"user_id": 1, "report": to_columnar(report_rows)}), args.iterations),
+        },
+        "holdings": {
+            "previous": time_it(holdings_previous, args.iterations),
+            "fast_rows": time_it(lambda: dumps({"holdings": shape_holdings(holding_rows), "next_cursor": None}), args.iterations),
+            "fast_columnar": time_it(lambda: dumps({"holdings": shape_holdings(holding_rows, "columnar"), "next_cursor": None}), args.iterations),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run(args)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Snapshot time series: decode packed sector/weight arrays into a weight matrix and
+compute drift/turnover for a year of daily snapshots, plus a single two-snapshot diff.
+
+No database needed (synthetic snapshots in the stored format):
+    python -m benchmarks.snapshot_diff --snapshots 365 --sectors 60 --iterations 50 --output snapshots.json
+"""
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+import time
+
+import numpy as np
+
+from app.services.snapshots import pack, weight_matrix, build_series
+from benchmarks.hierarchy_rollup import summarize
+
+
+def make_snapshots(n, sectors, seed=7):
+    rng = random.Random(seed)
+    started = datetime(2025, 1, 1)
+    out = []
+    for day in range(n):
+        held = sorted(rng.sample(range(1, sectors + 1), rng.randint(sectors // 2, sectors)))
+        raw = [rng.random() for _ in held]
+        total = sum(raw)
+        out.append(SimpleNamespace(
+            id=day + 1,
+            created_at=started + timedelta(days=day),
+            total_invested=1_000_000.0 + day,
+            sector_ids=pack(held, "i"),
+            weights=pack((w / total for w in raw), "f"),
+        ))
+    return out
+
+
+def run(args):
+    rows = make_snapshots(args.snapshots, args.sectors)
+    names = {i: f"Sector {i}" for i in range(1, args.sectors + 1)}
+    series, pair = [], []
+    for _ in range(args.iterations):
+        t0 = time.perf_counter()
+        matrix, columns = weight_matrix(rows)
+        build_series(rows, matrix, columns, names)
+        t1 = time.perf_counter()
+        matrix, _ = weight_matrix([rows[0], rows[-1]])
+        matrix[1] - matrix[0]
+        t2 = time.perf_counter()
+        series.append((t1 - t0) * 1000)
+        pair.append((t2 - t1) * 1000)
+
+    return {
+        "benchmark": "snapshot_diff",
+        "snapshots": args.snapshots,
+        "sectors": args.sectors,
+        "bytes_per_snapshot": round(sum(len(r.sector_ids) + len(r.weights) for r in rows) / len(rows), 1),
+        "series": summarize(series),
+        "pair_diff": summarize(pair),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--snapshots", type=int, default=365)
+    parser.add_argument("--sectors", type=int, default=60)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run(args)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
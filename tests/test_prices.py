@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from app.services.prices import PriceProvider, PriceProviderError, PriceService, StaticPriceProvider
+
+
+class SlowPriceProvider(PriceProvider):
+    """Holds every fetch until `release` is set."""
+    name = "slow"
+
+    def __init__(self, prices):
+        self.prices = prices
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.calls = 0
+
+    async def fetch(self, isins):
+        self.calls += 1
+        self.started.set()
+        await self.release.wait()
+        return {isin_no: self.prices[isin_no] for isin_no in isins if isin_no in self.prices}
+
+
+def make_service(provider):
+    return PriceService(provider, ttl_seconds=60, batch_size=500, max_concurrency=4)
+
+
+def test_fetched_prices_are_returned_and_cached():
+    async def run():
+        service = make_service(StaticPriceProvider({"INE002A01018": 2500.0, "INE009A01021": 1500.0}))
+        first = await service.get_prices(["INE002A01018", "INE009A01021", "INE467B01029"])
+        second = await service.get_prices(["INE002A01018"])
+        return service, first, second
+
+    service, first, second = asyncio.run(run())
+    assert first == {"INE002A01018": 2500.0, "INE009A01021": 1500.0, "INE467B01029": None}
+    assert second == {"INE002A01018": 2500.0}
+    assert (service.misses, service.hits, service.batches) == (3, 1, 1)
+    assert not service._inflight
+
+
+def test_concurrent_callers_share_one_fetch():
+    async def run():
+        provider = SlowPriceProvider({"INE002A01018": 2500.0})
+        service = make_service(provider)
+        first = asyncio.create_task(service.get_prices(["INE002A01018"]))
+        await provider.started.wait()
+        second = asyncio.create_task(service.get_prices(["INE002A01018"]))
+        await asyncio.sleep(0)
+        provider.release.set()
+        return provider, service, await first, await second
+
+    provider, service, first, second = asyncio.run(run())
+    assert first == second == {"INE002A01018": 2500.0}
+    assert provider.calls == 1
+    assert service.coalesced == 1
+
+
+def test_cancelled_fetch_releases_coalesced_callers():
+    async def run():
+        provider = SlowPriceProvider({"INE002A01018": 2500.0})
+        service = make_service(provider)
+        fetching = asyncio.create_task(service.get_prices(["INE002A01018"]))
+        await provider.started.wait()
+        waiter = asyncio.create_task(service.get_prices(["INE002A01018"]))
+        await asyncio.sleep(0)
+        fetching.cancel()
+        with pytest.raises(PriceProviderError, match="cancelled"):
+            await asyncio.wait_for(waiter, timeout=1)
+        return service
+
+    service = asyncio.run(run())
+    assert not service._inflight
@@ -0,0 +1,71 @@
+import numpy as np
+
+from app.services.rebalance import rebalance_arrays
+
+
+def rebalance_one(quantities, prices, targets, tolerance_pp, cash=0.0):
+    """One user holding one ISIN per category (row i is category i)."""
+    n = len(quantities)
+    return rebalance_arrays(np.zeros(n, dtype=np.int64), np.arange(n), np.array(quantities, dtype=np.float64),
+                            np.array(prices, dtype=np.float64), 1, np.array(targets), tolerance_pp, cash)
+
+
+def cash_after(r, cash=0.0):
+    return cash - r["traded"].sum()
+
+
+def test_buys_scaled_to_what_the_sells_raise():
+    # B is 4pp under and C 3pp over target; A is inside the band and stays put
+    r = rebalance_one([51, 46, 3], [1, 1, 1], [0.5, 0.5, 0.0], tolerance_pp=2)
+    assert np.allclose(r["trades"][0], [0, 3, -3])
+    assert r["quantity_change"].tolist() == [0, 3, -3]
+    assert cash_after(r) == 0
+
+
+def test_cash_is_invested_when_nothing_drifted():
+    r = rebalance_one([50, 50], [1, 1], [0.5, 0.5], tolerance_pp=2, cash=1000)
+    assert not r["out_of_band"].any()
+    assert np.allclose(r["trades"][0], [500, 500])
+    assert r["quantity_change"].tolist() == [500, 500]
+    assert cash_after(r, 1000) == 0
+
+
+def test_cash_tops_up_in_band_categories_after_out_of_band_buys():
+    # at the new total (110) A is already at target, so all of the cash goes to B
+    r = rebalance_one([55, 45], [1, 1], [0.5, 0.5], tolerance_pp=2, cash=10)
+    assert r["out_of_band"][0].tolist() == [True, True]
+    assert np.allclose(r["trades"][0], [0, 10])
+    assert cash_after(r, 10) == 0
+
+
+def test_sale_proceeds_go_to_categories_under_target():
+    # only C is out of band; what it raises goes to A and B pro rata to their shortfall
+    r = rebalance_one([40, 45, 15], [1, 1, 1], [0.41, 0.49, 0.10], tolerance_pp=2)
+    assert np.allclose(r["trades"][0], [1, 4, -5])
+    assert cash_after(r) == 0
+
+
+def test_whole_shares_stay_funded():
+    # sells round up and buys round down: 4 to sell at 3 a share sells 2 shares (6), 4 to buy at 0.5 buys 8
+    r = rebalance_one([8, 32], [3, 0.5], [0.5, 0.5], tolerance_pp=2)
+    assert r["quantity_change"].tolist() == [-2, 8]
+    assert cash_after(r) >= 0
+
+
+def test_batch_matches_one_user_at_a_time():
+    rng = np.random.default_rng(3)
+    users, rows, n = 20, 200, 5
+    user_codes = np.sort(rng.integers(0, users, rows))
+    categories = rng.integers(0, n, rows)
+    quantities = rng.integers(1, 100, rows).astype(np.float64)
+    prices = rng.uniform(1, 50, rows)
+    targets = np.array([0.3, 0.3, 0.2, 0.2, 0.0])
+
+    batch = rebalance_arrays(user_codes, categories, quantities, prices, users, targets, 2.0, cash=100.0)
+    for u in range(users):
+        rows_u = user_codes == u
+        one = rebalance_arrays(np.zeros(rows_u.sum(), dtype=np.int64), categories[rows_u], quantities[rows_u],
+                               prices[rows_u], 1, targets, 2.0, cash=100.0)
+        assert np.allclose(batch["trades"][u], one["trades"][0])
+        assert np.array_equal(batch["quantity_change"][rows_u], one["quantity_change"])
+        assert 100.0 - one["traded"].sum() >= -1e-9